@@ -1,15 +1,60 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import Optional, List
 from google import genai
 from google.genai import types
 from google.cloud import storage
 from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 import os
+import json
+import asyncio
+import base64
+import random
+from contextlib import asynccontextmanager
 from datetime import datetime
+from app.utils.sse import format_sse, SSE_HEADERS
+from app.utils.startup import StartupTracker, LazyClient, FAILED
+from app.services.write_behind import WriteBehindQueue
+from app.utils.npc_parser import extract_npc_name
+from app.services.lore_index import LoreIndex
+from app.services.lore_categories import (
+    increment_category, read_category_counts, rebuild_category_counts, valid_category
+)
+from app.rag.lore_vectors import LoreVectorIndex
+from app.services.context_cache import ContextBundleCache
+from app.rag.monster_table import monster_summary
+from app.rag.context_packer import pack_context, estimate_tokens
+from app.services.stat_engine import (
+    CLASSES, character_stat_block, creature_stat_block, monster_stat_block, parse_cr,
+    render_stat_block, stat_block_prompt
+)
+from app.services.jobs import JobQueue, InMemoryJobStore, FirestoreJobStore, JOB_SUCCEEDED, JOB_FAILED
+from app.services.chat_sessions import ChatSessionStore, valid_session_id
+from app.services.llm_scheduler import (
+    LLMScheduler, LLMBusy, INTERACTIVE, BATCH, BACKGROUND, is_rate_limited, used_tokens
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start job workers, then initialize the slower components in the background so
+    the instance can serve /health immediately; /ready reports when they are done"""
+    await job_queue.start()
+    init_task = asyncio.create_task(_initialize_components())
+    yield
+    init_task.cancel()
+    # Stop job workers and commit any queued Firestore writes before the instance stops
+    await job_queue.stop()
+    # Draining the queue commits batches and joins its thread; keep that off the event loop
+    await asyncio.to_thread(write_queue.stop)
+    lore_index.stop()
+    lore_vectors.stop()
 
 # Initialize FastAPI
-app = FastAPI(title="D&D DM Assistant API")
+app = FastAPI(title="D&D DM Assistant API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -24,21 +69,78 @@ app.add_middleware(
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "shattared-meridian-assistant")
 LOCATION = "us-central1"
 
+# Per-component init state and timings, reported by /ready
+startup = StartupTracker()
+
+# Clients are built on first use (or by the background warm-up in lifespan), not at import
 # Initialize GenAI client with Vertex AI mode (no API key needed in Cloud Shell)
-genai_client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
-db = firestore.Client(project=PROJECT_ID)
-storage_client = storage.Client(project=PROJECT_ID)
+genai_client = LazyClient("genai", lambda: genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION), startup)
+db = LazyClient("firestore", lambda: firestore.Client(project=PROJECT_ID), startup)
+storage_client = LazyClient("storage", lambda: storage.Client(project=PROJECT_ID), startup)
+
+# Firestore writes that don't need to block the response are batched in the background
+write_queue = WriteBehindQueue(
+    db,
+    max_batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+)
+
+# In-memory lore search index, built and kept current by a Firestore snapshot listener
+lore_index = LoreIndex()
+startup.register("lore_listeners")
+
+# Semantic lore search; entries are embedded on write, only when their content changes
+lore_vectors = LoreVectorIndex(db, genai_client)
+
+# Assembled NPC prompt context, reused across repeat generations in the same setting
+npc_context_cache = ContextBundleCache(ttl_seconds=float(os.getenv("NPC_CONTEXT_TTL_SECONDS", "900")))
+lore_index.add_listener(npc_context_cache.invalidate_lore)
+
+# Background jobs for long-running endpoints; JOB_STORE=memory keeps state in-process for local runs
+job_store = InMemoryJobStore() if os.getenv("JOB_STORE", "firestore") == "memory" else FirestoreJobStore(db)
+job_queue = JobQueue(job_store, concurrency=int(os.getenv("JOB_CONCURRENCY", "2")))
 
 MODEL_NAME = "publishers/google/models/gemini-2.5-flash"
 
+# Every model call goes through one scheduler: per-model concurrency and tokens-per-minute,
+# interactive requests ahead of batch and background work, 429 + Retry-After when saturated
+llm = LLMScheduler(
+    {MODEL_NAME: (int(os.getenv("LLM_CONCURRENCY", "8")), int(os.getenv("LLM_TOKENS_PER_MINUTE", "500000")))},
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "64")),
+    max_wait={
+        INTERACTIVE: float(os.getenv("LLM_INTERACTIVE_MAX_WAIT", "15")),
+        BATCH: float(os.getenv("LLM_BATCH_MAX_WAIT", "120"))
+    }
+)
+
 # Request/Response models
 class ChatRequest(BaseModel):
     message: str
     context_type: str = "general"
+    session_id: Optional[str] = None  # continue a server-side session instead of resending history
 
 class ChatResponse(BaseModel):
     response: str
     timestamp: str
+    session_id: Optional[str] = None
+
+class NPCSpec(BaseModel):
+    race: str = "random"
+    character_class: str = "random"
+    alignment: str = "random"
+    level: Optional[int] = None
+    cr: Optional[str] = None
+    npc_type: str = "character"
+    role: str = "neutral"
+    location_id: Optional[str] = None
+    faction_id: Optional[str] = None
+    size: str = "medium"  # creatures only; sets the hit die
+
+class BatchNPCRequest(BaseModel):
+    specs: Optional[List[NPCSpec]] = None  # one spec per NPC...
+    count: Optional[int] = None            # ...and/or `count` copies of `spec`
+    spec: Optional[NPCSpec] = None
+    concurrency: Optional[int] = None
 
 @app.get("/")
 async def root():
@@ -52,18 +154,115 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """
-    Main chat endpoint for DM assistance
-    """
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 until every component has finished initializing (or failed)"""
+    components = startup.report()
+    if not startup.is_ready():
+        status = "starting"
+    elif any(c['state'] == FAILED for c in components.values()):
+        status = "degraded"
+    else:
+        status = "ready"
+    body = {
+        "status": status,
+        "components": components,
+        "lore_index_ready": lore_index.ready.is_set()
+    }
+    return JSONResponse(body, status_code=503 if status == "starting" else 200)
+
+def _start_lore_listeners():
+    """Build the lore search index and subscribe to campaign_lore changes"""
+    lore_index.start(db.collection('campaign_lore'))
+    lore_vectors.start()
+
+async def _initialize_components():
+    """Warm up clients and load the rulebook index and Drive service in parallel threads"""
+    steps = {
+        "genai": genai_client.get,
+        "storage": storage_client.get,
+        "lore_listeners": lambda: startup.run("lore_listeners", _start_lore_listeners),
+        "rulebook_index": _init_rag_processor,
+        "drive": _init_drive_service
+    }
+    results = await asyncio.gather(*(asyncio.to_thread(step) for step in steps.values()),
+                                   return_exceptions=True)
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            print(f"Warning: {name} initialization failed: {result}")
+    print(f"Startup complete: {startup.report()}")
+
+# ============== MODEL CALL SCHEDULING ==============
+
+# Output tokens reserved for a call whose config doesn't cap them
+DEFAULT_OUTPUT_TOKENS = 1024
+
+def _request_tokens(contents, config) -> int:
+    """Tokens to reserve for a call (prompt estimate plus the output cap); settled from usage afterwards"""
+    texts = [part.text for content in contents for part in content.parts if part.text]
+    if config and config.system_instruction:
+        texts.append(str(config.system_instruction))
+    output = config.max_output_tokens if config and config.max_output_tokens else DEFAULT_OUTPUT_TOKENS
+    return sum(map(estimate_tokens, texts)) + output
+
+def _llm_busy(e: LLMBusy) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def _generate(contents, config, priority: int = INTERACTIVE):
+    """generate_content through the scheduler, without blocking the event loop while queued"""
+    try:
+        return await llm.acall(
+            MODEL_NAME,
+            lambda: genai_client.aio.models.generate_content(model=MODEL_NAME, contents=contents, config=config),
+            _request_tokens(contents, config),
+            priority
+        )
+    except LLMBusy as e:
+        raise _llm_busy(e)
+
+def _generate_sync(contents, config, priority: int = BACKGROUND):
+    """Blocking _generate for worker threads, jobs and background tasks"""
+    try:
+        return llm.call(
+            MODEL_NAME,
+            lambda: genai_client.models.generate_content(model=MODEL_NAME, contents=contents, config=config),
+            _request_tokens(contents, config),
+            priority
+        )
+    except LLMBusy as e:
+        raise _llm_busy(e)
+
+def _admit(contents, config, priority: int = INTERACTIVE):
+    """Refuse a streamed request up front, while a 429 can still be sent instead of a 200 stream"""
     try:
-        system_prompt = f"""You are an expert Dungeon Master assistant for Dungeons & Dragons 5th Edition.
+        llm.admit(MODEL_NAME, _request_tokens(contents, config), priority)
+    except LLMBusy as e:
+        raise _llm_busy(e)
+
+@app.get("/llm/scheduler")
+async def get_llm_scheduler_stats():
+    """Per-model slots, queue depth by priority, remaining per-minute budget and 429 counts"""
+    return llm.stats()
+
+def _build_chat_request(request: ChatRequest, session: dict = None):
+    """Build the Gemini contents and config for a DM chat message.
+
+    For a session, the rolling summary goes in the system instruction and the
+    window of recent turns precedes the question as conversation history.
+    """
+    system_prompt = f"""You are an expert Dungeon Master assistant for Dungeons & Dragons 5th Edition.
 Context Type: {request.context_type}
 
 Help the DM with creative storytelling, rule clarifications, NPC generation, 
 encounter balancing, and campaign management. Be concise but helpful."""
 
+    config = types.GenerateContentConfig(
+        temperature=1.0,
+        top_p=0.95,
+        max_output_tokens=4096
+    )
+    
+    if session is None:
         full_prompt = f"{system_prompt}\n\nDM Question: {request.message}"
         
         # Create content using the new SDK
@@ -73,39 +272,219 @@ encounter balancing, and campaign management. Be concise but helpful."""
                 parts=[types.Part.from_text(text=full_prompt)]
             )
         ]
-        
-        config = types.GenerateContentConfig(
-            temperature=1.0,
-            top_p=0.95,
-            max_output_tokens=4096
-        )
+        return contents, config
+    
+    summary, window = chat_sessions.prompt_context(session)
+    if summary:
+        system_prompt += f"\n\nSummary of the earlier conversation:\n{summary}"
+    config.system_instruction = system_prompt
+    
+    contents = []
+    for turn in window:
+        contents.append(types.Content(role="user", parts=[types.Part.from_text(text=turn['message'])]))
+        contents.append(types.Content(role="model", parts=[types.Part.from_text(text=turn['response'])]))
+    contents.append(types.Content(role="user", parts=[types.Part.from_text(text=request.message)]))
+    return contents, config
+
+def _save_chat_history(message: str, response_text: str, context_type: str):
+    """Queue a chat interaction for storage in Firestore"""
+    interaction_ref = db.collection('chat_history').document()
+    write_queue.enqueue(interaction_ref, {
+        'message': message,
+        'response': response_text,
+        'context_type': context_type,
+        'timestamp': datetime.utcnow()
+    })
+    return interaction_ref
+
+async def _stream_generation(contents, config, on_complete=None):
+    """Stream a Gemini generation as SSE chunk events, then a done event.
+    on_complete(response_text) is blocking work (Firestore writes) and runs in a worker thread."""
+    chunks = []
+    try:
+        # The slot is held until the stream ends; a throttled stream can't be retried once it has started
+        async with llm.aslot(MODEL_NAME, _request_tokens(contents, config)) as ticket:
+            stream = await genai_client.aio.models.generate_content_stream(
+                model=MODEL_NAME,
+                contents=contents,
+                config=config
+            )
+            async for chunk in stream:
+                ticket.used = used_tokens(chunk) or ticket.used
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield format_sse({"text": chunk.text}, event="chunk")
+    except LLMBusy as e:
+        yield format_sse({"error": str(e), "retry_after": e.retry_after}, event="error")
+        return
+    except Exception as e:
+        if is_rate_limited(e):
+            llm.throttled(MODEL_NAME)
+        print(f"Streaming generation error: {e}")
+        yield format_sse({"error": str(e)}, event="error")
+        return
+    
+    response_text = "".join(chunks)
+    if on_complete:
+        try:
+            await asyncio.to_thread(on_complete, response_text)
+        except Exception as e:
+            print(f"Error saving streamed response: {e}")
+    
+    yield format_sse({"timestamp": datetime.utcnow().isoformat()}, event="done")
+
+# ============== CHAT SESSIONS ==============
+
+# Recent turns kept verbatim in session prompts; older turns live on in the rolling summary
+CHAT_WINDOW_TURNS = int(os.getenv("CHAT_WINDOW_TURNS", "6"))
+CHAT_WINDOW_TOKENS = int(os.getenv("CHAT_WINDOW_TOKENS", "3000"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "600"))
+
+CHAT_SUMMARY_CONFIG = types.GenerateContentConfig(
+    temperature=0.2,
+    max_output_tokens=CHAT_SUMMARY_TOKENS
+)
+
+def _summarize_chat_turns(summary: str, turns: list) -> str:
+    """Fold turns that slid out of a session's window into its running summary"""
+    transcript = "\n\n".join(f"DM: {turn['message']}\nAssistant: {turn['response']}" for turn in turns)
+    prompt = f"""You keep a running summary of a conversation between a Dungeon Master and their assistant.
+
+Current summary:
+{summary or "(empty)"}
+
+New exchanges:
+{transcript}
+
+Rewrite the summary so it also covers the new exchanges. Keep names, campaign facts, decisions,
+rulings and open questions; drop pleasantries and anything already settled and irrelevant.
+Stay under {CHAT_SUMMARY_TOKENS * 3 // 4} words. Reply with the summary only."""
+    
+    response = _generate_sync([types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
+                              CHAT_SUMMARY_CONFIG)
+    return (response.text or summary).strip()
+
+chat_sessions = ChatSessionStore(db, _summarize_chat_turns,
+                                 window_turns=CHAT_WINDOW_TURNS, window_tokens=CHAT_WINDOW_TOKENS)
+
+async def _load_chat_session(request: ChatRequest):
+    """The stored session for a request (an empty one for a new id), or None for stateless chat"""
+    if request.session_id is None:
+        return None
+    if not valid_session_id(request.session_id):
+        raise HTTPException(status_code=400, detail="session_id may only contain letters, digits, '-' and '_'")
+    try:
+        return await asyncio.to_thread(chat_sessions.get_or_new, request.session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+def _fold_chat_session(session_id: str):
+    try:
+        chat_sessions.fold(session_id)
+    except Exception as e:
+        # The window stays capped regardless; the next turn retries the fold
+        print(f"Chat summary update failed for {session_id}: {e}")
+
+@app.post("/chat/sessions")
+async def create_chat_session(context_type: str = "general"):
+    """Start a server-side chat session; pass the returned session_id to /chat"""
+    try:
+        session_id = await asyncio.to_thread(chat_sessions.create, context_type)
+        return {"session_id": session_id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str):
+    """A session's rolling summary and the recent turns still in its window"""
+    try:
+        session = await asyncio.to_thread(chat_sessions.get, session_id) if valid_session_id(session_id) else None
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return {
+            "session_id": session_id,
+            "summary": session['summary'],
+            "recent": session['recent'],
+            "turn_count": session['turn_count'],
+            "context_type": session.get('context_type'),
+            "updated_at": session['updated_at'].isoformat()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    """Delete a session and its turn log"""
+    try:
+        deleted = valid_session_id(session_id) and await asyncio.to_thread(chat_sessions.delete, session_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return {"message": "Session deleted", "session_id": session_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
+    """
+    Main chat endpoint for DM assistance.
+    With a session_id the conversation is kept server-side: the prompt carries a
+    rolling summary plus the most recent turns, so only the new message is sent.
+    """
+    try:
+        session = await _load_chat_session(request)
+        contents, config = _build_chat_request(request, session)
         
         # Generate response
-        response = genai_client.models.generate_content(
-            model=MODEL_NAME,
-            contents=contents,
-            config=config
-        )
+        response = await _generate(contents, config)
         
         response_text = response.text
         
         # Store interaction in Firestore
-        interaction_ref = db.collection('chat_history').document()
-        interaction_ref.set({
-            'message': request.message,
-            'response': response_text,
-            'context_type': request.context_type,
-            'timestamp': datetime.utcnow()
-        })
+        if session is None:
+            _save_chat_history(request.message, response_text, request.context_type)
+        else:
+            await asyncio.to_thread(chat_sessions.append_turn, request.session_id, request.message,
+                                    response_text, request.context_type)
+            # Summarizing turns that slid out of the window waits until the response is sent
+            background_tasks.add_task(_fold_chat_session, request.session_id)
         
         return ChatResponse(
             response=response_text,
-            timestamp=datetime.utcnow().isoformat()
+            timestamp=datetime.utcnow().isoformat(),
+            session_id=request.session_id
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat that sends the response as server-sent events
+    """
+    session = await _load_chat_session(request)
+    contents, config = _build_chat_request(request, session)
+    _admit(contents, config)
+    
+    def save(response_text):
+        if session is None:
+            _save_chat_history(request.message, response_text, request.context_type)
+        else:
+            chat_sessions.append_turn(request.session_id, request.message, response_text, request.context_type)
+    
+    return StreamingResponse(
+        _stream_generation(contents, config, on_complete=save),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=BackgroundTask(_fold_chat_session, request.session_id) if session is not None else None
+    )
+
 @app.post("/generate-npc")
 async def generate_npc(
     race: str = "random",
@@ -137,17 +516,14 @@ stat block (simplified), and a quest they might offer. Format as structured text
             max_output_tokens=4096
         )
         
-        response = genai_client.models.generate_content(
-            model=MODEL_NAME,
-            contents=contents,
-            config=config
-        )
+        response = await _generate(contents, config)
         
         response_text = response.text
         
-        # Store NPC in Firestore
+        # Store NPC in Firestore (ID is allocated client-side, write is batched)
         npc_ref = db.collection('npcs').document()
-        npc_ref.set({
+        write_queue.enqueue(npc_ref, {
+            'name': extract_npc_name(response_text),
             'content': response_text,
             'race': race,
             'class': character_class,
@@ -160,88 +536,253 @@ stat block (simplified), and a quest they might offer. Format as structured text
             "id": npc_ref.id
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate-npc-enhanced")
-async def generate_npc_enhanced(
-    race: str = "random",
-    character_class: str = "random",
-    alignment: str = "random",
-    level: int = None,
-    cr: str = None,
-    npc_type: str = "character",  # "character" or "creature"
-    role: str = "neutral",  # ally, enemy, quest_giver, merchant, neutral
-    location_id: str = None,
-    faction_id: str = None
-):
-    """
-    Generate a detailed NPC with RAG-enhanced 2024 rules accuracy
-    and links to Campaign Lore
-    """
+def _lore_text(lore_id: str):
+    """Return (title, content) for a lore entry, from the in-memory index when possible"""
+    entry = lore_index.get(lore_id) if lore_index.ready.is_set() else None
+    if entry is None:
+        doc = db.collection('campaign_lore').document(lore_id).get()
+        if not doc.exists:
+            return None
+        entry = doc.to_dict()
+    return entry.get('title', 'Unknown'), entry.get('content', '')
+
+NPC_SIMILAR_CR_CREATURES = 3
+# Prompt budget for each rulebook excerpt section (race, class, creature reference)
+NPC_RULES_CONTEXT_TOKENS = int(os.getenv("NPC_RULES_CONTEXT_TOKENS", "250"))
+
+def _rules_excerpt(results, token_budget=NPC_RULES_CONTEXT_TOKENS) -> str:
+    """Merged, de-duplicated rulebook hits as "- " lines within the token budget"""
+    return pack_context(results, token_budget, formatter=lambda block: f"- {block['text']}")['text']
+
+def _assemble_npc_context(race, character_class, level, cr, npc_type, role, location_id, faction_id):
+    """Run the lore reads and rulebook lookups that feed an NPC generation prompt.
+    Lookups that fail are logged and left empty, and listed under 'failed_lookups'."""
+    lore_ids = set()
+    failed = []
+    
+    def lookup_failed(name, error):
+        failed.append(name)
+        print(f"NPC context: {name} lookup failed: {error}")
+    
+    # Fetch location from Campaign Lore if provided
+    location_info = ""
+    if location_id:
+        lore_ids.add(location_id)
+        try:
+            loc = _lore_text(location_id)
+            if loc:
+                location_info = f"\nLocation: {loc[0]}\nLocation Details: {loc[1]}"
+        except Exception as e:
+            lookup_failed("location", e)
+    
+    # Fetch faction from Campaign Lore if provided
+    faction_info = ""
+    if faction_id:
+        lore_ids.add(faction_id)
+        try:
+            fac = _lore_text(faction_id)
+            if fac:
+                faction_info = f"\nFaction: {fac[0]}\nFaction Details: {fac[1]}"
+        except Exception as e:
+            lookup_failed("faction", e)
+    
+    # Pull in other lore related to this NPC (semantic search, no collection scan)
+    related_lore = ""
     try:
-        # Fetch location from Campaign Lore if provided
-        location_info = ""
-        if location_id:
+        lore_query = " ".join(str(part) for part in [race, character_class, role.replace('_', ' '), npc_type]
+                              if part and part != "random")
+        lore_matches = lore_vectors.search(lore_query, n_results=3,
+                                           exclude_ids=[i for i in [location_id, faction_id] if i])
+        if lore_matches:
+            related_lore = "\n\nRelated Campaign Lore:\n"
+            for match in lore_matches:
+                lore_ids.add(match['id'])
+                entry = lore_index.get(match['id']) or {}
+                related_lore += f"- {match['title']}: {entry.get('content', '')[:500]}\n"
+    except Exception as e:
+        lookup_failed("related lore", e)
+    
+    # Different RAG searches based on NPC type
+    creature_stats = ""
+    race_rules = ""
+    class_rules = ""
+    
+    if npc_type == "creature":
+        # Parsed Monster Manual stat blocks: exact name and CR lookups, no embedding call.
+        # Falls back to vector search when the table hasn't been built or has no match.
+        monsters = rag_processor.monsters if rag_processor else None
+        monster = monsters.get(race) if monsters and race != "random" else None
+        if monster:
+            creature_stats = f"\n\nMonster Manual Reference:\n{monster['text']}\n"
+        elif race != "random" and rag_processor:
             try:
-                loc_doc = db.collection('campaign_lore').document(location_id).get()
-                if loc_doc.exists:
-                    loc_data = loc_doc.to_dict()
-                    location_info = f"\nLocation: {loc_data.get('title', 'Unknown')}\nLocation Details: {loc_data.get('content', '')}"
-            except:
-                pass
-        
-        # Fetch faction from Campaign Lore if provided
-        faction_info = ""
-        if faction_id:
+                creature_results = rag_processor.search(f"{race} monster stat block", n_results=3)
+                if creature_results:
+                    creature_stats = f"\n\nMonster Manual Reference:\n{_rules_excerpt(creature_results)}\n"
+            except Exception as e:
+                lookup_failed("creature reference", e)
+        
+        similar = []
+        if cr and monsters:
             try:
-                fac_doc = db.collection('campaign_lore').document(faction_id).get()
-                if fac_doc.exists:
-                    fac_data = fac_doc.to_dict()
-                    faction_info = f"\nFaction: {fac_data.get('title', 'Unknown')}\nFaction Details: {fac_data.get('content', '')}"
-            except:
+                similar = [m for m in monsters.by_cr(cr) if m is not monster]
+            except ValueError:
                 pass
+        if similar:
+            # Prefer creatures of the same type as the one being generated
+            words = set(str(race).lower().split())
+            similar.sort(key=lambda m: not words & set(m['type'].lower().split()))
+            creature_stats += "\n\nSimilar CR Creatures:\n"
+            for m in similar[:NPC_SIMILAR_CR_CREATURES]:
+                creature_stats += f"- {monster_summary(m)}\n"
+        elif cr and rag_processor and not monsters:
+            try:
+                cr_results = rag_processor.search(f"CR {cr} monster abilities actions", n_results=2)
+                if cr_results:
+                    creature_stats += f"\n\nSimilar CR Creatures:\n{_rules_excerpt(cr_results)}\n"
+            except Exception as e:
+                lookup_failed("similar CR creatures", e)
+    else:
+        # For characters, search PHB for race and class info
+        if race != "random" and rag_processor:
+            try:
+                race_results = rag_processor.search(f"{race} race traits features 2024", n_results=2)
+                if race_results:
+                    race_rules = f"\n\nRelevant Race Rules from 2024 PHB:\n{_rules_excerpt(race_results)}\n"
+            except Exception as e:
+                lookup_failed("race rules", e)
         
+        if character_class != "random" and rag_processor:
+            try:
+                level_text = f"level {level}" if level else ""
+                class_results = rag_processor.search(f"{character_class} class features {level_text} 2024", n_results=2)
+                if class_results:
+                    class_rules = f"\n\nRelevant Class Rules from 2024 PHB:\n{_rules_excerpt(class_results)}\n"
+            except Exception as e:
+                lookup_failed("class rules", e)
+    
+    return {
+        'location_info': location_info,
+        'faction_info': faction_info,
+        'related_lore': related_lore,
+        'creature_stats': creature_stats,
+        'race_rules': race_rules,
+        'class_rules': class_rules,
+        'lore_ids': lore_ids,
+        'failed_lookups': failed
+    }
+
+def _get_npc_context(race, character_class, level, cr, npc_type, role, location_id, faction_id):
+    """Return the assembled NPC context, reusing a cached bundle for repeat generations"""
+    # level/cr/role also shape the lookups, so they are part of the key
+    key = (location_id, faction_id, npc_type, race, character_class, level, cr, role)
+    index_version = rag_processor.get_index_version() if rag_processor else None
+    
+    bundle = npc_context_cache.get(key, index_version)
+    if bundle is None:
+        bundle = _assemble_npc_context(race, character_class, level, cr, npc_type, role, location_id, faction_id)
+        # A bundle missing context because a lookup failed is used once, not cached for the TTL
+        if not bundle['failed_lookups']:
+            npc_context_cache.put(key, bundle, bundle['lore_ids'], index_version)
+    return bundle
+
+def _npc_context_args(race, prompt_class, level, cr, npc_type, role, location_id, faction_id, stat_block):
+    """_get_npc_context arguments for the NPC as it will be written: the resolved class and
+    the stat block's level/CR rather than "random" and unset values"""
+    stats = stat_block or {}
+    return (race, prompt_class, stats.get('level', level), stats.get('cr', cr), npc_type,
+            role, location_id, faction_id)
+
+# Used when the request leaves level/CR unset, so the computed numbers have something to go on
+NPC_DEFAULT_LEVEL = 5
+NPC_DEFAULT_CR = "1"
+
+def _npc_stat_block(race, character_class, level, cr, npc_type, size="medium"):
+    """Compute the NPC's numbers locally; returns (class for the prompt, stat block or None).
+
+    A "random" class is picked here so the numbers and the narrative agree. Classes the
+    engine doesn't know (homebrew, multiclass names) leave the numbers to the model.
+    Raises ValueError for a CR that isn't on the DMG table.
+    """
+    if npc_type == "creature":
+        # A creature straight out of the Monster Manual keeps its published numbers
+        monster = rag_processor.monsters.get(race) if rag_processor and race != "random" else None
+        if monster and (not cr or parse_cr(cr) == parse_cr(monster['cr'])):
+            return character_class, monster_stat_block(monster)
+        return character_class, creature_stat_block(cr or NPC_DEFAULT_CR, size)
+    if not character_class or character_class.lower() == "random":
+        character_class = random.choice(list(CLASSES)).title()
+    try:
+        return character_class, character_stat_block(character_class, level or NPC_DEFAULT_LEVEL)
+    except ValueError:
+        return character_class, None
+
+def _numbered(sections):
+    return "\n\n".join(f"{i}. {section}" for i, section in enumerate(sections, 1))
+
+def _build_enhanced_npc_prompt(race, character_class, alignment, level, cr, npc_type, role, bundle,
+                               stat_block=None):
+    """Build the /generate-npc-enhanced prompt from the spec and its assembled context.
+
+    With a computed `stat_block` the model is given the final numbers and only asked
+    for the narrative, traits and actions; the stat block itself is added locally.
+    """
+    location_info = bundle['location_info']
+    faction_info = bundle['faction_info']
+    related_lore = bundle['related_lore']
+    creature_stats = bundle['creature_stats']
+    race_rules = bundle['race_rules']
+    class_rules = bundle['class_rules']
+    
+    role_descriptions = {
+        "ally": "This creature is a potential ally who can help the party.",
+        "enemy": "This creature is an antagonist or enemy with clear motivations for opposing the party.",
+        "quest_giver": "This creature offers quests and missions.",
+        "merchant": "This creature is a merchant or trader.",
+        "neutral": "This creature has its own agenda that may or may not align with the party."
+    }
+    role_context = role_descriptions.get(role, role_descriptions["neutral"])
+    
+    computed_stats = ""
+    if stat_block:
+        computed_stats = f"""
+**Computed Statistics (final; do not restate or change them):**
+{stat_block_prompt(stat_block)}
+Use exactly these numbers for attacks, spells and any other bonus you mention. The full stat block is added to your text automatically.
+"""
+    
+    if npc_type == "creature":
+        level_cr_text = f"Challenge Rating (CR): {stat_block['cr'] if stat_block else cr or 'appropriate for the creature'}"
+        # (section, computed by the stat engine)
+        sections = [
+            ("**Creature Name**", False),
+            ("**Size, Type, Alignment** (e.g., Medium undead, neutral evil)", False),
+            ("**Armor Class** (with armor type)", True),
+            ("**Hit Points** (with hit dice, e.g., 45 (6d10 + 12))", True),
+            ("**Speed** (walk, fly, swim, burrow, climb)", False),
+            ("**Ability Scores Table:**\n   STR | DEX | CON | INT | WIS | CHA\n   (scores with modifiers)", True),
+            ("**Saving Throws** (if proficient)", True),
+            ("**Skills** (if proficient)", False),
+            ("**Damage Resistances/Immunities**", False),
+            ("**Condition Immunities**", False),
+            ("**Senses** (darkvision, passive Perception, etc.)", False),
+            ("**Languages**", False),
+            ("**Challenge** (CR with XP)", True),
+            ("**Traits** (special abilities like Pack Tactics, Keen Senses)", False),
+            ("**Actions** (attacks with to-hit bonus and damage)", False),
+            ("**Reactions** (if any)", False),
+            ("**Legendary Actions** (if CR 10+)", False),
+            ("**Description** (appearance, behavior, habitat)", False),
+            ("**Tactics** (how it fights)", False),
+            ("**Plot Hooks** (ways to use in adventures)", False),
+        ]
         
-        # Different RAG searches based on NPC type
-        creature_stats = ""
-        race_rules = ""
-        class_rules = ""
-        
-        role_descriptions = {
-            "ally": "This creature is a potential ally who can help the party.",
-            "enemy": "This creature is an antagonist or enemy with clear motivations for opposing the party.",
-            "quest_giver": "This creature offers quests and missions.",
-            "merchant": "This creature is a merchant or trader.",
-            "neutral": "This creature has its own agenda that may or may not align with the party."
-        }
-        role_context = role_descriptions.get(role, role_descriptions["neutral"])
-        
-        if npc_type == "creature":
-            # For creatures, search Monster Manual for stat blocks
-            if race != "random" and rag_processor:
-                try:
-                    creature_results = rag_processor.search(f"{race} monster stat block", n_results=3)
-                    if creature_results:
-                        creature_stats = "\n\nMonster Manual Reference:\n"
-                        for r in creature_results:
-                            creature_stats += f"- {r.get('text', '')[:800]}...\n"
-                except:
-                    pass
-            
-            if cr and rag_processor:
-                try:
-                    cr_results = rag_processor.search(f"CR {cr} monster abilities actions", n_results=2)
-                    if cr_results:
-                        creature_stats += "\n\nSimilar CR Creatures:\n"
-                        for r in cr_results:
-                            creature_stats += f"- {r.get('text', '')[:500]}...\n"
-                except:
-                    pass
-            
-            level_cr_text = f"Challenge Rating (CR): {cr if cr else 'appropriate for the creature'}"
-            
-            prompt = f"""Generate a detailed D&D 5e CREATURE/MONSTER based on Monster Manual format.
+        prompt = f"""Generate a detailed D&D 5e CREATURE/MONSTER based on Monster Manual format.
 
 **Basic Information:**
 - Creature Type: {race}
@@ -253,80 +794,35 @@ async def generate_npc_enhanced(
 **Role Context:** {role_context}
 {location_info}
 {faction_info}
+{related_lore}
 {creature_stats}
-
+{computed_stats}
 **Generate a MONSTER STAT BLOCK in official D&D 5e Monster Manual format:**
 
-1. **Creature Name**
-
-2. **Size, Type, Alignment** (e.g., Medium undead, neutral evil)
-
-3. **Armor Class** (with armor type)
-
-4. **Hit Points** (with hit dice, e.g., 45 (6d10 + 12))
-
-5. **Speed** (walk, fly, swim, burrow, climb)
-
-6. **Ability Scores Table:**
-   STR | DEX | CON | INT | WIS | CHA
-   (scores with modifiers)
-
-7. **Saving Throws** (if proficient)
-
-8. **Skills** (if proficient)
-
-9. **Damage Resistances/Immunities**
-
-10. **Condition Immunities**
-
-11. **Senses** (darkvision, passive Perception, etc.)
-
-12. **Languages**
-
-13. **Challenge** (CR with XP)
-
-14. **Traits** (special abilities like Pack Tactics, Keen Senses)
-
-15. **Actions** (attacks with to-hit bonus and damage)
-
-16. **Reactions** (if any)
-
-17. **Legendary Actions** (if CR 10+)
-
-18. **Description** (appearance, behavior, habitat)
-
-19. **Tactics** (how it fights)
-
-20. **Plot Hooks** (ways to use in adventures)
+{_numbered(section for section, numeric in sections if not (numeric and stat_block))}
 
 Format as an official Monster Manual stat block."""
 
+    else:
+        level_cr_text = f"Level: {stat_block['level'] if stat_block else level or 'appropriate for the class'}"
+        
+        if stat_block:
+            stat_sections = """13. **Skills:** (proficient skills, using the computed proficiency bonus)
+14. **Abilities & Features:** (class features, racial traits from 2024 PHB)
+15. **Actions:** (attacks, spells, or special actions)
+16. **Roleplaying Tips:** (how to portray this NPC)
+17. **Plot Hooks:** (2-3 ways to involve this NPC in adventures)"""
         else:
-            # For characters, search PHB for race and class info
-            if race != "random" and rag_processor:
-                try:
-                    race_results = rag_processor.search(f"{race} race traits features 2024", n_results=2)
-                    if race_results:
-                        race_rules = "\n\nRelevant Race Rules from 2024 PHB:\n"
-                        for r in race_results:
-                            race_rules += f"- {r.get('text', '')[:500]}...\n"
-                except:
-                    pass
-            
-            if character_class != "random" and rag_processor:
-                try:
-                    level_text = f"level {level}" if level else ""
-                    class_results = rag_processor.search(f"{character_class} class features {level_text} 2024", n_results=2)
-                    if class_results:
-                        class_rules = "\n\nRelevant Class Rules from 2024 PHB:\n"
-                        for r in class_results:
-                            class_rules += f"- {r.get('text', '')[:500]}...\n"
-                except:
-                    pass
-            
-            level_cr_text = f"Level: {level if level else 'appropriate for the class'}"
-            
-            prompt = f"""Generate a detailed D&D 5e NPC using the 2024 rules with the following specifications:
+            stat_sections = """13. **Stat Block (Simplified):**
+    - STR, DEX, CON, INT, WIS, CHA scores
+    - Armor Class, Hit Points
+    - Key skills and saving throws
+14. **Abilities & Features:** (class features, racial traits from 2024 PHB)
+15. **Actions:** (attacks, spells, or special actions)
+16. **Roleplaying Tips:** (how to portray this NPC)
+17. **Plot Hooks:** (2-3 ways to involve this NPC in adventures)"""
+        
+        prompt = f"""Generate a detailed D&D 5e NPC using the 2024 rules with the following specifications:
 
 **Basic Information:**
 - Race: {race}
@@ -339,9 +835,10 @@ Format as an official Monster Manual stat block."""
 **Role Context:** {role_context}
 {location_info}
 {faction_info}
+{related_lore}
 {race_rules}
 {class_rules}
-
+{computed_stats}
 **Please generate the NPC with these sections:**
 
 1. **NPC Name:** (creative fantasy name appropriate for the race)
@@ -356,18 +853,69 @@ Format as an official Monster Manual stat block."""
 10. **Voice Suggestions:** (accent, speech patterns, mannerisms)
 11. **Personality Traits:** (3-4 distinct traits)
 12. **Background:** (history, motivations, goals)
-13. **Stat Block (Simplified):**
-    - STR, DEX, CON, INT, WIS, CHA scores
-    - Armor Class, Hit Points
-    - Key skills and saving throws
-14. **Abilities & Features:** (class features, racial traits from 2024 PHB)
-15. **Actions:** (attacks, spells, or special actions)
-16. **Roleplaying Tips:** (how to portray this NPC)
-17. **Plot Hooks:** (2-3 ways to involve this NPC in adventures)
+{stat_sections}
 
 Format the response with clear headers and organized sections."""
+    return prompt
+
+NPC_ENHANCED_CONFIG = types.GenerateContentConfig(
+    temperature=0.9,
+    top_p=0.95,
+    max_output_tokens=8192
+)
 
+def _with_stat_block(response_text: str, stat_block: dict) -> str:
+    """Put the computed stat block ahead of the narrative (first label wins when the text is parsed)"""
+    if not stat_block:
+        return response_text
+    return f"{render_stat_block(stat_block)}\n\n{response_text}"
+
+def _save_enhanced_npc(response_text: str, metadata: dict, stat_block: dict = None):
+    """Queue a generated NPC and its metadata for storage in Firestore"""
+    npc_ref = db.collection('npcs').document()
+    npc_data = {
+        'name': extract_npc_name(response_text),
+        'content': response_text,
+        **metadata,
+        'created_at': datetime.utcnow()
+    }
+    if stat_block:
+        npc_data['stat_block'] = stat_block
+    write_queue.enqueue(npc_ref, npc_data)
+    return npc_ref
 
+@app.post("/generate-npc-enhanced")
+async def generate_npc_enhanced(
+    race: str = "random",
+    character_class: str = "random",
+    alignment: str = "random",
+    level: int = None,
+    cr: str = None,
+    npc_type: str = "character",  # "character" or "creature"
+    role: str = "neutral",  # ally, enemy, quest_giver, merchant, neutral
+    location_id: str = None,
+    faction_id: str = None,
+    size: str = "medium"  # creatures only
+):
+    """
+    Generate a detailed NPC with RAG-enhanced 2024 rules accuracy
+    and links to Campaign Lore.
+    Numeric stats (abilities, AC, HP, saves, CR/XP) are computed locally;
+    the model writes the narrative, traits and actions around them.
+    """
+    try:
+        prompt_class, stat_block = _npc_stat_block(race, character_class, level, cr, npc_type, size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        # Firestore reads and the lore embedding block, so assemble the context in a worker thread
+        context_args = _npc_context_args(race, prompt_class, level, cr, npc_type, role,
+                                         location_id, faction_id, stat_block)
+        bundle = await asyncio.to_thread(_get_npc_context, *context_args)
+        prompt = _build_enhanced_npc_prompt(race, prompt_class, alignment, level, cr, npc_type, role, bundle,
+                                            stat_block)
+        
         contents = [
             types.Content(
                 role="user",
@@ -375,72 +923,219 @@ Format the response with clear headers and organized sections."""
             )
         ]
         
-        config = types.GenerateContentConfig(
-            temperature=0.9,
-            top_p=0.95,
-            max_output_tokens=8192
-        )
-        
-        response = genai_client.models.generate_content(
-            model=MODEL_NAME,
-            contents=contents,
-            config=config
-        )
-        
-        response_text = response.text
-        
-        # Store NPC in Firestore with all metadata
-        npc_ref = db.collection('npcs').document()
-        npc_data = {
-            'content': response_text,
-            'race': race,
-            'class': character_class,
-            'alignment': alignment,
-            'level': level,
-            'cr': cr,
-            'npc_type': npc_type,
-            'role': role,
-            'location_id': location_id,
-            'faction_id': faction_id,
-            'created_at': datetime.utcnow()
+        response = await _generate(contents, NPC_ENHANCED_CONFIG)
+        
+        response_text = _with_stat_block(response.text, stat_block)
+        
+        # Store NPC in Firestore with all metadata (ID is allocated client-side, write is batched)
+        metadata = {
+            "race": race,
+            "class": prompt_class,
+            "alignment": alignment,
+            "level": (stat_block or {}).get('level', level),
+            "cr": (stat_block or {}).get('cr', cr),
+            "npc_type": npc_type,
+            "role": role,
+            "location_id": location_id,
+            "faction_id": faction_id
         }
-        npc_ref.set(npc_data)
+        npc_ref = _save_enhanced_npc(response_text, metadata, stat_block)
         
         return {
             "npc": response_text,
             "id": npc_ref.id,
-            "metadata": {
-                "race": race,
-                "class": character_class,
-                "alignment": alignment,
-                "level": level,
-                "cr": cr,
-                "npc_type": npc_type,
-                "role": role,
-                "location_id": location_id,
-                "faction_id": faction_id
-            }
+            "metadata": metadata,
+            "stat_block": stat_block
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"NPC Generation Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+BATCH_NPC_MAX_COUNT = 50
+BATCH_NPC_MAX_CONCURRENCY = 20
+BATCH_NPC_CONCURRENCY = int(os.getenv("BATCH_NPC_CONCURRENCY", "5"))
+
+def _npc_spec_context_args(spec: NPCSpec, prompt_class: str, stat_block: dict):
+    return _npc_context_args(spec.race, prompt_class, spec.level, spec.cr, spec.npc_type,
+                             spec.role, spec.location_id, spec.faction_id, stat_block)
+
+@app.post("/generate-npcs-batch")
+async def generate_npcs_batch(request: BatchNPCRequest):
+    """
+    Generate many NPCs concurrently (bounded by `concurrency`) and stream each one
+    back as a server-sent event as soon as it completes.
+    Context for each distinct setting is assembled once and shared.
+    """
+    specs = list(request.specs or [])
+    if request.count:
+        specs += [request.spec or NPCSpec()] * request.count
+    if not specs:
+        raise HTTPException(status_code=400, detail="Provide specs or a count")
+    if len(specs) > BATCH_NPC_MAX_COUNT:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_NPC_MAX_COUNT} NPCs per batch")
+    
+    concurrency = max(1, min(request.concurrency or BATCH_NPC_CONCURRENCY, BATCH_NPC_MAX_CONCURRENCY))
+    
+    try:
+        stat_blocks = [_npc_stat_block(spec.race, spec.character_class, spec.level, spec.cr, spec.npc_type, spec.size)
+                       for spec in specs]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Fetch shared lore/rulebook context once per distinct setting
+    spec_context_args = [_npc_spec_context_args(spec, *stat_blocks[i]) for i, spec in enumerate(specs)]
+    context_keys = list(dict.fromkeys(spec_context_args))
+    try:
+        bundles = await asyncio.gather(*[asyncio.to_thread(_get_npc_context, *key) for key in context_keys])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    bundles = dict(zip(context_keys, bundles))
+    
+    # Generations queue behind interactive requests; refuse the batch outright if the queue is full
+    try:
+        llm.admit(MODEL_NAME, NPC_ENHANCED_CONFIG.max_output_tokens, BATCH)
+    except LLMBusy as e:
+        raise _llm_busy(e)
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def generate_one(index: int, spec: NPCSpec):
+        try:
+            prompt_class, stat_block = stat_blocks[index]
+            prompt = _build_enhanced_npc_prompt(spec.race, prompt_class, spec.alignment, spec.level,
+                                                spec.cr, spec.npc_type, spec.role,
+                                                bundles[spec_context_args[index]], stat_block)
+            contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
+            async with semaphore:
+                response = await _generate(contents, NPC_ENHANCED_CONFIG, BATCH)
+            
+            npc_text = _with_stat_block(response.text, stat_block)
+            metadata = {
+                "race": spec.race,
+                "class": prompt_class,
+                "alignment": spec.alignment,
+                "level": (stat_block or {}).get('level', spec.level),
+                "cr": (stat_block or {}).get('cr', spec.cr),
+                "npc_type": spec.npc_type,
+                "role": spec.role,
+                "location_id": spec.location_id,
+                "faction_id": spec.faction_id
+            }
+            # Batched into Firestore batch commits by the write-behind queue
+            npc_ref = _save_enhanced_npc(npc_text, metadata, stat_block)
+            return {"index": index, "id": npc_ref.id, "npc": npc_text, "metadata": metadata,
+                    "stat_block": stat_block}
+        except Exception as e:
+            print(f"Batch NPC {index} failed: {e}")
+            return {"index": index, "error": str(e)}
+    
+    async def events():
+        tasks = [asyncio.create_task(generate_one(i, spec)) for i, spec in enumerate(specs)]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if "error" in result:
+                    yield format_sse(result, event="error")
+                else:
+                    succeeded += 1
+                    yield format_sse(result, event="npc")
+            yield format_sse({"requested": len(specs), "succeeded": succeeded,
+                              "failed": len(specs) - succeeded}, event="done")
+        finally:
+            # Client went away: stop generations that haven't finished
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# Fields returned by GET /npcs?fields=summary (skips the large generated `content`)
+NPC_SUMMARY_FIELDS = ['name', 'race', 'class', 'role', 'npc_type', 'location_id', 'faction_id', 'created_at']
+NPC_MAX_PAGE_SIZE = 200
+# GET /npcs equality filters; each has its own composite index with created_at
+NPC_FILTER_FIELDS = ['npc_type', 'role', 'location_id', 'faction_id']
+
+def _encode_npc_cursor(npc: dict) -> str:
+    """Encode the (created_at, id) sort key of the last NPC on a page"""
+    created_at = npc.get('created_at')
+    payload = {
+        'created_at': created_at.isoformat() if created_at else None,
+        'id': npc['id']
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('utf-8')
+
+def _decode_npc_cursor(cursor: str) -> dict:
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    return {
+        'created_at': datetime.fromisoformat(payload['created_at']),
+        '__name__': payload['id']
+    }
+
 @app.get("/npcs")
-async def get_all_npcs():
-    """Get all saved NPCs"""
+async def get_all_npcs(
+    page_size: int = 50,
+    cursor: str = None,
+    fields: str = "full",  # "full" or "summary"
+    npc_type: str = None,
+    role: str = None,
+    location_id: str = None,
+    faction_id: str = None
+):
+    """
+    Get saved NPCs, newest first, one page at a time.
+    Pass the returned next_cursor back as `cursor` to fetch the following page.
+    Filters are backed by the composite indexes in firestore.indexes.json,
+    one (filter, created_at) index each, so only one filter applies per request.
+    """
     try:
-        npcs_ref = db.collection('npcs')
-        docs = npcs_ref.order_by('created_at', direction=firestore.Query.DESCENDING).stream()
+        page_size = max(1, min(page_size, NPC_MAX_PAGE_SIZE))
+        
+        filters = {
+            'npc_type': npc_type,
+            'role': role,
+            'location_id': location_id,
+            'faction_id': faction_id
+        }
+        filters = {field: value for field, value in filters.items() if value is not None}
+        if len(filters) > 1:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Filter by one of {', '.join(NPC_FILTER_FIELDS)} at a time, got {', '.join(filters)}"
+            )
+        
+        query = db.collection('npcs')
+        for field, value in filters.items():
+            query = query.where(filter=FieldFilter(field, '==', value))
+        
+        query = query.order_by('created_at', direction=firestore.Query.DESCENDING)
+        query = query.order_by('__name__', direction=firestore.Query.DESCENDING)
+        
+        if fields == "summary":
+            query = query.select(NPC_SUMMARY_FIELDS)
+        
+        if cursor:
+            try:
+                query = query.start_after(_decode_npc_cursor(cursor))
+            except (ValueError, KeyError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
         
         npcs = []
-        for doc in docs:
+        for doc in query.limit(page_size).stream():
             npc = doc.to_dict()
             npc['id'] = doc.id
             npcs.append(npc)
         
-        return {"npcs": npcs, "count": len(npcs)}
+        next_cursor = None
+        if len(npcs) == page_size:
+            next_cursor = _encode_npc_cursor(npcs[-1])
+        
+        return {"npcs": npcs, "count": len(npcs), "next_cursor": next_cursor}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -503,40 +1198,81 @@ async def get_campaign_lore():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/campaign/lore")
-async def add_campaign_lore(title: str, content: str, category: str = "general"):
+async def add_campaign_lore(background_tasks: BackgroundTasks, title: str, content: str, category: str = "general"):
     """
     Add new campaign lore entry
     """
+    if not valid_category(category):
+        raise HTTPException(status_code=400, detail="category must not be empty")
     try:
         lore_ref = db.collection('campaign_lore').document()
-        lore_ref.set({
+        batch = db.batch()
+        batch.set(lore_ref, {
             'title': title,
             'content': content,
             'category': category,
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow()
         })
+        increment_category(batch, db, category, 1)
+        batch.commit()
+        
+        background_tasks.add_task(lore_vectors.index_entry, lore_ref.id,
+                                  {'title': title, 'content': content, 'category': category})
         
         return {
             "message": "Lore entry added successfully",
             "id": lore_ref.id
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _update_lore_entry(lore_ref, update_data: dict):
+    """Update a lore entry and move its category count in one transaction, so concurrent
+    category changes can't both decrement the same old category.
+    Returns the entry as it was before the update, or None if it doesn't exist."""
+    @firestore.transactional
+    def update_in_transaction(transaction):
+        doc = lore_ref.get(transaction=transaction)
+        if not doc.exists:
+            return None
+        old_entry = doc.to_dict()
+        transaction.update(lore_ref, update_data)
+        category = update_data.get('category')
+        if category is not None and category != old_entry.get('category'):
+            increment_category(transaction, db, old_entry.get('category'), -1)
+            increment_category(transaction, db, category, 1)
+        return old_entry
+    
+    return update_in_transaction(db.transaction())
+
+def _delete_lore_entry(lore_ref) -> bool:
+    """Delete a lore entry and decrement its category once, even if deleted concurrently"""
+    @firestore.transactional
+    def delete_in_transaction(transaction):
+        doc = lore_ref.get(transaction=transaction)
+        if not doc.exists:
+            return False
+        increment_category(transaction, db, doc.to_dict().get('category'), -1)
+        transaction.delete(lore_ref)
+        return True
+    
+    return delete_in_transaction(db.transaction())
+
 @app.put("/campaign/lore/{lore_id}")
-async def update_campaign_lore(lore_id: str, title: str = None, content: str = None, category: str = None):
+async def update_campaign_lore(background_tasks: BackgroundTasks, lore_id: str, title: str = None,
+                               content: str = None, category: str = None):
     """
     Update an existing campaign lore entry
     """
+    if category is not None and not valid_category(category):
+        raise HTTPException(status_code=400, detail="category must not be empty")
     try:
         lore_ref = db.collection('campaign_lore').document(lore_id)
-        doc = lore_ref.get()
-        
-        if not doc.exists:
-            raise HTTPException(status_code=404, detail="Lore entry not found")
         
         update_data = {'updated_at': datetime.utcnow()}
         if title is not None:
@@ -546,7 +1282,13 @@ async def update_campaign_lore(lore_id: str, title: str = None, content: str = N
         if category is not None:
             update_data['category'] = category
         
-        lore_ref.update(update_data)
+        old_entry = _update_lore_entry(lore_ref, update_data)
+        if old_entry is None:
+            raise HTTPException(status_code=404, detail="Lore entry not found")
+        
+        # Re-embeds only if the title/content hash changed
+        updated_entry = {**old_entry, **update_data}
+        background_tasks.add_task(lore_vectors.index_entry, lore_id, updated_entry)
         
         return {"message": "Lore entry updated successfully", "id": lore_id}
         
@@ -556,18 +1298,17 @@ async def update_campaign_lore(lore_id: str, title: str = None, content: str = N
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/campaign/lore/{lore_id}")
-async def delete_campaign_lore(lore_id: str):
+async def delete_campaign_lore(background_tasks: BackgroundTasks, lore_id: str):
     """
     Delete a campaign lore entry
     """
     try:
         lore_ref = db.collection('campaign_lore').document(lore_id)
-        doc = lore_ref.get()
         
-        if not doc.exists:
+        if not _delete_lore_entry(lore_ref):
             raise HTTPException(status_code=404, detail="Lore entry not found")
         
-        lore_ref.delete()
+        background_tasks.add_task(lore_vectors.remove_entry, lore_id)
         
         return {"message": "Lore entry deleted successfully", "id": lore_id}
         
@@ -577,11 +1318,16 @@ async def delete_campaign_lore(lore_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/campaign/lore/search")
-async def search_campaign_lore(query: str, category: str = None):
+async def search_campaign_lore(query: str, category: str = None, limit: int = None):
     """
-    Search campaign lore entries by text or category
+    Search campaign lore entries by text or category.
+    Served from the in-memory lore index; falls back to scanning Firestore
+    only until the index has received its first snapshot.
     """
     try:
+        if lore_index.ready.is_set():
+            return lore_index.search(query, category=category, limit=limit)
+        
         lore_ref = db.collection('campaign_lore')
         docs = lore_ref.stream()
         
@@ -609,20 +1355,68 @@ async def search_campaign_lore(query: str, category: str = None):
 @app.get("/campaign/lore/categories")
 async def get_lore_categories():
     """
-    Get all unique categories from campaign lore
+    Get all lore categories with entry counts.
+    Served from the in-memory lore index when it is ready, otherwise from
+    the maintained aggregate document (one read).
     """
     try:
-        lore_ref = db.collection('campaign_lore')
-        docs = lore_ref.stream()
+        if lore_index.ready.is_set():
+            counts = lore_index.category_counts()
+        else:
+            counts = read_category_counts(db)
+            if counts is None:
+                counts = rebuild_category_counts(db)
         
-        categories = set()
-        for doc in docs:
-            entry = doc.to_dict()
-            if 'category' in entry:
-                categories.add(entry['category'])
+        return {"categories": list(counts.keys()), "counts": counts}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/campaign/lore/categories/rebuild")
+async def rebuild_lore_categories():
+    """
+    Repair job: recount categories from campaign_lore and rewrite the aggregate
+    """
+    try:
+        counts = rebuild_category_counts(db)
+        return {"message": "Lore category counts rebuilt", "counts": counts}
         
-        return {"categories": list(categories)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/campaign/lore/semantic-search")
+async def semantic_search_campaign_lore(query: str, n_results: int = 5, category: str = None):
+    """
+    Search campaign lore by meaning using the lore vector index
+    """
+    try:
+        # The query embedding is a blocking Vertex AI call
+        matches = await asyncio.to_thread(lore_vectors.search, query, n_results=n_results, category=category)
         
+        results = []
+        for match in matches:
+            entry = lore_index.get(match['id'])
+            if entry is None:
+                doc = db.collection('campaign_lore').document(match['id']).get()
+                if not doc.exists:
+                    continue
+                entry = doc.to_dict()
+                entry['id'] = doc.id
+            entry['similarity'] = match['similarity']
+            results.append(entry)
+        
+        return {"results": results, "count": len(results)}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/campaign/lore/semantic-search/reindex")
+async def reindex_campaign_lore():
+    """
+    Repair job: embed new or changed lore entries and drop orphaned embeddings
+    """
+    try:
+        return lore_vectors.reindex()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -654,12 +1448,26 @@ if __name__ == "__main__":
 # RAG Rulebook Search
 from app.rag.pdf_processor import PDFProcessor
 
-# Initialize RAG processor (add after other initializations)
-try:
-    rag_processor = PDFProcessor(PROJECT_ID)
-except Exception as e:
-    print(f"Warning: RAG processor initialization failed: {e}")
-    rag_processor = None
+# RAG processor is created (and the vector DB downloaded) in the background at startup;
+# until then endpoints see None and answer as if rulebooks were unavailable
+rag_processor = None
+startup.register("rulebook_index")
+
+def _init_rag_processor():
+    global rag_processor
+    rag_processor = startup.run(
+        "rulebook_index",
+        lambda: PDFProcessor(PROJECT_ID, client=genai_client, storage_client=storage_client)
+    )
+
+# Semantic cache for rules answers (skips retrieval + generation for repeat questions)
+from app.rag.answer_cache import SemanticAnswerCache
+
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+)
 
 @app.post("/search-rulebooks")
 async def search_rulebooks(query: str, n_results: int = 5):
@@ -679,6 +1487,50 @@ async def search_rulebooks(query: str, n_results: int = 5):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Retrieve more hits than fit, then let the packer merge, de-duplicate and fill the budget by score
+RULEBOOK_CANDIDATES = int(os.getenv("RULEBOOK_CANDIDATES", "8"))
+RULEBOOK_CONTEXT_TOKENS = int(os.getenv("RULEBOOK_CONTEXT_TOKENS", "700"))
+
+def _search_rulebook_context(query_embedding):
+    """Rulebook context for a question, packed into RULEBOOK_CONTEXT_TOKENS"""
+    results = []
+    if query_embedding:
+        results = rag_processor.search_by_embedding(query_embedding, n_results=RULEBOOK_CANDIDATES)
+    return pack_context(results, RULEBOOK_CONTEXT_TOKENS)
+
+def _build_rulebook_request(message: str, context_text: str):
+    """Build the Gemini contents and config for a rulebook-grounded question"""
+    system_prompt = f"""You are a D&D 5e rules expert. Use the following rulebook excerpts to answer the question accurately.
+
+Rulebook Context:
+{context_text}
+
+Question: {message}
+
+Provide a clear answer based on the rulebook information. Cite the source and page number."""
+
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=system_prompt)])]
+    
+    config = types.GenerateContentConfig(
+        temperature=0.3,
+        top_p=0.95,
+        max_output_tokens=2048
+    )
+    return contents, config
+
+def _lookup_rules_answer(message: str):
+    """Check the answer cache, returning (cached_answer, query_embedding, index_version)"""
+    index_version = rag_processor.get_index_version()
+    
+    cached = answer_cache.get(message, index_version)
+    if cached:
+        return cached, None, index_version
+    
+    query_embedding = rag_processor.get_embedding(message)
+    if query_embedding:
+        cached = answer_cache.lookup(query_embedding, index_version)
+    return cached, query_embedding, index_version
+
 @app.post("/chat-with-rulebooks")
 async def chat_with_rulebooks(message: str, context_type: str = "rules"):
     """Chat with rulebook context"""
@@ -686,75 +1538,164 @@ async def chat_with_rulebooks(message: str, context_type: str = "rules"):
         if not rag_processor:
             raise HTTPException(status_code=503, detail="Rulebook search not available")
         
+        cached, query_embedding, index_version = _lookup_rules_answer(message)
+        if cached:
+            return {
+                "response": cached['response'],
+                "sources": cached['sources'],
+                "timestamp": datetime.utcnow().isoformat(),
+                "cached": True
+            }
+        
         # Search rulebooks for relevant context
-        rulebook_results = rag_processor.search(message, n_results=3)
+        context = _search_rulebook_context(query_embedding)
+        rulebook_results = context['sources']
         
-        # Build prompt with rulebook context
-        context_text = "\n\n".join([
-            f"[{r['source']}, Page {r['page_number']}]: {r['text']}" 
-            for r in rulebook_results
-        ])
+        contents, config = _build_rulebook_request(message, context['text'])
         
-        system_prompt = f"""You are a D&D 5e rules expert. Use the following rulebook excerpts to answer the question accurately.
-
-Rulebook Context:
-{context_text}
-
-Question: {message}
-
-Provide a clear answer based on the rulebook information. Cite the source and page number."""
-
-        contents = [types.Content(role="user", parts=[types.Part.from_text(text=system_prompt)])]
+        response = await _generate(contents, config)
         
-        config = types.GenerateContentConfig(
-            temperature=0.3,
-            top_p=0.95,
-            max_output_tokens=2048
-        )
-        
-        response = genai_client.models.generate_content(
-            model=MODEL_NAME,
-            contents=contents,
-            config=config
-        )
+        answer_cache.store(message, query_embedding, index_version, response.text, rulebook_results)
         
         return {
             "response": response.text,
             "sources": rulebook_results,
-            "timestamp": datetime.utcnow().isoformat()
+            "context_tokens": context['tokens'],
+            "timestamp": datetime.utcnow().isoformat(),
+            "cached": False
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat-with-rulebooks/stream")
+async def chat_with_rulebooks_stream(message: str, context_type: str = "rules"):
+    """Streaming variant of /chat-with-rulebooks; sources are sent before the answer"""
+    if not rag_processor:
+        raise HTTPException(status_code=503, detail="Rulebook search not available")
+    
+    try:
+        cached, query_embedding, index_version = _lookup_rules_answer(message)
+        context = None
+        rulebook_results = cached['sources'] if cached else []
+        if not cached:
+            context = _search_rulebook_context(query_embedding)
+            rulebook_results = context['sources']
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if cached:
+        async def cached_events():
+            yield format_sse({"sources": rulebook_results, "cached": True}, event="sources")
+            yield format_sse({"text": cached['response']}, event="chunk")
+            yield format_sse({"timestamp": datetime.utcnow().isoformat()}, event="done")
+        
+        return StreamingResponse(cached_events(), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    contents, config = _build_rulebook_request(message, context['text'])
+    _admit(contents, config)
+    
+    def save(response_text):
+        answer_cache.store(message, query_embedding, index_version, response_text, rulebook_results)
+        _save_chat_history(message, response_text, context_type)
+    
+    async def events():
+        yield format_sse({"sources": rulebook_results, "cached": False,
+                          "context_tokens": context['tokens']}, event="sources")
+        async for event in _stream_generation(contents, config, on_complete=save):
+            yield event
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/chat-with-rulebooks/cache")
+async def get_answer_cache_stats():
+    """Report semantic answer cache size and hit rate"""
+    return answer_cache.stats()
+
+@app.delete("/chat-with-rulebooks/cache")
+async def clear_answer_cache():
+    """Drop all cached rules answers"""
+    answer_cache.clear()
+    return {"message": "Answer cache cleared"}
+
 # Import Google Drive service
 from app.services.google_drive_service import GoogleDriveService
 from app.utils.npc_parser import parse_npc_text
+from app.utils.npc_schema import DriveNPC, validate_npc_fields, parse_npc_json, repair_schema, to_template_data
 
-# Initialize Google Drive service (add after other initializations)
-try:
-    drive_service = GoogleDriveService(PROJECT_ID)
-except Exception as e:
-    print(f"Warning: Google Drive service initialization failed: {e}")
-    drive_service = None
+# Google Drive service is initialized in the background at startup
+drive_service = None
+startup.register("drive")
 
-@app.post("/generate-npc-to-drive")
-async def generate_npc_to_drive(
-    race: str = "random",
-    character_class: str = "random",
-    alignment: str = "random"
-):
-    """Generate an NPC and save it to Google Drive"""
-    try:
-        if not drive_service:
-            raise HTTPException(status_code=503, detail="Google Drive service not available")
-        
-        # Template and folder IDs
-        TEMPLATE_ID = "1mxeHjGBSAHXAWbj_hmSZr4ACiJBAszkExB9cIv37s2s"
-        FOLDER_ID = "1s9uJh8y864acY1yAv20ughDqwztq6ao3"
-        
-        # Generate NPC with structured output
-        prompt = f"""Generate a detailed D&D 5e NPC with these parameters:
+def _init_drive_service():
+    global drive_service
+    drive_service = startup.run("drive", lambda: GoogleDriveService(PROJECT_ID))
+
+# Template and folder IDs
+TEMPLATE_ID = "1mxeHjGBSAHXAWbj_hmSZr4ACiJBAszkExB9cIv37s2s"
+FOLDER_ID = "1s9uJh8y864acY1yAv20ughDqwztq6ao3"
+
+NPC_REPAIR_ATTEMPTS = 2
+
+def _generate_structured_npc(race: str, character_class: str, alignment: str, priority: int = BACKGROUND):
+    """Generate an NPC as JSON matching DriveNPC, re-requesting only fields that fail validation.
+    Returns the template data and the keys still missing after the repair attempts."""
+    prompt = f"""Generate a detailed D&D 5e NPC with these parameters:
+Race: {race}
+Class: {character_class}
+Alignment: {alignment}
+
+World placement, physical description and voice suggestions are 2-3 sentences each;
+the background is 2-3 paragraphs. Ability scores are between 8 and 18.
+Personality traits, abilities and actions are "Name: description" entries."""
+    
+    response = _generate_sync(
+        [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
+        types.GenerateContentConfig(
+            temperature=1.0,
+            top_p=0.95,
+            max_output_tokens=4096,
+            response_mime_type="application/json",
+            response_schema=DriveNPC
+        ),
+        priority
+    )
+    npc, missing = validate_npc_fields(parse_npc_json(response.text))
+    
+    for _ in range(NPC_REPAIR_ATTEMPTS):
+        if not missing:
+            break
+        print(f"Repairing NPC fields: {missing}")
+        repair_prompt = f"""Here is a partially generated D&D 5e NPC:
+{json.dumps(npc, indent=2)}
+
+Provide only these missing fields, consistent with the NPC above: {', '.join(missing)}."""
+        response = _generate_sync(
+            [types.Content(role="user", parts=[types.Part.from_text(text=repair_prompt)])],
+            types.GenerateContentConfig(
+                temperature=0.7,
+                max_output_tokens=2048,
+                response_mime_type="application/json",
+                response_schema=repair_schema(missing)
+            ),
+            priority
+        )
+        repaired, _ = validate_npc_fields(parse_npc_json(response.text))
+        npc.update({key: value for key, value in repaired.items() if key in missing})
+        missing = [key for key in missing if key not in npc]
+    
+    return to_template_data(npc), missing
+
+def _generate_npc_to_drive_sync(race: str, character_class: str, alignment: str,
+                                structured: bool = True, progress=None, priority: int = BACKGROUND):
+    """Generate an NPC, export it to a Google Doc and record it in Firestore (blocking).
+    structured=False uses the older free-text format parsed by parse_npc_text."""
+    progress = progress or (lambda percent, message=None: None)
+    
+    # Free-text format, used when structured output is turned off
+    prompt = f"""Generate a detailed D&D 5e NPC with these parameters:
 Race: {race}
 Class: {character_class}
 Alignment: {alignment}
@@ -799,6 +1740,10 @@ Actions:
 
 Use this EXACT format."""
 
+    if structured:
+        npc_data, missing = _generate_structured_npc(race, character_class, alignment, priority)
+        progress(40, "Generated NPC")
+    else:
         contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
         
         config = types.GenerateContentConfig(
@@ -807,60 +1752,157 @@ Use this EXACT format."""
             max_output_tokens=4096
         )
         
-        response = genai_client.models.generate_content(
-            model=MODEL_NAME,
-            contents=contents,
-            config=config
-        )
+        response = _generate_sync(contents, config, priority)
         
         npc_text = response.text
+        progress(40, "Generated NPC text")
         
         # Parse the generated NPC data
         npc_data = parse_npc_text(npc_text)
+        missing = None
+    
+    # Create document title
+    npc_name = npc_data.get('name', 'Unnamed NPC')
+    doc_title = f"{npc_name} - NPC"
+    
+    # Copy template
+    progress(50, "Creating Google Doc")
+    new_doc_id = drive_service.copy_template(TEMPLATE_ID, doc_title, FOLDER_ID)
+    
+    if not new_doc_id:
+        raise HTTPException(status_code=500, detail="Failed to create document")
+    
+    # Fill template
+    progress(70, "Filling template")
+    success = drive_service.fill_npc_template(new_doc_id, npc_data)
+    
+    if not success:
+        raise HTTPException(status_code=500, detail="Failed to fill template")
+    
+    # Get document URL
+    doc_url = drive_service.get_document_url(new_doc_id)
+    
+    # Store in Firestore
+    progress(90, "Saving NPC")
+    npc_ref = db.collection('npcs').document()
+    npc_ref.set({
+        'name': npc_name,
+        'race': race,
+        'class': character_class,
+        'alignment': alignment,
+        'google_doc_id': new_doc_id,
+        'google_doc_url': doc_url,
+        'created_at': datetime.utcnow()
+    })
+    
+    result = {
+        "npc_name": npc_name,
+        "google_doc_url": doc_url,
+        "firestore_id": npc_ref.id,
+        "message": "NPC created successfully in Google Drive!"
+    }
+    if missing:
+        result["missing_fields"] = missing
+    return result
+
+@app.post("/generate-npc-to-drive")
+async def generate_npc_to_drive(
+    race: str = "random",
+    character_class: str = "random",
+    alignment: str = "random",
+    structured: bool = True,
+    background: bool = False
+):
+    """
+    Generate an NPC and save it to Google Drive.
+    By default the NPC is requested as schema-constrained JSON and only invalid fields
+    are regenerated; structured=false uses the free-text format and parser instead.
+    With background=true the work runs as a job and a job id is returned to poll.
+    """
+    try:
+        if not drive_service:
+            raise HTTPException(status_code=503, detail="Google Drive service not available")
         
-        # Create document title
-        npc_name = npc_data.get('name', 'Unnamed NPC')
-        doc_title = f"{npc_name} - NPC"
-        
-        # Copy template
-        new_doc_id = drive_service.copy_template(TEMPLATE_ID, doc_title, FOLDER_ID)
-        
-        if not new_doc_id:
-            raise HTTPException(status_code=500, detail="Failed to create document")
-        
-        # Fill template
-        success = drive_service.fill_npc_template(new_doc_id, npc_data)
+        if background:
+            job = await job_queue.enqueue("generate-npc-to-drive", {
+                "race": race,
+                "character_class": character_class,
+                "alignment": alignment,
+                "structured": structured
+            })
+            return _job_accepted(job)
         
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to fill template")
+        # Queued model calls and the Drive API both block, so keep them off the event loop
+        return await asyncio.to_thread(_generate_npc_to_drive_sync, race, character_class, alignment,
+                                       structured, priority=INTERACTIVE)
         
-        # Get document URL
-        doc_url = drive_service.get_document_url(new_doc_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+
+class DriveExportRequest(BaseModel):
+    npc_ids: List[str]
+
+def _export_npcs_to_drive_sync(npc_ids: List[str], progress=None):
+    """Export saved NPCs to Google Docs with batched Drive/Docs calls (blocking)"""
+    progress = progress or (lambda percent, message=None: None)
+    
+    refs = [db.collection('npcs').document(npc_id) for npc_id in npc_ids]
+    docs = [doc for doc in db.get_all(refs) if doc.exists]
+    progress(10, f"Loaded {len(docs)} NPCs")
+    
+    npcs = []
+    for doc in docs:
+        npc = doc.to_dict()
+        npc_data = parse_npc_text(npc.get('content', ''))
+        npc_data.setdefault('name', npc.get('name') or 'Unnamed NPC')
+        npcs.append((f"{npc_data['name']} - NPC", npc_data))
+    
+    doc_ids = drive_service.export_npcs(TEMPLATE_ID, npcs, FOLDER_ID)
+    progress(80, "Exported to Google Drive")
+    
+    exported = []
+    failed = []
+    batch = db.batch()
+    for doc, doc_id in zip(docs, doc_ids):
+        if not doc_id:
+            failed.append(doc.id)
+            continue
+        doc_url = drive_service.get_document_url(doc_id)
+        batch.update(doc.reference, {'google_doc_id': doc_id, 'google_doc_url': doc_url})
+        exported.append({"id": doc.id, "google_doc_url": doc_url})
+    if exported:
+        batch.commit()
+    
+    missing = [npc_id for npc_id in npc_ids if npc_id not in {doc.id for doc in docs}]
+    return {"exported": exported, "failed": failed, "not_found": missing}
+
+@app.post("/npcs/export-to-drive")
+async def export_npcs_to_drive(request: DriveExportRequest, background: bool = False):
+    """
+    Export saved NPCs to Google Docs from the NPC template, batching the Drive
+    and Docs calls. With background=true the export runs as a job.
+    """
+    try:
+        if not drive_service:
+            raise HTTPException(status_code=503, detail="Google Drive service not available")
+        if len(request.npc_ids) > 500:
+            raise HTTPException(status_code=400, detail="At most 500 NPCs per export")
         
-        # Store in Firestore
-        npc_ref = db.collection('npcs').document()
-        npc_ref.set({
-            'name': npc_name,
-            'race': race,
-            'class': character_class,
-            'alignment': alignment,
-            'google_doc_id': new_doc_id,
-            'google_doc_url': doc_url,
-            'created_at': datetime.utcnow()
-        })
+        if background:
+            job = await job_queue.enqueue("export-npcs-to-drive", {"npc_ids": request.npc_ids})
+            return _job_accepted(job)
         
-        return {
-            "npc_name": npc_name,
-            "google_doc_url": doc_url,
-            "firestore_id": npc_ref.id,
-            "message": "NPC created successfully in Google Drive!"
-        }
+        return await asyncio.to_thread(_export_npcs_to_drive_sync, request.npc_ids)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-
-
 @app.post("/test-npc-generation")
 async def test_npc_generation(race: str = "elf", character_class: str = "wizard"):
     """Test NPC generation and return raw output"""
@@ -916,45 +1958,46 @@ Use this EXACT format. Do not add extra headers or sections."""
             max_output_tokens=4096
         )
         
-        response = genai_client.models.generate_content(
-            model=MODEL_NAME,
-            contents=contents,
-            config=config
-        )
+        response = await _generate(contents, config)
         
         return {"raw_output": response.text}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ============== MAP GENERATOR ==============
 
+from app.services.map_service import (
+    PIXELS_PER_SQUARE, IMAGE_FORMATS, PUBLIC_URL_BASE, IMAGEN_MODEL, BaseMapCache,
+    base_map_key, variant_name, map_bucket, object_exists, remember_object,
+    render_map_in_pool, upload_map_tiles_in_pool
+)
 
-@app.post("/generate-map")
-async def generate_map(
-    description: str,
-    rows: int = 20,
-    columns: int = 20,
-    style: str = "realistic top-down battle map",
-    show_grid: bool = True
-):
-    """Generate a battle map using Vertex AI Imagen with optional grid overlay"""
-    try:
-        from vertexai.preview.vision_models import ImageGenerationModel
-        from PIL import Image
-        import io
-        import base64
-        import uuid
-        from google.cloud import storage
-        
-        # Calculate image size based on grid (70 pixels per square - VTT standard)
-        PIXELS_PER_SQUARE = 70
-        width = columns * PIXELS_PER_SQUARE
-        height = rows * PIXELS_PER_SQUARE
-        
-        # Imagen generates fixed sizes, so we'll generate and resize
-        prompt = f"""Top-down fantasy battle map for D&D tabletop RPG, {style}, seamless texture, no grid lines, no axis lines, no borders.
+MAP_OUTPUTS = ["image", "tiles"]
+
+# Generated base images, reused for every grid size / format of the same prompt and style
+base_maps = BaseMapCache(max_entries=int(os.getenv("MAP_BASE_CACHE_ENTRIES", "16")))
+
+# Imagen quota is counted in images per minute rather than tokens
+llm.set_limits(IMAGEN_MODEL, int(os.getenv("IMAGEN_CONCURRENCY", "2")),
+               int(os.getenv("IMAGEN_IMAGES_PER_MINUTE", "20")))
+
+
+def _generate_map_sync(description: str, rows: int, columns: int, style: str, show_grid: bool,
+                       include_base64: bool = False, image_format: str = "png", output: str = "image",
+                       regenerate: bool = False, progress=None, priority: int = BACKGROUND):
+    """Generate (or reuse), grid and upload a battle map (blocking)"""
+    progress = progress or (lambda percent, message=None: None)
+    
+    # Calculate image size based on grid (70 pixels per square - VTT standard)
+    width = columns * PIXELS_PER_SQUARE
+    height = rows * PIXELS_PER_SQUARE
+    
+    # Imagen generates fixed sizes, so we'll generate and resize
+    prompt = f"""Top-down fantasy battle map for D&D tabletop RPG, {style}, seamless texture, no grid lines, no axis lines, no borders.
         
 Scene description: {description}
 
@@ -967,73 +2010,304 @@ Style requirements:
 - NO grid lines, squares, axis lines, rulers, coordinate markers, or borders in the image
 - Pure terrain and features only"""
 
+    bucket = map_bucket(storage_client)
+    base_key = base_map_key(prompt, style, IMAGEN_MODEL)
+    base = None if regenerate else base_maps.get(bucket, base_key)
+    cached = base is not None
+    
+    if base is None:
+        from vertexai.preview.vision_models import ImageGenerationModel
+        
+        progress(5, "Generating image")
+        
         # Generate image using Imagen
-        model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
-        
-        response = model.generate_images(
-            prompt=prompt,
-            number_of_images=1,
-            aspect_ratio="1:1",
-            safety_filter_level="block_few",
-            person_generation="dont_allow"
-        )
+        model = ImageGenerationModel.from_pretrained(IMAGEN_MODEL)
+        
+        try:
+            response = llm.call(IMAGEN_MODEL, lambda: model.generate_images(
+                prompt=prompt,
+                number_of_images=1,
+                aspect_ratio="1:1",
+                safety_filter_level="block_few",
+                person_generation="dont_allow"
+            ), 1, priority, usage=lambda response: None)
+        except LLMBusy as e:
+            raise _llm_busy(e)
+        
+        if not response.images:
+            return {"success": False, "error": "No image generated"}
         
-        if response.images:
-            # Get the generated image
-            generated_image = response.images[0]
-            image_bytes = generated_image._image_bytes
-            
-            # Open with PIL for processing
-            img = Image.open(io.BytesIO(image_bytes))
-            
-            # Resize to match grid dimensions
-            img = img.resize((width, height), Image.LANCZOS)
-            
-            # Draw grid if requested
-            if show_grid:
-                from PIL import ImageDraw
-                draw = ImageDraw.Draw(img)
-                
-                # Draw vertical lines
-                for x in range(0, width + 1, PIXELS_PER_SQUARE):
-                    draw.line([(x, 0), (x, height)], fill=(0, 0, 0, 128), width=1)
-                
-                # Draw horizontal lines
-                for y in range(0, height + 1, PIXELS_PER_SQUARE):
-                    draw.line([(0, y), (width, y)], fill=(0, 0, 0, 128), width=1)
-            
-            # Convert back to bytes
-            output_buffer = io.BytesIO()
-            img.save(output_buffer, format='PNG')
-            final_image_bytes = output_buffer.getvalue()
-            
-            # Convert to base64 for frontend
-            base64_image = base64.b64encode(final_image_bytes).decode('utf-8')
-            
-            # Save to Cloud Storage for persistence
-            storage_client = storage.Client()
-            bucket = storage_client.bucket("dnd-dm-assistant-web")
-            
-            # Generate unique filename
-            filename = f"maps/map_{uuid.uuid4().hex[:8]}.png"
-            blob = bucket.blob(filename)
-            blob.upload_from_string(final_image_bytes, content_type="image/png")
-            
-            # Bucket is already public
-            public_url = f"https://storage.googleapis.com/dnd-dm-assistant-web/{filename}"
-            
-            return {
-                "success": True,
-                "image_base64": base64_image,
-                "image_url": public_url,
-                "prompt_used": prompt,
-                "grid_size": f"{columns}x{rows}",
-                "dimensions": f"{width}x{height}",
-                "pixels_per_square": PIXELS_PER_SQUARE
-            }
+        # Keep the ungridded base so other grid sizes can be derived from it later
+        base = base_maps.put(bucket, base_key, response.images[0]._image_bytes)
+        progress(50, "Image generated")
+    else:
+        progress(50, "Reusing generated image")
+    
+    image_bytes, digest = base
+    variant = variant_name(digest, rows, columns, show_grid)
+    result = {
+        "success": True,
+        "cached": cached,
+        "base_id": base_key,
+        "prompt_used": prompt,
+        "grid_size": f"{columns}x{rows}",
+        "dimensions": f"{width}x{height}",
+        "pixels_per_square": PIXELS_PER_SQUARE
+    }
+    
+    progress(60, "Processing image")
+    
+    if output == "tiles":
+        # Deep-zoom pyramid instead of one full-size image
+        prefix = f"maps/tiles/{variant}_{image_format}"
+        if object_exists(bucket, f"{prefix}/manifest.json"):
+            result["tiles"] = json.loads(bucket.blob(f"{prefix}/manifest.json").download_as_bytes())
         else:
-            return {"success": False, "error": "No image generated"}
+            result["tiles"] = upload_map_tiles_in_pool(
+                bucket, prefix, image_bytes, rows, columns, show_grid, image_format,
+                progress=lambda percent, message=None: progress(60 + percent * 0.35, message)
+            )
+            remember_object(f"{prefix}/manifest.json")
+        return result
+    
+    # Rendered variants are content-addressed too, so an existing one is reused as is
+    filename = f"maps/{variant}.{image_format}"
+    if object_exists(bucket, filename):
+        final_image_bytes = bucket.blob(filename).download_as_bytes() if include_base64 else None
+    else:
+        # Resize, grid and encode on the map render pool
+        final_image_bytes = render_map_in_pool(image_bytes, rows, columns, show_grid, image_format)
+        
+        # Save to Cloud Storage for persistence
+        progress(85, "Uploading map")
+        bucket.blob(filename).upload_from_string(final_image_bytes, content_type=IMAGE_FORMATS[image_format])
+        remember_object(filename)
+    
+    # Bucket is already public
+    result["image_url"] = f"{PUBLIC_URL_BASE}/{filename}"
+    result["content_type"] = IMAGE_FORMATS[image_format]
+    if include_base64:
+        # Inline copy for clients that can't fetch image_url
+        result["image_base64"] = base64.b64encode(final_image_bytes).decode('utf-8')
+    return result
+
+@app.post("/generate-map")
+async def generate_map(
+    description: str,
+    rows: int = 20,
+    columns: int = 20,
+    style: str = "realistic top-down battle map",
+    show_grid: bool = True,
+    image_format: str = "png",
+    include_base64: bool = False,
+    output: str = "image",
+    regenerate: bool = False,
+    background: bool = False
+):
+    """
+    Generate a battle map using Vertex AI Imagen with optional grid overlay.
+    image_format is png or webp. The map is returned by image_url; include_base64=true
+    also inlines the image. output=tiles instead uploads a Deep Zoom tile pyramid
+    and returns its manifest under "tiles". Maps are cached by description and style,
+    so other grid sizes reuse the same image; regenerate=true asks Imagen for a new one.
+    With background=true the work runs as a job and a job id is returned to poll;
+    job results carry image_url only (no base64 payload).
+    """
+    try:
+        if image_format not in IMAGE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"image_format must be one of {list(IMAGE_FORMATS)}")
+        if output not in MAP_OUTPUTS:
+            raise HTTPException(status_code=400, detail=f"output must be one of {MAP_OUTPUTS}")
+        
+        if background:
+            job = await job_queue.enqueue("generate-map", {
+                "description": description,
+                "rows": rows,
+                "columns": columns,
+                "style": style,
+                "show_grid": show_grid,
+                "image_format": image_format,
+                "output": output,
+                "regenerate": regenerate
+            })
+            return _job_accepted(job)
+        
+        # Imagen call and rendering both block, so keep them off the event loop
+        return await asyncio.to_thread(
+            _generate_map_sync, description, rows, columns, style, show_grid,
+            include_base64=include_base64, image_format=image_format, output=output,
+            regenerate=regenerate, priority=INTERACTIVE
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Map generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============== ENCOUNTER BALANCING ==============
+
+from app.services.encounter import (
+    DEFAULT_PARTY_CLASSES, xp_budget, rate_encounter, character_combatant, creature_combatant,
+    simulate_combat
+)
+
+ENCOUNTER_MAX_TRIALS = 20000
+ENCOUNTER_MAX_COMBATANTS = 40
+# Attack rolls per simulated round across all trials; fewer trials are run for fights with many attacks
+ENCOUNTER_MAX_ROLLS_PER_ROUND = 400000
+
+class PartyMember(BaseModel):
+    level: int = Field(1, ge=1, le=20)
+    character_class: Optional[str] = None  # defaults cycle fighter, cleric, rogue, wizard
+
+class EncounterMonster(BaseModel):
+    name: Optional[str] = None   # looked up in the parsed Monster Manual table
+    cr: Optional[str] = None     # or built from the DMG targets for this CR
+    count: int = Field(1, ge=1, le=ENCOUNTER_MAX_COMBATANTS)
+    size: str = "medium"
+    # Manual stats; each one given overrides the looked-up/derived value
+    hit_points: Optional[int] = Field(None, ge=1, le=1000)
+    armor_class: Optional[int] = Field(None, ge=1, le=40)
+    attack_bonus: Optional[int] = Field(None, ge=-5, le=30)
+    attacks: Optional[int] = Field(None, ge=0, le=10)
+    damage_per_hit: Optional[float] = Field(None, ge=0, le=500)
+    xp: Optional[int] = Field(None, ge=0, le=1000000)
+
+class EncounterRequest(BaseModel):
+    party: Optional[List[PartyMember]] = Field(None, max_length=ENCOUNTER_MAX_COMBATANTS)
+    party_level: Optional[int] = Field(None, ge=1, le=20)  # shorthand for `party_size` members of one level
+    party_size: int = Field(4, ge=1, le=ENCOUNTER_MAX_COMBATANTS)
+    monsters: List[EncounterMonster] = Field(max_length=ENCOUNTER_MAX_COMBATANTS)
+    trials: int = 2000
+    seed: Optional[int] = None
+
+def _encounter_party(request: EncounterRequest) -> List[PartyMember]:
+    return request.party or [PartyMember(level=request.party_level or 1)] * request.party_size
+
+def _encounter_monster(spec: EncounterMonster) -> dict:
+    monster = None
+    if spec.name and rag_processor and rag_processor.monsters:
+        monster = rag_processor.monsters.get(spec.name)
+    if not monster and not spec.cr:
+        raise ValueError(f"Unknown monster {spec.name!r}: give a cr (and any stats) instead")
+    # A table hit keeps its Monster Manual name
+    overrides = spec.model_dump(exclude={'cr', 'count', 'size'} | ({'name'} if monster else set()),
+                                exclude_none=True)
+    return creature_combatant(cr=spec.cr, monster=monster, size=spec.size, **overrides)
+
+@app.get("/encounters/budget")
+async def encounter_budget(party_level: int = Query(ge=1, le=20),
+                           party_size: int = Query(4, ge=1, le=ENCOUNTER_MAX_COMBATANTS)):
+    """XP thresholds (easy/medium/hard/deadly) for a party of one level"""
+    return {"party_level": party_level, "party_size": party_size,
+            "budget": xp_budget([party_level] * party_size)}
+
+@app.post("/encounters/evaluate")
+async def evaluate_encounter(request: EncounterRequest):
+    """
+    Rate a proposed encounter without any model call: DMG XP budget and difficulty,
+    plus a Monte Carlo combat simulation (all trials batched as arrays) estimating
+    win rate, party wipes and how many characters go down.
+    Monsters come from the parsed Monster Manual table by name, or from a CR,
+    with any manually supplied stats taking precedence.
+    """
+    # Checked before any combatant is built, so a huge count is refused without the work
+    party_size = len(request.party) if request.party else request.party_size
+    if party_size + sum(spec.count for spec in request.monsters) > ENCOUNTER_MAX_COMBATANTS:
+        raise HTTPException(status_code=400, detail=f"At most {ENCOUNTER_MAX_COMBATANTS} combatants")
+    
+    try:
+        members = _encounter_party(request)
+        party = [character_combatant(member.character_class or DEFAULT_PARTY_CLASSES[i % len(DEFAULT_PARTY_CLASSES)],
+                                     member.level)
+                 for i, member in enumerate(members)]
+        monsters = []
+        for spec in request.monsters:
+            combatant = _encounter_monster(spec)
+            monsters += [combatant] * spec.count
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not party or not monsters:
+        raise HTTPException(status_code=400, detail="Provide at least one party member and one monster")
+    
+    attacks = sum(combatant['attacks'] for combatant in party + monsters)
+    trials = max(100, min(request.trials, ENCOUNTER_MAX_TRIALS, ENCOUNTER_MAX_ROLLS_PER_ROUND // max(1, attacks)))
+    simulation = await asyncio.to_thread(simulate_combat, party, monsters, trials, seed=request.seed)
+    
+    return {
+        **rate_encounter([member.level for member in members], [monster['xp'] for monster in monsters]),
+        "simulation": simulation,
+        "party": party,
+        "monsters": list({id(monster): monster for monster in monsters}.values())
+    }
+
+
+# ============== BACKGROUND JOBS ==============
+
+job_queue.register("generate-map", lambda params, progress: _generate_map_sync(
+    progress=progress, **params))
+job_queue.register("generate-npc-to-drive", lambda params, progress: _generate_npc_to_drive_sync(
+    progress=progress, **params))
+job_queue.register("export-npcs-to-drive", lambda params, progress: _export_npcs_to_drive_sync(
+    progress=progress, **params))
+
+def _job_accepted(job: dict) -> dict:
+    return {
+        "job_id": job['id'],
+        "status": job['status'],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events"
+    }
+
+def _job_view(job: dict) -> dict:
+    """Public fields of a job"""
+    return {
+        "job_id": job['id'],
+        "type": job['type'],
+        "status": job['status'],
+        "progress": job.get('progress', 0),
+        "message": job.get('message'),
+        "result": job.get('result'),
+        "error": job.get('error'),
+        "created_at": job['created_at'].isoformat(),
+        "updated_at": job['updated_at'].isoformat()
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll the status and result of a background job"""
+    try:
+        job = await job_queue.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return _job_view(job)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    """Stream job progress as server-sent events until the job finishes"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        current = job
+        last_sent = None
+        while True:
+            view = _job_view(current)
+            if view != last_sent:
+                yield format_sse(view, event="progress")
+                last_sent = view
+            if current['status'] in (JOB_SUCCEEDED, JOB_FAILED):
+                yield format_sse(view, event="done")
+                return
+            await job_queue.wait_for_update(job_id, timeout=2.0)
+            current = await job_queue.get(job_id)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,130 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """In-memory cache of rulebook answers keyed by query-embedding similarity.
+
+    Entries are tagged with the rulebook index version they were generated
+    against; a lookup with a different version drops the whole cache. Eviction
+    is least-recently-used once max_entries is reached, plus a per-entry TTL.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 500,
+                 ttl_seconds: float = 86400):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._index_version = None
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Normalize a question so trivially different phrasings share a key"""
+        return " ".join(re.findall(r"[a-z0-9]+", query.lower()))
+
+    def _check_version(self, index_version: str):
+        if index_version != self._index_version:
+            self._entries.clear()
+            self._matrix = None
+            self._index_version = index_version
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry['created_at'] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _hit(self, key: str) -> Dict:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        entry = self._entries[key]
+        return {'response': entry['response'], 'sources': entry['sources'], 'query': entry['query']}
+
+    def get(self, query: str, index_version: str) -> Optional[Dict]:
+        """Exact lookup on the normalized question text; needs no embedding call"""
+        with self._lock:
+            self._check_version(index_version)
+            self._expire()
+            key = self.normalize_query(query)
+            if key in self._entries:
+                return self._hit(key)
+            return None
+
+    def lookup(self, query_embedding: List[float], index_version: str) -> Optional[Dict]:
+        """Return the most similar cached answer above the threshold, if any"""
+        with self._lock:
+            self._check_version(index_version)
+            self._expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries.keys())
+                self._matrix = np.vstack([self._entries[k]['embedding'] for k in self._matrix_keys])
+
+            vector = _unit_vector(query_embedding)
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                return self._hit(self._matrix_keys[best])
+
+            self.misses += 1
+            return None
+
+    def store(self, query: str, query_embedding: List[float], index_version: str,
+              response: str, sources: List[Dict]):
+        """Cache an answer generated against the given index version"""
+        if query_embedding is None:
+            return
+        with self._lock:
+            self._check_version(index_version)
+            key = self.normalize_query(query)
+            self._entries[key] = {
+                'query': query,
+                'embedding': _unit_vector(query_embedding),
+                'response': response,
+                'sources': sources,
+                'created_at': time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'similarity_threshold': self.similarity_threshold,
+                'index_version': self._index_version,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+def _unit_vector(values: List[float]) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,164 @@
+import math
+import re
+from typing import Dict, List
+
+# Rough Gemini tokenization for English prose; good enough to budget prompt size without a count_tokens call
+CHARS_PER_TOKEN = 4
+
+# Overlap shorter than this between chunk edges is treated as coincidence
+MIN_OVERLAP = 20
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_WORDS = 5
+
+# A block that doesn't fit is only cut down if at least this much budget is left for it
+MIN_PARTIAL_TOKENS = 60
+
+_CHUNK_ID_RE = re.compile(r'_p(\d+)_c(\d+)$')
+_SENTENCE_END_RE = re.compile(r'[.!?]["\')\]]?\s')
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _chunk_index(result: Dict):
+    match = _CHUNK_ID_RE.search(result.get('id') or '')
+    return int(match.group(2)) if match else None
+
+
+def _merge_text(first: str, second: str) -> str:
+    """Join two chunks, dropping the text the second repeats from the end of the first"""
+    probe = second[:MIN_OVERLAP]
+    start = first.rfind(probe, max(0, len(first) - len(second) - MIN_OVERLAP))
+    while start != -1:
+        overlap = len(first) - start
+        if second.startswith(first[start:]):
+            return first + second[overlap:]
+        start = first.rfind(probe, 0, start)
+    if second in first:
+        return first
+    return f"{first} {second}"
+
+
+def _overlaps(first: str, second: str) -> bool:
+    probe = second[:MIN_OVERLAP]
+    return len(probe) == MIN_OVERLAP and probe in first[-(len(second) + MIN_OVERLAP):]
+
+
+def merge_chunks(results: List[Dict]) -> List[Dict]:
+    """Merge hits from the same page that overlap or are consecutive chunks into single blocks"""
+    pages = {}
+    seen = set()
+    for result in results:
+        key = result.get('id') or (result['source'], result['page_number'], result['text'])
+        if key in seen:
+            continue
+        seen.add(key)
+        pages.setdefault((result['source'], result['page_number']), []).append(result)
+
+    blocks = []
+    for (source, page_number), hits in pages.items():
+        hits.sort(key=lambda r: (_chunk_index(r) is None, _chunk_index(r) or 0))
+        block = None
+        for hit in hits:
+            index = _chunk_index(hit)
+            if block is not None and (
+                    (index is not None and block['last_index'] is not None and index == block['last_index'] + 1)
+                    or _overlaps(block['text'], hit['text'])):
+                block['text'] = _merge_text(block['text'], hit['text'])
+                block['similarity'] = max(block['similarity'], hit.get('similarity', 0))
+                block['chunk_ids'].append(hit.get('id'))
+                block['last_index'] = index
+                continue
+            block = {
+                'text': hit['text'],
+                'source': source,
+                'page_number': page_number,
+                'similarity': hit.get('similarity', 0),
+                'chunk_ids': [hit.get('id')],
+                'last_index': index
+            }
+            blocks.append(block)
+
+    for block in blocks:
+        del block['last_index']
+    return blocks
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def drop_near_duplicates(blocks: List[Dict], threshold: float = DUPLICATE_THRESHOLD) -> List[Dict]:
+    """Keep the best-scoring copy of text that appears (nearly) verbatim in several blocks.
+
+    Blocks are compared on 5-word shingles; one counts as a duplicate when it
+    shares `threshold` of its shingles with a block already kept (so text that
+    is contained in a longer block is dropped too).
+    """
+    kept = []
+    kept_shingles = []
+    for block in sorted(blocks, key=lambda b: b['similarity'], reverse=True):
+        shingles = _shingles(block['text'])
+        if any(len(shingles & other) >= threshold * len(shingles) for other in kept_shingles):
+            continue
+        kept.append(block)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut text to the token budget, at the last sentence end when there is one"""
+    cut = text[:max_tokens * CHARS_PER_TOKEN]
+    ends = [match.end() for match in _SENTENCE_END_RE.finditer(cut)]
+    if ends and ends[-1] > len(cut) // 2:
+        cut = cut[:ends[-1]]
+    return cut.rstrip() + " ..."
+
+
+def format_block(block: Dict) -> str:
+    return f"[{block['source']}, Page {block['page_number']}]: {block['text']}"
+
+
+def pack_context(results: List[Dict], token_budget: int, formatter=format_block) -> Dict:
+    """Pack search results into at most `token_budget` tokens of prompt context.
+
+    Overlapping and consecutive chunks from the same page are merged, near
+    duplicates dropped, and blocks added in order of similarity until the
+    budget is spent; the block that crosses the budget is cut at a sentence
+    boundary when enough room is left for it. Returns the context text, the
+    blocks used (as sources) and the estimated tokens.
+    """
+    merged = merge_chunks(results)
+    blocks = drop_near_duplicates(merged)
+    used = []
+    parts = []
+    tokens = 0
+    for block in blocks:
+        text = formatter(block)
+        cost = estimate_tokens(text) + 1
+        if tokens + cost > token_budget:
+            remaining = token_budget - tokens - 1
+            if remaining < MIN_PARTIAL_TOKENS:
+                continue
+            header = estimate_tokens(formatter({**block, 'text': ''}))
+            # One token is left for the " ..." marking the cut
+            block = {**block, 'text': _truncate(block['text'], remaining - header - 1), 'truncated': True}
+            text = formatter(block)
+            cost = estimate_tokens(text) + 1
+        parts.append(text)
+        used.append(block)
+        tokens += cost
+
+    return {
+        'text': "\n\n".join(parts),
+        'sources': used,
+        'tokens': tokens,
+        'token_budget': token_budget,
+        'candidates': len(results),
+        'duplicates': len(merged) - len(blocks),
+        'over_budget': len(blocks) - len(used)
+    }
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+MANIFEST_NAME = "manifest.json"
+
+# Blobs larger than one chunk are fetched as parallel ranged reads
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_WORKERS = 8
+
+
+class BlobCache:
+    """Local directory cache of Cloud Storage blobs, keyed by blob generation.
+
+    A manifest.json in the cache directory records the generation, MD5 and
+    size of every cached blob and when it was last checked against Cloud
+    Storage. Within `max_age` seconds of the last check the local copy is used
+    without any network call; after that a single metadata request decides
+    whether the blob has to be downloaded again. The directory can be baked
+    into the container image to make cold starts skip the download too.
+    """
+
+    def __init__(self, cache_dir: str, max_age: float = 3600,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = DEFAULT_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+
+    # ---- Manifest ----
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest: Dict):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _local_path(self, blob_name: str) -> str:
+        return os.path.join(self.cache_dir, blob_name.replace('/', '__'))
+
+    def _is_intact(self, entry: Optional[Dict], path: str) -> bool:
+        return bool(entry) and os.path.exists(path) and os.path.getsize(path) == entry['size']
+
+    # ---- Fetch ----
+
+    def fetch(self, bucket, blob_name: str) -> Optional[str]:
+        """Return a local path holding the current contents of the blob, or None if it doesn't exist"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = self._read_manifest()
+        entry = manifest.get(blob_name)
+        path = self._local_path(blob_name)
+        intact = self._is_intact(entry, path)
+
+        if intact and time.time() - entry.get('checked_at', 0) < self.max_age:
+            return path
+
+        try:
+            blob = bucket.get_blob(blob_name)
+        except Exception as e:
+            if intact:
+                print(f"Could not check {blob_name} in Cloud Storage ({e}); using cached copy")
+                return path
+            raise
+
+        if blob is None:
+            return path if intact else None
+
+        if not (intact and entry['generation'] == blob.generation):
+            self._download(blob, path)
+            entry = {
+                'generation': blob.generation,
+                'md5_hash': blob.md5_hash,
+                'size': blob.size
+            }
+        entry['checked_at'] = time.time()
+        manifest[blob_name] = entry
+        self._write_manifest(manifest)
+        return path
+
+    def _download(self, blob, path: str):
+        tmp_path = f"{path}.part"
+        started = time.perf_counter()
+        if blob.size > self.chunk_size:
+            self._download_ranges(blob, tmp_path)
+        else:
+            with open(tmp_path, 'wb') as f:
+                blob.download_to_file(f, if_generation_match=blob.generation)
+
+        if blob.md5_hash and _file_md5(tmp_path) != blob.md5_hash:
+            os.remove(tmp_path)
+            raise ValueError(f"MD5 mismatch downloading {blob.name}")
+        os.replace(tmp_path, path)
+
+        elapsed = time.perf_counter() - started
+        print(f"✓ Downloaded {blob.name} ({blob.size / 1024 / 1024:.1f} MB in {elapsed:.1f}s)")
+
+    def _download_ranges(self, blob, tmp_path: str):
+        """Fetch the blob as parallel ranged reads written in place into a preallocated file"""
+        with open(tmp_path, 'wb') as f:
+            f.truncate(blob.size)
+
+        fd = os.open(tmp_path, os.O_WRONLY)
+        try:
+            def fetch_range(start: int):
+                end = min(start + self.chunk_size, blob.size) - 1
+                # Ranged reads can't be checked per chunk; the whole file is verified afterwards
+                data = blob.download_as_bytes(start=start, end=end, checksum=None,
+                                              if_generation_match=blob.generation)
+                os.pwrite(fd, data, start)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(fetch_range, range(0, blob.size, self.chunk_size)))
+        finally:
+            os.close(fd)
+
+
+def _file_md5(path: str) -> str:
+    """Base64 MD5 of a file, in the format Cloud Storage reports as md5_hash"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return base64.b64encode(digest.digest()).decode('ascii')
@@ -0,0 +1,200 @@
+import hashlib
+import threading
+from typing import List, Dict
+
+import numpy as np
+
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDINGS_COLLECTION = "campaign_lore_embeddings"
+
+# Vertex AI accepts a limited number of inputs per embed_content request
+EMBED_BATCH_SIZE = 20
+
+
+def lore_text(entry: dict) -> str:
+    """The text that gets embedded for a lore entry"""
+    return f"{entry.get('title', '')}\n{entry.get('content', '')}"
+
+
+def content_hash(entry: dict) -> str:
+    return hashlib.sha256(lore_text(entry).encode('utf-8')).hexdigest()
+
+
+class LoreVectorIndex:
+    """Vector index over campaign lore, stored one document per entry in Firestore.
+
+    Entries are only re-embedded when the hash of their title and content
+    changes, so embedding cost follows edits rather than collection size.
+    The in-memory matrix is loaded once and kept current by an on_snapshot
+    listener on the embeddings collection.
+    """
+
+    def __init__(self, db, client):
+        self.db = db
+        self.client = client
+        self._vectors = {}  # lore_id -> {'embedding', 'content_hash', 'title', 'category'}
+        self._matrix = None
+        self._matrix_ids = []
+        self._lock = threading.RLock()
+        self._watch = None
+        self.ready = threading.Event()
+
+    # ---- Firestore listener ----
+
+    def start(self):
+        if self._watch is None:
+            self._watch = self.db.collection(EMBEDDINGS_COLLECTION).on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    self._vectors.pop(doc.id, None)
+                else:
+                    self._set_vector(doc.id, doc.to_dict())
+            self._matrix = None
+        self.ready.set()
+
+    def _set_vector(self, lore_id: str, data: dict):
+        vector = np.asarray(data['embedding'], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        self._vectors[lore_id] = {
+            'embedding': vector / norm if norm else vector,
+            'content_hash': data.get('content_hash'),
+            'title': data.get('title'),
+            'category': data.get('category')
+        }
+
+    # ---- Embedding on write ----
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            response = self.client.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=texts[start:start + EMBED_BATCH_SIZE]
+            )
+            embeddings.extend(e.values for e in response.embeddings)
+        return embeddings
+
+    def needs_embedding(self, lore_id: str, entry: dict) -> bool:
+        with self._lock:
+            existing = self._vectors.get(lore_id)
+        return existing is None or existing['content_hash'] != content_hash(entry)
+
+    def index_entries(self, entries: Dict[str, dict]) -> int:
+        """Embed the given {lore_id: entry} map, skipping entries whose content is unchanged"""
+        changed = {lore_id: entry for lore_id, entry in entries.items()
+                   if self.needs_embedding(lore_id, entry)}
+        if not changed:
+            return 0
+
+        ids = list(changed.keys())
+        embeddings = self._embed([lore_text(changed[lore_id]) for lore_id in ids])
+
+        batch = self.db.batch()
+        for count, (lore_id, embedding) in enumerate(zip(ids, embeddings), start=1):
+            entry = changed[lore_id]
+            data = {
+                'embedding': list(embedding),
+                'content_hash': content_hash(entry),
+                'title': entry.get('title'),
+                'category': entry.get('category')
+            }
+            batch.set(self.db.collection(EMBEDDINGS_COLLECTION).document(lore_id), data)
+            with self._lock:
+                self._set_vector(lore_id, data)
+                self._matrix = None
+            if count % 500 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        batch.commit()
+        return len(changed)
+
+    def index_entry(self, lore_id: str, entry: dict) -> bool:
+        """Embed one entry if its content changed; a category-only edit just updates metadata"""
+        try:
+            if self.index_entries({lore_id: entry}):
+                return True
+            with self._lock:
+                existing = self._vectors.get(lore_id)
+                stale = existing and (existing['category'], existing['title']) != (entry.get('category'), entry.get('title'))
+                if stale:
+                    existing['category'] = entry.get('category')
+                    existing['title'] = entry.get('title')
+            if stale:
+                self.db.collection(EMBEDDINGS_COLLECTION).document(lore_id).update({
+                    'category': entry.get('category'),
+                    'title': entry.get('title')
+                })
+            return False
+        except Exception as e:
+            print(f"Error embedding lore entry {lore_id}: {e}")
+            return False
+
+    def remove_entry(self, lore_id: str):
+        with self._lock:
+            self._vectors.pop(lore_id, None)
+            self._matrix = None
+        self.db.collection(EMBEDDINGS_COLLECTION).document(lore_id).delete()
+
+    def reindex(self) -> Dict:
+        """Repair job: embed new or changed lore entries and drop embeddings of deleted ones"""
+        entries = {doc.id: doc.to_dict() for doc in self.db.collection('campaign_lore').stream()}
+        embedded = self.index_entries(entries)
+
+        with self._lock:
+            orphaned = [lore_id for lore_id in self._vectors if lore_id not in entries]
+        for lore_id in orphaned:
+            self.remove_entry(lore_id)
+
+        return {'entries': len(entries), 'embedded': embedded, 'removed': len(orphaned)}
+
+    # ---- Queries ----
+
+    def search(self, query: str, n_results: int = 5, category: str = None,
+               exclude_ids: List[str] = None) -> List[Dict]:
+        """Return the lore entries most similar to the query"""
+        with self._lock:
+            if not self._vectors:
+                return []
+        query_vector = np.asarray(self._embed([query])[0], dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm:
+            query_vector = query_vector / norm
+
+        with self._lock:
+            if not self._vectors:
+                return []
+            if self._matrix is None:
+                self._matrix_ids = list(self._vectors.keys())
+                self._matrix = np.vstack([self._vectors[i]['embedding'] for i in self._matrix_ids])
+            scores = self._matrix @ query_vector
+            order = np.argsort(-scores)
+
+            exclude = set(exclude_ids or [])
+            results = []
+            for position in order:
+                lore_id = self._matrix_ids[position]
+                meta = self._vectors[lore_id]
+                if lore_id in exclude or (category and meta['category'] != category):
+                    continue
+                results.append({
+                    'id': lore_id,
+                    'title': meta['title'],
+                    'category': meta['category'],
+                    'similarity': float(scores[position])
+                })
+                if len(results) >= n_results:
+                    break
+            return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'ready': self.ready.is_set(), 'entries': len(self._vectors)}
@@ -0,0 +1,309 @@
+import json
+import os
+import re
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
+from typing import Dict, Iterable, List, Optional
+
+SIZES = ('Tiny', 'Small', 'Medium', 'Large', 'Huge', 'Gargantuan')
+
+# "Medium humanoid (goblinoid), neutral evil" starts a stat block, right under the name
+_TYPE_LINE_RE = re.compile(r'^(Tiny|Small|Medium|Large|Huge|Gargantuan)\b(?: or \w+)?\s+([^,]{3,60}),\s*(.{3,40})$',
+                           re.IGNORECASE)
+# 2014 ("Armor Class 15 (leather armor)") and 2024 ("AC 15  Initiative +2 (12)") layouts
+_AC_RE = re.compile(r'^(?:Armou?r Class|AC)\s+(\d+)\s*(?:\(([^)]*)\))?')
+_HP_RE = re.compile(r'^(?:Hit Points|HP)\s+(\d+)\s*(?:\(([^)]*)\))?')
+_CR_RE = re.compile(r'^(?:Challenge|CR)\s+(\d+(?:/\d+)?)\s*(?:\((?:XP\s*)?([\d,]+))?')
+# A challenge rating on its own: "5", "1/4" or "0.25", never negative
+_CR_TEXT_RE = re.compile(r'\d{1,3}(?:/\d{1,3}|\.\d{1,4})?')
+MAX_CR = 30
+# "8 (-1) 14 (+2) ..." under a STR DEX CON header, or "Str 8 -1 -1" rows in 2024 books
+_SCORE_RE = re.compile(r'(\d+)\s*\(\s*[+\-−–]?\s*\d+\s*\)')
+_SCORE_ROW_RE = re.compile(r'\b(Str|Dex|Con|Int|Wis|Cha)\s+(\d+)\s+[+\-−–]\d+', re.IGNORECASE)
+# "Scimitar. Melee Weapon Attack: ...", "Bite (Costs 2 Actions). ..." starts a trait or action entry
+_ENTRY_RE = re.compile(r"^([A-Z][\w'’ ,/+\-–()]{0,60}?)\.\s")
+_MINOR_WORDS = {'a', 'an', 'and', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'}
+# Lines of prose after a finished entry that mean the stat block is over (group lore, flavor text)
+MAX_PROSE_LINES = 5
+
+ABILITIES = ('str', 'dex', 'con', 'int', 'wis', 'cha')
+
+LINE_FIELDS = {
+    'Speed': 'speed',
+    'Saving Throws': 'saving_throws',
+    'Saves': 'saving_throws',
+    'Skills': 'skills',
+    'Damage Vulnerabilities': 'damage_vulnerabilities',
+    'Vulnerabilities': 'damage_vulnerabilities',
+    'Damage Resistances': 'damage_resistances',
+    'Resistances': 'damage_resistances',
+    'Damage Immunities': 'damage_immunities',
+    'Condition Immunities': 'condition_immunities',
+    'Immunities': 'damage_immunities',
+    'Senses': 'senses',
+    'Languages': 'languages',
+}
+
+SECTION_HEADERS = {
+    'TRAITS': 'traits',
+    'ACTIONS': 'actions',
+    'BONUS ACTIONS': 'bonus_actions',
+    'REACTIONS': 'reactions',
+    'LEGENDARY ACTIONS': 'legendary_actions',
+    'MYTHIC ACTIONS': 'mythic_actions',
+}
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+
+
+def _singular(key: str) -> str:
+    if key.endswith('ies'):
+        return key[:-3] + 'y'
+    if key.endswith(('ches', 'shes', 'sses', 'xes')):
+        return key[:-2]
+    if key.endswith('s') and not key.endswith('ss'):
+        return key[:-1]
+    return key
+
+
+def monster_aliases(name: str) -> List[str]:
+    """Lookup keys for a monster name: the name itself, without a parenthetical, and singular"""
+    keys = [normalize_name(name), normalize_name(re.sub(r'\(.*?\)', '', name))]
+    keys.append(_singular(keys[1]))
+    return [key for key in dict.fromkeys(keys) if key]
+
+
+def cr_fraction(cr) -> Fraction:
+    """Parse a challenge rating ('1/4', '0.25', 5); raises ValueError for anything that isn't one"""
+    text = str(cr).strip()
+    if not _CR_TEXT_RE.fullmatch(text):
+        raise ValueError(f"Invalid challenge rating: {cr}")
+    try:
+        value = Fraction(text)
+    except ZeroDivisionError:
+        raise ValueError(f"Invalid challenge rating: {cr}") from None
+    if value > MAX_CR:
+        raise ValueError(f"Challenge rating {cr} is above {MAX_CR}")
+    return value
+
+
+def cr_value(cr) -> float:
+    return float(cr_fraction(cr))
+
+
+def _title(line: str) -> str:
+    # Monster names are often set in capitals ("ADULT RED DRAGON")
+    return line.title() if line.isupper() else line
+
+
+def _ends_sentence(line: str) -> bool:
+    return line.rstrip('"\')’”').endswith(('.', '!', '?'))
+
+
+def _is_heading(line: str) -> bool:
+    """A short capitalized line with no closing punctuation: the next section of the book"""
+    words = line.split()
+    if not words or len(line) > 40 or line[-1] in '.,:;' or _ENTRY_RE.match(line + ' '):
+        return False
+    if line.isupper():
+        return True
+    return all(word[0].isupper() or word in _MINOR_WORDS for word in words if word[0].isalpha())
+
+
+def action_entries(text: str) -> List[tuple]:
+    """(name, text) of each "Name. ..." entry in a traits/actions section, wrapped lines joined.
+    Lines before the first entry (a section's introduction) are left out."""
+    entries = []
+    for line in (text or '').splitlines():
+        match = _ENTRY_RE.match(line)
+        if match:
+            entries.append([match.group(1), line])
+        elif entries:
+            entries[-1][1] += ' ' + line
+    return [tuple(entry) for entry in entries]
+
+
+def _source_lines(pages: List[Dict]) -> List[tuple]:
+    return [(page['page_number'], line.strip())
+            for page in pages for line in page['text'].splitlines()]
+
+
+def parse_stat_blocks(pages: List[Dict]) -> List[Dict]:
+    """Find and parse monster stat blocks in the pages of one rulebook.
+
+    `pages` are extract_text_from_pdf entries ({'page_number', 'text', 'source'}).
+    A stat block is a name line followed by a "Size type, alignment" line; it
+    runs until the next one, or until its trait and action entries give way to
+    a heading or a run of prose. Blocks without AC, HP and a challenge rating
+    are discarded, which filters out prose that happens to look like a type line.
+    """
+    if not pages:
+        return []
+    source = pages[0]['source']
+    lines = _source_lines(pages)
+    starts = [i for i in range(1, len(lines)) if _TYPE_LINE_RE.match(lines[i][1])
+              and lines[i - 1][1] and len(lines[i - 1][1]) <= 60]
+
+    monsters = []
+    for n, start in enumerate(starts):
+        end = starts[n + 1] - 1 if n + 1 < len(starts) else len(lines)
+        monster = _parse_block(lines[start - 1:end])
+        if monster:
+            monster['source'] = source
+            monsters.append(monster)
+    return monsters
+
+
+def _parse_block(block: List[tuple]) -> Optional[Dict]:
+    (page_number, name), (_, type_line) = block[0], block[1]
+    size, creature_type, alignment = _TYPE_LINE_RE.match(type_line).groups()
+    monster = {
+        'name': _title(name),
+        'size': size.title(),
+        'type': creature_type.strip(),
+        'alignment': alignment.strip(),
+        'page_number': page_number,
+        'abilities': {}
+    }
+    sections = {}
+    section = None
+    last_field = None
+    score_text = None  # ability score numbers collected after a STR DEX CON header
+    previous = type_line
+    prose_start = None  # where a run of non-entry lines after a finished sentence began
+    end = len(block)
+
+    for position, (_, line) in enumerate(block[2:], start=2):
+        if not line:
+            continue
+        line_before, previous = previous, line
+
+        if score_text is not None:
+            score_text += ' ' + line
+            scores = _SCORE_RE.findall(score_text)
+            if len(scores) >= 6:
+                monster['abilities'] = dict(zip(ABILITIES, map(int, scores[:6])))
+                score_text = None
+            continue
+
+        header = SECTION_HEADERS.get(line.upper().rstrip(':'))
+        if header:
+            section = header
+            sections.setdefault(section, [])
+            prose_start = None
+            continue
+        if section:
+            if _ENTRY_RE.match(line):
+                prose_start = None
+            elif _ends_sentence(line_before) and _is_heading(line):
+                end = position
+                break
+            elif prose_start is None and _ends_sentence(line_before):
+                prose_start = (section, len(sections[section]), position, 1)
+            elif prose_start is not None:
+                prose_start = prose_start[:3] + (prose_start[3] + 1,)
+                if prose_start[3] > MAX_PROSE_LINES:
+                    # The entries ended where this run of prose began
+                    prose_section, kept, end, _ = prose_start
+                    del sections[prose_section][kept:]
+                    break
+            sections[section].append(line)
+            continue
+
+        ac, hp, cr = _AC_RE.match(line), _HP_RE.match(line), _CR_RE.match(line)
+        if ac:
+            monster['armor_class'] = int(ac.group(1))
+            monster['armor'] = ac.group(2)
+        elif hp:
+            monster['hit_points'] = int(hp.group(1))
+            monster['hit_dice'] = hp.group(2)
+        elif cr:
+            try:
+                monster['cr_value'] = cr_value(cr.group(1))
+            except ValueError:
+                # Garbled by the PDF extraction ("1/0"); the block is dropped without a CR
+                continue
+            monster['cr'] = cr.group(1)
+            if cr.group(2):
+                monster['xp'] = int(cr.group(2).replace(',', ''))
+            # Anything before the first section header after the CR line is a trait
+            section = 'traits'
+            sections.setdefault(section, [])
+        elif line.upper().split() == ['STR', 'DEX', 'CON', 'INT', 'WIS', 'CHA']:
+            score_text = ''
+        elif _SCORE_ROW_RE.search(line):
+            for ability, score in _SCORE_ROW_RE.findall(line):
+                monster['abilities'][ability.lower()] = int(score)
+        else:
+            label = next((label for label in LINE_FIELDS if line.startswith(label + ' ')), None)
+            if label:
+                last_field = LINE_FIELDS[label]
+                monster[last_field] = line[len(label):].strip()
+            elif last_field:
+                # Wrapped continuation of the previous field
+                monster[last_field] += ' ' + line
+
+    if not all(key in monster for key in ('armor_class', 'hit_points', 'cr')):
+        return None
+    for key, section_lines in sections.items():
+        if section_lines:
+            monster[key] = '\n'.join(section_lines)
+    monster['text'] = '\n'.join(line for _, line in block[:end] if line)
+    return monster
+
+
+class MonsterTable:
+    """Monster Manual stat blocks parsed at ingestion, indexed by name and CR.
+
+    Name lookups are a dictionary hit on normalized names and aliases
+    (parentheticals dropped, plurals folded); CR lookups are a bisect over the
+    entries sorted by CR.
+    """
+
+    def __init__(self, monsters: Iterable[Dict] = ()):
+        self.monsters = list(monsters)
+        self._by_name = {}
+        for monster in self.monsters:
+            for alias in monster_aliases(monster['name']):
+                # The first book processed wins a name shared between editions
+                self._by_name.setdefault(alias, monster)
+        self._by_cr = sorted(self.monsters, key=lambda m: (m['cr_value'], m['name']))
+        self._cr_keys = [monster['cr_value'] for monster in self._by_cr]
+
+    def __len__(self):
+        return len(self.monsters)
+
+    @classmethod
+    def load(cls, path: str) -> 'MonsterTable':
+        if not path or not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.monsters, f)
+
+    def get(self, name: str) -> Optional[Dict]:
+        key = normalize_name(name or '')
+        return self._by_name.get(key) or self._by_name.get(_singular(key))
+
+    def by_cr(self, low, high=None) -> List[Dict]:
+        """Monsters with low <= CR <= high (CRs may be given as '1/4', 0.25, ...)"""
+        low = cr_value(low)
+        high = low if high is None else cr_value(high)
+        return self._by_cr[bisect_left(self._cr_keys, low):bisect_right(self._cr_keys, high)]
+
+
+def monster_summary(monster: Dict) -> str:
+    """One line per monster for "similar creature" context"""
+    actions = [line.split('.')[0] for line in monster.get('actions', '').splitlines()
+               if '.' in line and len(line.split('.')[0]) <= 40]
+    summary = (f"{monster['name']} (CR {monster['cr']}, {monster['size']} {monster['type']}): "
+               f"AC {monster['armor_class']}, HP {monster['hit_points']}")
+    if actions:
+        summary += f"; actions: {', '.join(actions[:4])}"
+    return summary
@@ -5,40 +5,57 @@ import os
 from google import genai
 from google.genai import types
 from google.cloud import storage
+from app.rag.index_cache import BlobCache
+from app.rag.monster_table import MonsterTable, parse_stat_blocks
 
 class PDFProcessor:
-    def __init__(self, project_id: str):
+    def __init__(self, project_id: str, client=None, storage_client=None):
         self.project_id = project_id
-        self.client = genai.Client(
+        # Callers that already hold clients pass them in to skip a second credential/channel setup
+        self.client = client or genai.Client(
             vertexai=True,
             project=project_id,
             location="us-central1"
         )
+        self.storage_client = storage_client
         
         # Try Cloud Storage first, fallback to local
         self.vector_store_path = "/tmp/rulebooks.json"
+        self.index_cache = BlobCache(
+            os.getenv("RULEBOOK_INDEX_CACHE_DIR", "/tmp/rulebook_index"),
+            max_age=float(os.getenv("RULEBOOK_INDEX_MAX_AGE", "3600"))
+        )
+        # Parsed Monster Manual stat blocks, built next to the vector store at ingestion
+        self.monsters = MonsterTable()
         self._load_from_storage()
         
     def _load_from_storage(self):
-        """Load vector database from Cloud Storage"""
+        """Load vector database from Cloud Storage, reusing the local cache when it is current"""
         try:
-            storage_client = storage.Client(project=self.project_id)
+            storage_client = self.storage_client or storage.Client(project=self.project_id)
             bucket = storage_client.bucket("shattered-meridian-assistant-campaign-data")
-            blob = bucket.blob("vector_db/rulebooks.json")
+            path = self.index_cache.fetch(bucket, "vector_db/rulebooks.json")
             
-            if blob.exists():
-                print("Loading vector database from Cloud Storage...")
-                blob.download_to_filename(self.vector_store_path)
-                print(f"✓ Loaded vector database ({os.path.getsize(self.vector_store_path) / 1024 / 1024:.1f} MB)")
+            if path:
+                self.vector_store_path = path
+                print(f"✓ Loaded vector database ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
             else:
                 print("Vector database not found in Cloud Storage")
+            
+            self.monsters = MonsterTable.load(self.index_cache.fetch(bucket, "vector_db/monsters.json"))
+            print(f"✓ Loaded {len(self.monsters)} monster stat blocks")
         except Exception as e:
             print(f"Could not load from Cloud Storage: {e}")
             # Fallback to local path
             local_path = "/home/jeffrey1871/dnd-dm-assistant/vector_db/rulebooks.json"
             if os.path.exists(local_path):
                 self.vector_store_path = local_path
+                self.monsters = MonsterTable.load(self.monster_table_path)
                 print("Using local vector database")
+    
+    @property
+    def monster_table_path(self) -> str:
+        return os.path.join(os.path.dirname(self.vector_store_path), "monsters.json")
         
     def extract_text_from_pdf(self, pdf_path: str) -> List[Dict[str, str]]:
         """Extract text from PDF with page numbers"""
@@ -141,23 +158,40 @@ class PDFProcessor:
             return 0
         return dot_product / (magnitude1 * magnitude2)
     
+    def get_index_version(self) -> str:
+        """Return a version tag that changes whenever the vector store file is rebuilt"""
+        try:
+            stat = os.stat(self.vector_store_path)
+        except OSError:
+            return None
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+    
     def search(self, query: str, n_results: int = 5) -> List[Dict]:
         """Search the vector store"""
         if not os.path.exists(self.vector_store_path):
             print(f"Vector store not found at {self.vector_store_path}")
             return []
         
-        with open(self.vector_store_path, 'r') as f:
-            vector_store = json.load(f)
-        
         query_embedding = self.get_embedding(query)
         if not query_embedding:
             return []
         
+        return self.search_by_embedding(query_embedding, n_results=n_results)
+    
+    def search_by_embedding(self, query_embedding: List[float], n_results: int = 5) -> List[Dict]:
+        """Search the vector store with a precomputed query embedding"""
+        if not os.path.exists(self.vector_store_path):
+            print(f"Vector store not found at {self.vector_store_path}")
+            return []
+        
+        with open(self.vector_store_path, 'r') as f:
+            vector_store = json.load(f)
+        
         results = []
         for item in vector_store:
             similarity = self.cosine_similarity(query_embedding, item['embedding'])
             results.append({
+                'id': item.get('id'),
                 'text': item['text'],
                 'source': item['source'],
                 'page_number': item['page_number'],
@@ -175,15 +209,22 @@ def process_all_rulebooks(rulebooks_dir: str, project_id: str):
     print(f"Found {len(pdf_files)} PDF files")
     
     all_chunks = []
+    monsters = []
     for pdf_file in sorted(pdf_files):
         pdf_path = os.path.join(rulebooks_dir, pdf_file)
         print(f"\nProcessing: {pdf_file}")
         pages = processor.extract_text_from_pdf(pdf_path)
         print(f"✓ Extracted {len(pages)} pages")
+        stat_blocks = parse_stat_blocks(pages)
+        if stat_blocks:
+            print(f"✓ Parsed {len(stat_blocks)} stat blocks")
+            monsters.extend(stat_blocks)
         chunks = processor.chunk_documents(pages)
         print(f"✓ Created {len(chunks)} chunks")
         all_chunks.extend(chunks)
     
     print(f"\nTOTAL: {len(all_chunks)} chunks from {len(pdf_files)} PDFs\n")
     processor.save_to_vector_store(all_chunks)
+    MonsterTable(monsters).save(processor.monster_table_path)
+    print(f"✓ Saved {len(monsters)} stat blocks to {processor.monster_table_path}")
     print("\n✅ All rulebooks processed!")
@@ -0,0 +1,189 @@
+import re
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from app.rag.context_packer import estimate_tokens
+
+SESSIONS_COLLECTION = 'chat_history'
+TURNS_SUBCOLLECTION = 'turns'
+
+# Session ids become Firestore document ids
+_SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+# Firestore batches are limited to 500 writes
+_DELETE_BATCH = 500
+
+# Recent turns kept in the session document if summaries keep failing, as a multiple of the
+# window; older ones stay in the turn log but the document stays well under Firestore's 1 MiB
+MAX_RECENT_WINDOWS = 4
+
+
+def valid_session_id(session_id: str) -> bool:
+    return bool(_SESSION_ID_RE.match(session_id or ''))
+
+
+def turn_tokens(turn: Dict) -> int:
+    return estimate_tokens(turn['message']) + estimate_tokens(turn['response'])
+
+
+class ChatSessionStore:
+    """Server-side /chat sessions: a sliding window of recent turns plus a rolling summary.
+
+    Each session is one chat_history document holding the summary and the
+    recent turns, so building a prompt is a single read; every turn is also
+    written to a `turns` subcollection as the full log. Once the recent turns
+    exceed `window_turns` or `window_tokens`, the oldest are folded into the
+    summary by `summarize(summary, turns)` (a model call, made after the
+    response has been sent), so prompts stay the same size however long the
+    session runs.
+    """
+
+    def __init__(self, db, summarize: Callable[[str, List[Dict]], str],
+                 window_turns: int = 6, window_tokens: int = 3000):
+        self.db = db
+        self.summarize = summarize
+        self.window_turns = window_turns
+        self.window_tokens = window_tokens
+        self.max_recent_turns = window_turns * MAX_RECENT_WINDOWS
+
+    def _ref(self, session_id: str):
+        return self.db.collection(SESSIONS_COLLECTION).document(session_id)
+
+    # ---- Reads ----
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        doc = self._ref(session_id).get()
+        session = doc.to_dict() if doc.exists else None
+        # chat_history also holds the one-off interactions logged by stateless /chat
+        return session if session and session.get('session') else None
+
+    def get_or_new(self, session_id: str) -> Dict:
+        """The stored session, or an empty one for an unused id.
+        Raises ValueError if the id belongs to another chat_history document."""
+        doc = self._ref(session_id).get()
+        if not doc.exists:
+            return {}
+        session = doc.to_dict()
+        if not session.get('session'):
+            raise ValueError(f"{session_id} is not a chat session")
+        return session
+
+    def split_window(self, recent: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Split recent turns into (turns to fold into the summary, turns that stay in the window).
+
+        The newest turns are kept while they fit both limits; the latest turn is
+        always kept, however long it is.
+        """
+        kept = 0
+        tokens = 0
+        for turn in reversed(recent):
+            tokens += turn_tokens(turn)
+            if kept and (kept >= self.window_turns or tokens > self.window_tokens):
+                break
+            kept += 1
+        return recent[:len(recent) - kept], recent[len(recent) - kept:]
+
+    def prompt_context(self, session: Optional[Dict]) -> Tuple[str, List[Dict]]:
+        """(summary, window turns) to put in a prompt; never more than the window holds"""
+        if not session:
+            return '', []
+        _, window = self.split_window(session.get('recent', []))
+        return session.get('summary', ''), window
+
+    # ---- Writes ----
+
+    def create(self, context_type: str = 'general') -> str:
+        ref = self.db.collection(SESSIONS_COLLECTION).document()
+        now = datetime.utcnow()
+        ref.set(self._new_session(context_type, now))
+        return ref.id
+
+    def _new_session(self, context_type: str, now: datetime) -> Dict:
+        return {
+            'session': True,
+            'summary': '',
+            'summary_through': -1,
+            'recent': [],
+            'turn_count': 0,
+            'context_type': context_type,
+            'created_at': now,
+            'updated_at': now
+        }
+
+    def append_turn(self, session_id: str, message: str, response: str, context_type: str) -> Dict:
+        """Record a turn in the session window and the turn log, creating the session if needed"""
+        ref = self._ref(session_id)
+        now = datetime.utcnow()
+
+        @firestore.transactional
+        def append_in_transaction(transaction):
+            snapshot = ref.get(transaction=transaction)
+            session = snapshot.to_dict() if snapshot.exists else self._new_session(context_type, now)
+            if not session.get('session'):
+                raise ValueError(f"{session_id} is not a chat session")
+            turn = {
+                'index': session['turn_count'],
+                'message': message,
+                'response': response,
+                'timestamp': now
+            }
+            # Normally fold keeps this to the window; the cap only matters if folding keeps failing
+            session['recent'] = (session['recent'] + [turn])[-self.max_recent_turns:]
+            session['turn_count'] += 1
+            session['context_type'] = context_type
+            session['updated_at'] = now
+            transaction.set(ref, session)
+            transaction.set(ref.collection(TURNS_SUBCOLLECTION).document(f"{turn['index']:06d}"),
+                            {**turn, 'context_type': context_type})
+            return session
+
+        return append_in_transaction(self.db.transaction())
+
+    def fold(self, session_id: str) -> bool:
+        """Summarize the turns that have slid out of the window; returns whether anything was folded"""
+        session = self.get(session_id)
+        if not session:
+            return False
+        folding, _ = self.split_window(session.get('recent', []))
+        if not folding:
+            return False
+
+        # The model call happens outside the transaction; the write only lands if
+        # no other request folded the same turns in the meantime
+        summary = self.summarize(session.get('summary', ''), folding)
+        folded_through = folding[-1]['index']
+        ref = self._ref(session_id)
+
+        @firestore.transactional
+        def fold_in_transaction(transaction):
+            snapshot = ref.get(transaction=transaction)
+            current = snapshot.to_dict() if snapshot.exists else None
+            if not current or current.get('summary_through', -1) != session.get('summary_through', -1):
+                return False
+            transaction.update(ref, {
+                'summary': summary,
+                'summary_through': folded_through,
+                'recent': [turn for turn in current['recent'] if turn['index'] > folded_through],
+                'updated_at': datetime.utcnow()
+            })
+            return True
+
+        return fold_in_transaction(self.db.transaction())
+
+    def delete(self, session_id: str) -> bool:
+        """Delete a session and its turns; False if the id isn't a session (one-off interactions are kept)"""
+        if self.get(session_id) is None:
+            return False
+        ref = self._ref(session_id)
+        while True:
+            turns = list(ref.collection(TURNS_SUBCOLLECTION).limit(_DELETE_BATCH).stream())
+            if not turns:
+                break
+            batch = self.db.batch()
+            for turn in turns:
+                batch.delete(turn.reference)
+            batch.commit()
+        ref.delete()
+        return True
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+
+class ContextBundleCache:
+    """TTL cache of assembled NPC prompt context (lore text + rulebook excerpts).
+
+    Each bundle remembers which campaign_lore documents it was built from, so a
+    change to any of them drops the bundle. Bundles are also tagged with the
+    rulebook index version and ignored once the index is reloaded.
+    """
+
+    def __init__(self, ttl_seconds: float = 900, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._bundles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, index_version: str = None) -> Optional[Dict]:
+        with self._lock:
+            cached = self._bundles.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            if (time.time() - cached['created_at'] > self.ttl_seconds or
+                    cached['index_version'] != index_version):
+                del self._bundles[key]
+                self.misses += 1
+                return None
+            self._bundles.move_to_end(key)
+            self.hits += 1
+            return cached['bundle']
+
+    def put(self, key: tuple, bundle: Dict, lore_ids: Iterable[str], index_version: str = None):
+        with self._lock:
+            self._bundles[key] = {
+                'bundle': bundle,
+                'lore_ids': set(lore_ids),
+                'index_version': index_version,
+                'created_at': time.time()
+            }
+            self._bundles.move_to_end(key)
+            while len(self._bundles) > self.max_entries:
+                self._bundles.popitem(last=False)
+
+    def invalidate_lore(self, lore_id: str):
+        """Drop every bundle that was built from the given lore document"""
+        with self._lock:
+            stale = [key for key, cached in self._bundles.items() if lore_id in cached['lore_ids']]
+            for key in stale:
+                del self._bundles[key]
+
+    def clear(self):
+        with self._lock:
+            self._bundles.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._bundles),
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses
+            }
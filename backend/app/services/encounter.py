@@ -0,0 +1,307 @@
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.services.stat_engine import character_stat_block, creature_stat_block, monster_stat_block, parse_cr
+
+# DMG XP thresholds per character: level -> (easy, medium, hard, deadly)
+XP_THRESHOLDS = {
+    1: (25, 50, 75, 100),
+    2: (50, 100, 150, 200),
+    3: (75, 150, 225, 400),
+    4: (125, 250, 375, 500),
+    5: (250, 500, 750, 1100),
+    6: (300, 600, 900, 1400),
+    7: (350, 750, 1100, 1700),
+    8: (450, 900, 1400, 2100),
+    9: (550, 1100, 1600, 2400),
+    10: (600, 1200, 1900, 2800),
+    11: (800, 1600, 2400, 3600),
+    12: (1000, 2000, 3000, 4500),
+    13: (1100, 2200, 3400, 5100),
+    14: (1250, 2500, 3800, 5700),
+    15: (1400, 2800, 4300, 6400),
+    16: (1600, 3200, 4800, 7200),
+    17: (2000, 3900, 5900, 8800),
+    18: (2100, 4200, 6300, 9500),
+    19: (2400, 4900, 7300, 10900),
+    20: (2800, 5700, 8500, 12700),
+}
+DIFFICULTIES = ('easy', 'medium', 'hard', 'deadly')
+
+# Encounter multipliers; small parties step one up the list and parties of six or more one down
+_MULTIPLIERS = (0.5, 1, 1.5, 2, 2.5, 3, 4, 5)
+
+# Party members without a class cycle through a standard party
+DEFAULT_PARTY_CLASSES = ('fighter', 'cleric', 'rogue', 'wizard')
+
+MAX_ROUNDS = 20
+
+_WORD_NUMBERS = {'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6}
+_MULTIATTACK_RE = re.compile(r'makes (two|three|four|five|six|\d) (?:\w+ )?attacks', re.IGNORECASE)
+_HIT_DAMAGE_RE = re.compile(r'Hit:\s*(\d+)\s*\(')
+
+
+# ---- XP budget ----
+
+def xp_budget(party_levels: Sequence[int]) -> Dict[str, int]:
+    """Party XP thresholds for each difficulty (the sum of every member's thresholds)"""
+    totals = [0, 0, 0, 0]
+    for level in party_levels:
+        for i, xp in enumerate(XP_THRESHOLDS[max(1, min(int(level), 20))]):
+            totals[i] += xp
+    return dict(zip(DIFFICULTIES, totals))
+
+
+def encounter_multiplier(monster_count: int, party_size: int) -> float:
+    if monster_count <= 1:
+        index = 1
+    elif monster_count == 2:
+        index = 2
+    elif monster_count <= 6:
+        index = 3
+    elif monster_count <= 10:
+        index = 4
+    elif monster_count <= 14:
+        index = 5
+    else:
+        index = 6
+    if party_size < 3:
+        index += 1
+    elif party_size >= 6:
+        index -= 1
+    return _MULTIPLIERS[index]
+
+
+def rate_encounter(party_levels: Sequence[int], monster_xp: Sequence[int]) -> Dict:
+    """DMG difficulty: monster XP times the group-size multiplier, against the party thresholds"""
+    budget = xp_budget(party_levels)
+    base_xp = sum(monster_xp)
+    multiplier = encounter_multiplier(len(monster_xp), len(party_levels))
+    adjusted_xp = int(base_xp * multiplier)
+    difficulty = 'trivial'
+    for name in DIFFICULTIES:
+        if adjusted_xp >= budget[name]:
+            difficulty = name
+    return {
+        'budget': budget,
+        'base_xp': base_xp,
+        'multiplier': multiplier,
+        'adjusted_xp': adjusted_xp,
+        'difficulty': difficulty
+    }
+
+
+# ---- Combatants ----
+
+def _tier(level: int) -> int:
+    """Cantrip dice and martial arts steps: 1 at levels 1-4, 2 at 5-10, 3 at 11-16, 4 at 17+"""
+    return 1 + (level >= 5) + (level >= 11) + (level >= 17)
+
+
+def character_combatant(character_class: str, level: int) -> Dict:
+    """At-will offense of a classed character (weapon attacks or attack cantrips; no spell slots)"""
+    block = character_stat_block(character_class, level)
+    key, level = block['class'], block['level']
+    mods = {ability: stat['modifier'] for ability, stat in block['abilities'].items()}
+    attack_mod = block['attack_bonus'] - block['proficiency_bonus']
+
+    if key == 'barbarian':
+        attacks, damage = 1 + (level >= 5), 6.5 + attack_mod + (2 if level < 9 else 3 if level < 16 else 4)
+    elif key == 'fighter':
+        attacks, damage = 1 + (level >= 5) + (level >= 11) + (level >= 20), 4.5 + attack_mod + 2
+    elif key == 'paladin':
+        attacks, damage = 1 + (level >= 5), 4.5 + attack_mod + 2 + (4.5 if level >= 11 else 0)
+    elif key == 'ranger':
+        attacks, damage = 1 + (level >= 5), 4.5 + attack_mod + 3.5
+    elif key == 'monk':
+        attacks, damage = 2 + (level >= 5), 2.5 + _tier(level) + attack_mod
+    elif key == 'rogue':
+        attacks, damage = 1, 3.5 + attack_mod + 3.5 * ((level + 1) // 2)
+    elif key == 'warlock':
+        # Eldritch Blast: one beam per tier, Agonizing Blast from level 2
+        attacks, damage = _tier(level), 5.5 + (mods['cha'] if level >= 2 else 0)
+    else:
+        attacks, damage = 1, 5.5 * _tier(level)
+
+    bonus = block.get('spell_attack_bonus', block['attack_bonus']) if key in (
+        'warlock', 'wizard', 'sorcerer', 'bard', 'cleric', 'druid', 'artificer') else block['attack_bonus']
+    return {
+        'name': f"{key.title()} {level}",
+        'hit_points': block['hit_points'],
+        'armor_class': block['armor_class'],
+        'attack_bonus': bonus,
+        'attacks': attacks,
+        'damage_per_hit': round(damage, 1)
+    }
+
+
+def monster_combatant(block: Dict, actions: str = '') -> Dict:
+    """Offense of a creature stat block; parsed Monster Manual actions refine the CR-table targets"""
+    low, high = block['damage_per_round']
+    cr = float(parse_cr(block['cr']))
+    attacks = 1 if cr < 3 else 2 if cr < 11 else 3
+    damage_per_hit = (low + high) / 2 / attacks
+
+    multiattack = _MULTIATTACK_RE.search(actions)
+    hit_damage = [int(damage) for damage in _HIT_DAMAGE_RE.findall(actions)]
+    if multiattack:
+        count = multiattack.group(1).lower()
+        attacks = _WORD_NUMBERS.get(count) or int(count)
+        damage_per_hit = (low + high) / 2 / attacks
+    elif hit_damage:
+        attacks = 1
+    if hit_damage:
+        damage_per_hit = max(hit_damage)
+
+    return {
+        'name': block.get('name', f"CR {block['cr']} creature"),
+        'cr': block['cr'],
+        'xp': block['xp'],
+        'hit_points': block['hit_points'],
+        'armor_class': block['armor_class'],
+        'attack_bonus': block['attack_bonus'],
+        'attacks': attacks,
+        'damage_per_hit': round(max(damage_per_hit, 1), 1)
+    }
+
+
+def typical_monster_stats(cr) -> tuple:
+    """(hit points, damage per round) of a typical published monster of this CR.
+
+    The DMG targets describe a creature rated on HP or damage alone, so a monster
+    built to both is much tougher than what the Monster Manual prints at that CR;
+    published monsters come in around 15 HP and 5 damage per round per CR step.
+    """
+    value = float(parse_cr(cr))
+    if value < 1:
+        return max(3, round(7 + 23 * value)), max(1.0, 2.5 + 10 * value)
+    return round(15 * (value + 1)), 5 * (value + 1)
+
+
+def creature_combatant(cr=None, monster: Optional[Dict] = None, size: str = 'medium', **overrides) -> Dict:
+    """A monster from a parsed Monster Manual entry or a CR; any given stat overrides the derived one"""
+    if monster:
+        combatant = monster_combatant(monster_stat_block(monster), monster.get('actions', ''))
+    else:
+        combatant = monster_combatant(creature_stat_block(cr, size))
+        hit_points, damage_per_round = typical_monster_stats(cr)
+        combatant['hit_points'] = hit_points
+        combatant['damage_per_hit'] = round(damage_per_round / combatant['attacks'], 1)
+    combatant.update({key: value for key, value in overrides.items() if value is not None})
+    return combatant
+
+
+def default_party(party_level: int, party_size: int) -> List[Dict]:
+    return [character_combatant(DEFAULT_PARTY_CLASSES[i % len(DEFAULT_PARTY_CLASSES)], party_level)
+            for i in range(party_size)]
+
+
+# ---- Simulation ----
+
+def _attack_slots(combatants: List[Dict]):
+    """Flatten combatants into one column per attack: (owner index, attack bonus, damage per hit)"""
+    owners, bonuses, damage = [], [], []
+    for i, combatant in enumerate(combatants):
+        for _ in range(int(combatant['attacks'])):
+            owners.append(i)
+            bonuses.append(combatant['attack_bonus'])
+            damage.append(combatant['damage_per_hit'])
+    return np.array(owners, dtype=np.intp), np.array(bonuses, dtype=np.int16), np.array(damage)
+
+
+def _resolve_attacks(rng, slots, attacker_alive, target_hp, target_ac, focus: bool):
+    """Apply one side's attacks for a round to `target_hp` (trials, targets) in place.
+
+    Dice for every attack in every trial are rolled as one array; attacks are
+    then applied in turn so each one picks among targets still standing.
+    """
+    owners, bonuses, damage = slots
+    trials = target_hp.shape[0]
+    rows = np.arange(trials)
+    rolls = rng.integers(1, 21, size=(trials, len(owners)), dtype=np.int16)
+    crits = np.where(rolls == 20, 2.0, 1.0)
+    picks = None if focus else rng.random((trials, len(owners), target_hp.shape[1]))
+
+    for k in range(len(owners)):
+        standing = target_hp > 0
+        if focus:
+            # Focus fire: attacks go to the first target still standing
+            chosen = standing.argmax(axis=1)
+        else:
+            chosen = (picks[:, k, :] * standing).argmax(axis=1)
+        roll = rolls[:, k]
+        hits = (roll == 20) | ((roll != 1) & (roll + bonuses[k] >= target_ac[chosen]))
+        hits &= attacker_alive[:, owners[k]] & standing[rows, chosen]
+        target_hp[rows, chosen] -= damage[k] * crits[:, k] * hits
+
+
+def simulate_combat(party: List[Dict], monsters: List[Dict], trials: int = 2000,
+                    max_rounds: int = MAX_ROUNDS, seed: Optional[int] = None) -> Dict:
+    """Monte Carlo estimate of how a fight goes, every trial advanced together as arrays.
+
+    Rounds are resolved simultaneously: both sides attack using who was standing
+    at the start of the round. The party focuses fire on one monster at a time;
+    monsters pick random standing targets. Only the per-attack targeting loops
+    in Python; dice and damage for all trials are array operations. Characters use at-will attacks only
+    (no spell slots, healing or death saves), so results lean pessimistic for
+    the party.
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    party_hp = np.tile(np.array([c['hit_points'] for c in party], dtype=float), (trials, 1))
+    monster_hp = np.tile(np.array([c['hit_points'] for c in monsters], dtype=float), (trials, 1))
+    party_ac = np.array([c['armor_class'] for c in party], dtype=np.int16)
+    monster_ac = np.array([c['armor_class'] for c in monsters], dtype=np.int16)
+    party_slots, monster_slots = _attack_slots(party), _attack_slots(monsters)
+    rounds = np.zeros(trials, dtype=np.int16)
+
+    for _ in range(max_rounds):
+        party_alive = party_hp > 0
+        monster_alive = monster_hp > 0
+        fighting = party_alive.any(axis=1) & monster_alive.any(axis=1)
+        if not fighting.any():
+            break
+        rounds += fighting
+        party_alive &= fighting[:, None]
+        monster_alive &= fighting[:, None]
+
+        # Both sides act on who was standing at the start of the round
+        _resolve_attacks(rng, party_slots, party_alive, monster_hp, monster_ac, focus=True)
+        _resolve_attacks(rng, monster_slots, monster_alive, party_hp, party_ac, focus=False)
+
+    party_standing = (party_hp > 0).any(axis=1)
+    monsters_standing = (monster_hp > 0).any(axis=1)
+    downed = (party_hp <= 0).sum(axis=1)
+    max_hp = np.array([c['hit_points'] for c in party], dtype=float)
+    hp_lost = 1 - np.clip(party_hp, 0, None).sum(axis=1) / max_hp.sum()
+
+    victory = float((party_standing & ~monsters_standing).mean())
+    wipe = float((~party_standing).mean())
+    any_downed = float((downed > 0).mean())
+    result = {
+        'trials': trials,
+        'party_victory_rate': round(victory, 3),
+        'party_wipe_rate': round(wipe, 3),
+        'unresolved_rate': round(float((party_standing & monsters_standing).mean()), 3),
+        'any_downed_rate': round(any_downed, 3),
+        'average_downed': round(float(downed.mean()), 2),
+        'average_rounds': round(float(rounds.mean()), 1),
+        'average_party_hp_lost': round(float(hp_lost.mean()), 3)
+    }
+    result['deadliness'] = _deadliness(result)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _deadliness(result: Dict) -> str:
+    if result['party_wipe_rate'] >= 0.1 or result['party_victory_rate'] < 0.75:
+        return 'deadly'
+    if result['average_downed'] >= 0.5 or result['average_party_hp_lost'] >= 0.5:
+        return 'hard'
+    if result['average_party_hp_lost'] >= 0.25:
+        return 'medium'
+    return 'easy'
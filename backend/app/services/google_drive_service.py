@@ -1,120 +1,195 @@
+import queue
+from contextlib import contextmanager
+
 import google.auth
+import google_auth_httplib2
+import httplib2
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+SCOPES = [
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/documents'
+]
+
+# Google's batch endpoints accept at most 100 calls per HTTP batch request
+MAX_BATCH_SIZE = 100
+
+# Template placeholder -> key in the parsed NPC data
+NPC_TEMPLATE_FIELDS = {
+    '{{NPC_NAME}}': 'name',
+    '{{RACE}}': 'race',
+    '{{CLASS}}': 'class',
+    '{{ALIGNMENT}}': 'alignment',
+    '{{LEVEL}}': 'level',
+    '{{WORLD_PLACEMENT}}': 'world_placement',
+    '{{PHYSICAL_DESCRIPTION}}': 'physical_description',
+    '{{VOICE_SUGGESTIONS}}': 'voice_suggestions',
+    '{{PERSONALITY_TRAITS}}': 'personality_traits',
+    '{{BACKGROUND}}': 'background',
+    '{{STR}}': 'str',
+    '{{DEX}}': 'dex',
+    '{{CON}}': 'con',
+    '{{INT}}': 'int',
+    '{{WIS}}': 'wis',
+    '{{CHA}}': 'cha',
+    '{{SAVING_THROWS}}': 'saving_throws',
+    '{{SKILLS}}': 'skills',
+    '{{SENSES}}': 'senses',
+    '{{LANGUAGES}}': 'languages',
+    '{{ABILITIES}}': 'abilities',
+    '{{ACTIONS}}': 'actions',
+}
+
+
+class AuthorizedHttpPool:
+    """Thread-safe pool of authorized HTTP clients.
+
+    httplib2.Http objects must not be shared between threads, so each
+    request borrows one from the pool (creating it on demand) and returns it.
+    """
+
+    def __init__(self, credentials, max_idle: int = 8):
+        self.credentials = credentials
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    @contextmanager
+    def http(self):
+        try:
+            http = self._idle.get_nowait()
+        except queue.Empty:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+        try:
+            yield http
+        finally:
+            try:
+                self._idle.put_nowait(http)
+            except queue.Full:
+                pass
+
+
 class GoogleDriveService:
     def __init__(self, project_id: str):
         self.project_id = project_id
+        self.credentials = self._get_credentials()
+        self.http_pool = AuthorizedHttpPool(self.credentials) if self.credentials else None
         self.service = self._get_drive_service()
         self.docs_service = self._get_docs_service()
-        
+
+    def _get_credentials(self):
+        """Load default credentials once, scoped for both Drive and Docs"""
+        try:
+            credentials, _ = google.auth.default(scopes=SCOPES)
+            return credentials
+        except Exception as e:
+            print(f"Error loading Google credentials: {e}")
+            return None
+
     def _get_drive_service(self):
-        """Initialize Google Drive service with default credentials"""
+        """Initialize Google Drive service with default credentials.
+
+        static_discovery uses the discovery documents bundled with the client
+        library instead of fetching them over the network on every start.
+        """
         try:
-            credentials, _ = google.auth.default(
-                scopes=['https://www.googleapis.com/auth/drive']
-            )
-            return build('drive', 'v3', credentials=credentials)
+            return build('drive', 'v3', credentials=self.credentials,
+                         static_discovery=True, cache_discovery=False)
         except Exception as e:
             print(f"Error initializing Drive service: {e}")
             return None
-    
+
     def _get_docs_service(self):
         """Initialize Google Docs service"""
         try:
-            credentials, _ = google.auth.default(
-                scopes=['https://www.googleapis.com/auth/documents']
-            )
-            return build('docs', 'v1', credentials=credentials)
+            return build('docs', 'v1', credentials=self.credentials,
+                         static_discovery=True, cache_discovery=False)
         except Exception as e:
             print(f"Error initializing Docs service: {e}")
             return None
-    
+
+    def _copy_request(self, template_id: str, new_title: str, folder_id: str = None):
+        body = {'name': new_title}
+        if folder_id:
+            # Setting the parent on the copy avoids a separate get + update of parents
+            body['parents'] = [folder_id]
+        return self.service.files().copy(fileId=template_id, body=body, fields='id')
+
+    def _fill_request(self, doc_id: str, npc_data: dict):
+        requests = []
+        for placeholder, key in NPC_TEMPLATE_FIELDS.items():
+            requests.append({
+                'replaceAllText': {
+                    'containsText': {
+                        'text': placeholder,
+                        'matchCase': True
+                    },
+                    'replaceText': str(npc_data.get(key, ''))
+                }
+            })
+        return self.docs_service.documents().batchUpdate(
+            documentId=doc_id,
+            body={'requests': requests}
+        )
+
     def copy_template(self, template_id: str, new_title: str, folder_id: str = None):
-        """Copy a Google Doc template and return the new document ID"""
+        """Copy a Google Doc template (into folder_id, if given) and return the new document ID"""
         try:
-            body = {'name': new_title}
-            
-            drive_response = self.service.files().copy(
-                fileId=template_id,
-                body=body
-            ).execute()
-            
-            new_doc_id = drive_response.get('id')
-            
-            if folder_id:
-                file = self.service.files().get(
-                    fileId=new_doc_id,
-                    fields='parents'
-                ).execute()
-                
-                previous_parents = ",".join(file.get('parents', []))
-                
-                self.service.files().update(
-                    fileId=new_doc_id,
-                    addParents=folder_id,
-                    removeParents=previous_parents,
-                    fields='id, parents'
-                ).execute()
-            
-            return new_doc_id
-            
+            with self.http_pool.http() as http:
+                drive_response = self._copy_request(template_id, new_title, folder_id).execute(http=http)
+            return drive_response.get('id')
+
         except HttpError as error:
             print(f"An error occurred: {error}")
             return None
-    
+
     def fill_npc_template(self, doc_id: str, npc_data: dict):
         """Fill the NPC template with data"""
         try:
-            replacements = {
-                '{{NPC_NAME}}': npc_data.get('name', ''),
-                '{{RACE}}': npc_data.get('race', ''),
-                '{{CLASS}}': npc_data.get('class', ''),
-                '{{ALIGNMENT}}': npc_data.get('alignment', ''),
-                '{{LEVEL}}': npc_data.get('level', ''),
-                '{{WORLD_PLACEMENT}}': npc_data.get('world_placement', ''),
-                '{{PHYSICAL_DESCRIPTION}}': npc_data.get('physical_description', ''),
-                '{{VOICE_SUGGESTIONS}}': npc_data.get('voice_suggestions', ''),
-                '{{PERSONALITY_TRAITS}}': npc_data.get('personality_traits', ''),
-                '{{BACKGROUND}}': npc_data.get('background', ''),
-                '{{STR}}': npc_data.get('str', ''),
-                '{{DEX}}': npc_data.get('dex', ''),
-                '{{CON}}': npc_data.get('con', ''),
-                '{{INT}}': npc_data.get('int', ''),
-                '{{WIS}}': npc_data.get('wis', ''),
-                '{{CHA}}': npc_data.get('cha', ''),
-                '{{SAVING_THROWS}}': npc_data.get('saving_throws', ''),
-                '{{SKILLS}}': npc_data.get('skills', ''),
-                '{{SENSES}}': npc_data.get('senses', ''),
-                '{{LANGUAGES}}': npc_data.get('languages', ''),
-                '{{ABILITIES}}': npc_data.get('abilities', ''),
-                '{{ACTIONS}}': npc_data.get('actions', ''),
-            }
-            
-            requests = []
-            for placeholder, value in replacements.items():
-                requests.append({
-                    'replaceAllText': {
-                        'containsText': {
-                            'text': placeholder,
-                            'matchCase': True
-                        },
-                        'replaceText': str(value)
-                    }
-                })
-            
-            self.docs_service.documents().batchUpdate(
-                documentId=doc_id,
-                body={'requests': requests}
-            ).execute()
-            
+            with self.http_pool.http() as http:
+                self._fill_request(doc_id, npc_data).execute(http=http)
             return True
-            
+
         except HttpError as error:
             print(f"An error occurred filling template: {error}")
             return False
-    
+
+    def export_npcs(self, template_id: str, npcs: list, folder_id: str = None) -> list:
+        """Copy and fill one template per NPC using HTTP batch requests.
+
+        `npcs` is a list of (title, npc_data) pairs. Returns a list of document
+        IDs in the same order, with None for NPCs that failed.
+        """
+        doc_ids = [None] * len(npcs)
+
+        def copied(request_id, response, exception):
+            if exception is not None:
+                print(f"Batch copy {request_id} failed: {exception}")
+            else:
+                doc_ids[int(request_id)] = response.get('id')
+
+        for start in range(0, len(npcs), MAX_BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=copied)
+            for i in range(start, min(start + MAX_BATCH_SIZE, len(npcs))):
+                batch.add(self._copy_request(template_id, npcs[i][0], folder_id), request_id=str(i))
+            with self.http_pool.http() as http:
+                batch.execute(http=http)
+
+        def filled(request_id, response, exception):
+            if exception is not None:
+                print(f"Batch fill {request_id} failed: {exception}")
+                doc_ids[int(request_id)] = None
+
+        copied_indexes = [i for i, doc_id in enumerate(doc_ids) if doc_id]
+        for start in range(0, len(copied_indexes), MAX_BATCH_SIZE):
+            batch = self.docs_service.new_batch_http_request(callback=filled)
+            for i in copied_indexes[start:start + MAX_BATCH_SIZE]:
+                batch.add(self._fill_request(doc_ids[i], npcs[i][1]), request_id=str(i))
+            with self.http_pool.http() as http:
+                batch.execute(http=http)
+
+        return doc_ids
+
     def get_document_url(self, doc_id: str):
         """Get the URL for a Google Doc"""
         return f"https://docs.google.com/document/d/{doc_id}/edit"
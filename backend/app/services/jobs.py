@@ -0,0 +1,274 @@
+import asyncio
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+UNFINISHED_STATUSES = [JOB_QUEUED, JOB_RUNNING]
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+class InMemoryJobStore:
+    """Job state kept in process memory; for local runs and tests"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: Dict):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def update(self, job_id: str, fields: Dict):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def claim(self, job_id: str, worker_id: str, stale_before: datetime) -> bool:
+        """Atomically mark a job as running on this worker if nobody else holds it"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or not _claimable(job, stale_before):
+                return False
+            job.update({'status': JOB_RUNNING, 'worker_id': worker_id, 'updated_at': _utcnow()})
+            job['attempts'] = job.get('attempts', 0) + 1
+            return True
+
+    def list_stale(self, stale_before: datetime) -> List[Dict]:
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()
+                    if job['status'] in UNFINISHED_STATUSES and job['updated_at'] < stale_before]
+
+
+class FirestoreJobStore:
+    """Job state in a Firestore collection so it survives instance restarts"""
+
+    def __init__(self, db, collection: str = "jobs"):
+        self.db = db
+        self.collection = collection
+
+    def _ref(self, job_id: str):
+        return self.db.collection(self.collection).document(job_id)
+
+    def create(self, job: Dict):
+        self._ref(job['id']).set(job)
+
+    def update(self, job_id: str, fields: Dict):
+        self._ref(job_id).update(fields)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        doc = self._ref(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def claim(self, job_id: str, worker_id: str, stale_before: datetime) -> bool:
+        ref = self._ref(job_id)
+
+        @firestore.transactional
+        def claim_in_transaction(transaction):
+            snapshot = ref.get(transaction=transaction)
+            if not snapshot.exists or not _claimable(snapshot.to_dict(), stale_before):
+                return False
+            transaction.update(ref, {
+                'status': JOB_RUNNING,
+                'worker_id': worker_id,
+                'updated_at': _utcnow(),
+                'attempts': firestore.Increment(1)
+            })
+            return True
+
+        return claim_in_transaction(self.db.transaction())
+
+    def list_stale(self, stale_before: datetime) -> List[Dict]:
+        query = (self.db.collection(self.collection)
+                 .where(filter=FieldFilter('status', 'in', UNFINISHED_STATUSES))
+                 .where(filter=FieldFilter('updated_at', '<', stale_before)))
+        return [doc.to_dict() for doc in query.stream()]
+
+
+def _claimable(job: Dict, stale_before: datetime) -> bool:
+    if job['status'] == JOB_QUEUED:
+        return True
+    # A running job whose heartbeat stopped belongs to a dead instance
+    return job['status'] == JOB_RUNNING and job['updated_at'] < stale_before
+
+
+class JobQueue:
+    """Runs long endpoints as background jobs with a concurrency limit.
+
+    Handlers are blocking functions ``handler(params, progress)`` run in worker
+    threads; ``progress(percent, message)`` records progress on the job. Running
+    jobs heartbeat their ``updated_at``; jobs whose heartbeat goes stale (the
+    instance died) are reclaimed by the periodic sweep on any instance.
+    On Cloud Run this needs CPU allocated outside of requests.
+    """
+
+    def __init__(self, store, concurrency: int = 2, stale_after: float = 300,
+                 sweep_interval: float = 60, max_attempts: int = 3):
+        self.store = store
+        self.concurrency = concurrency
+        self.stale_after = stale_after
+        self.sweep_interval = sweep_interval
+        self.max_attempts = max_attempts
+        self.worker_id = uuid.uuid4().hex[:12]
+
+        self._handlers = {}
+        self._queue = None
+        self._loop = None
+        self._tasks = []
+        self._updated = {}  # job_id -> {'event': asyncio.Event set on each local state change, 'waiters': n}
+
+    def register(self, job_type: str, handler: Callable):
+        self._handlers[job_type] = handler
+
+    # ---- Lifecycle ----
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---- Public API ----
+
+    async def enqueue(self, job_type: str, params: Dict) -> Dict:
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        now = _utcnow()
+        job = {
+            'id': uuid.uuid4().hex,
+            'type': job_type,
+            'params': params,
+            'status': JOB_QUEUED,
+            'progress': 0,
+            'message': 'Queued',
+            'result': None,
+            'error': None,
+            'attempts': 0,
+            'worker_id': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        await asyncio.to_thread(self.store.create, job)
+        await self._queue.put(job['id'])
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait_for_update(self, job_id: str, timeout: float):
+        """Wait until this instance changes the job, or the timeout passes (for jobs running elsewhere)"""
+        watch = self._updated.setdefault(job_id, {'event': asyncio.Event(), 'waiters': 0})
+        watch['waiters'] += 1
+        try:
+            await asyncio.wait_for(watch['event'].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            watch['waiters'] -= 1
+            # Nobody left watching (job finished elsewhere, client gone): don't keep the event
+            if not watch['waiters'] and self._updated.get(job_id) is watch:
+                del self._updated[job_id]
+        watch['event'].clear()
+
+    # ---- Workers ----
+
+    def _update(self, job_id: str, fields: Dict):
+        fields['updated_at'] = _utcnow()
+        self.store.update(job_id, fields)
+        finished = fields.get('status') in (JOB_SUCCEEDED, JOB_FAILED)
+        self._loop.call_soon_threadsafe(self._notify, job_id, finished)
+
+    def _notify(self, job_id: str, finished: bool = False):
+        watch = self._updated.pop(job_id, None) if finished else self._updated.get(job_id)
+        if watch:
+            watch['event'].set()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Job worker error on {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        stale_before = _utcnow() - timedelta(seconds=self.stale_after)
+        claimed = await asyncio.to_thread(self.store.claim, job_id, self.worker_id, stale_before)
+        if not claimed:
+            return
+
+        job = await self.get(job_id)
+        if job['attempts'] > self.max_attempts:
+            await asyncio.to_thread(self._update, job_id, {
+                'status': JOB_FAILED,
+                'error': f"Gave up after {self.max_attempts} attempts"
+            })
+            return
+        self._notify(job_id)
+
+        def progress(percent: float, message: str = None):
+            fields = {'progress': percent}
+            if message:
+                fields['message'] = message
+            self._update(job_id, fields)
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        started = time.monotonic()
+        try:
+            handler = self._handlers[job['type']]
+            result = await asyncio.to_thread(handler, job['params'], progress)
+            await asyncio.to_thread(self._update, job_id, {
+                'status': JOB_SUCCEEDED,
+                'progress': 100,
+                'message': 'Done',
+                'result': result,
+                'duration_seconds': round(time.monotonic() - started, 2)
+            })
+        except Exception as e:
+            error = getattr(e, 'detail', None) or str(e)
+            print(f"Job {job_id} ({job['type']}) failed: {error}")
+            await asyncio.to_thread(self._update, job_id, {'status': JOB_FAILED, 'error': error})
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.stale_after / 3)
+            try:
+                await asyncio.to_thread(self.store.update, job_id, {'updated_at': _utcnow()})
+            except Exception as e:
+                print(f"Job heartbeat failed for {job_id}: {e}")
+
+    async def _sweeper(self):
+        """Re-queue jobs left queued or running by an instance that went away"""
+        while True:
+            try:
+                stale_before = _utcnow() - timedelta(seconds=self.stale_after)
+                for job in await asyncio.to_thread(self.store.list_stale, stale_before):
+                    await self._queue.put(job['id'])
+            except Exception as e:
+                print(f"Job sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
@@ -0,0 +1,326 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+# Lower runs first: a user waiting on the response, a batch they are watching stream in,
+# then work nobody is waiting on (jobs, summaries)
+INTERACTIVE = 0
+BATCH = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch', BACKGROUND: 'background'}
+
+# Waiters re-check their lane at least this often, whatever they are waiting on
+_MAX_POLL_SECONDS = 1.0
+# Assumed call latency until the lane has measured some
+_INITIAL_CALL_SECONDS = 5.0
+
+
+class LLMBusy(Exception):
+    """The model's queue is saturated; retry after `retry_after` seconds"""
+
+    def __init__(self, model: str, retry_after: float):
+        self.model = model
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"{model} is at capacity, retry in {self.retry_after}s")
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """A quota 429 from Vertex AI (genai APIError, or google.api_core ResourceExhausted for Imagen)"""
+    return getattr(error, 'code', None) == 429 or 'RESOURCE_EXHAUSTED' in str(error)
+
+
+def used_tokens(response) -> Optional[int]:
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'total_token_count', None)
+
+
+class _Ticket:
+    def __init__(self, model: str, lane, cost: float, priority: int, deadline: Optional[float], wake: Callable):
+        self.model = model
+        self.lane = lane
+        self.cost = cost
+        self.priority = priority
+        self.deadline = deadline
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+        self.started = None
+        # Set by the caller once the real cost is known (response usage metadata)
+        self.used = None
+
+
+class _Lane:
+    """Concurrency, per-minute budget and waiters for one model"""
+
+    def __init__(self, concurrency: int, per_minute: float):
+        self.concurrency = concurrency
+        self.per_minute = per_minute
+        self.budget = float(per_minute)
+        self.refilled = time.monotonic()
+        self.active = 0
+        self.waiting = []  # heap of (priority, seq, ticket)
+        self.paused_until = 0.0
+        self.call_seconds = _INITIAL_CALL_SECONDS
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def refill(self, now: float):
+        self.budget = min(self.per_minute, self.budget + (now - self.refilled) * self.per_minute / 60)
+        self.refilled = now
+
+    def queued(self) -> list:
+        return [ticket for _, _, ticket in self.waiting if not ticket.cancelled]
+
+    def head(self) -> Optional[_Ticket]:
+        while self.waiting and self.waiting[0][2].cancelled:
+            heapq.heappop(self.waiting)
+        return self.waiting[0][2] if self.waiting else None
+
+
+class LLMScheduler:
+    """Admission control and priority scheduling for model calls shared by every endpoint.
+
+    Each model gets a lane with a concurrency limit and a per-minute budget
+    (tokens for Gemini, images for Imagen) refilled continuously as a token
+    bucket. Calls wait in a priority queue and are granted strictly in
+    priority order, so interactive chat overtakes batch and background work.
+    A request is refused with LLMBusy, carrying a Retry-After estimate, when
+    the queue is full or its wait would exceed the priority's `max_wait`
+    instead of timing out later. A quota 429 from the API pauses the whole
+    lane before the call is retried, so one throttled call doesn't set off
+    a burst of others. Works from both threads (`call`, `slot`) and the event
+    loop (`acall`, `aslot`).
+    """
+
+    def __init__(self, limits: Dict[str, tuple], default_limits: tuple = (8, 500000),
+                 max_queue: int = 64, max_wait: Dict[int, Optional[float]] = None,
+                 max_retries: int = 3, throttle_pause: float = 2.0):
+        self._limits = dict(limits)
+        self._default_limits = default_limits
+        self.max_queue = max_queue
+        self.max_wait = {INTERACTIVE: 15.0, BATCH: 120.0, BACKGROUND: None, **(max_wait or {})}
+        self.max_retries = max_retries
+        self.throttle_pause = throttle_pause
+        self._lanes = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def set_limits(self, model: str, concurrency: int, per_minute: float):
+        with self._lock:
+            self._limits[model] = (concurrency, per_minute)
+            lane = self._lanes.get(model)
+            if lane:
+                lane.concurrency, lane.per_minute = concurrency, per_minute
+                lane.budget = min(lane.budget, per_minute)
+
+    def _lane(self, model: str) -> _Lane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane(*self._limits.get(model, self._default_limits))
+        return lane
+
+    # ---- Queue (all under self._lock) ----
+
+    def _estimated_wait(self, lane: _Lane, cost: float, priority: int, now: float) -> float:
+        """Rough wait for a new call: budget owed to calls ahead of it, or their turns at the concurrency limit"""
+        ahead = [ticket for ticket in lane.queued() if ticket.priority <= priority]
+        owed = sum(min(ticket.cost, lane.per_minute) for ticket in ahead) + min(cost, lane.per_minute)
+        budget_wait = max(0.0, owed - lane.budget) * 60 / lane.per_minute
+        busy = lane.active + len(ahead) + 1 - lane.concurrency
+        slot_wait = max(0, math.ceil(busy / lane.concurrency)) * lane.call_seconds
+        return max(budget_wait, slot_wait, lane.paused_until - now)
+
+    def _check_admission(self, lane: _Lane, model: str, cost: float, priority: int, now: float):
+        if len(lane.queued()) >= self.max_queue:
+            lane.rejected += 1
+            raise LLMBusy(model, self._estimated_wait(lane, cost, priority, now))
+        limit = self.max_wait.get(priority)
+        wait = self._estimated_wait(lane, cost, priority, now)
+        if limit is not None and wait > limit:
+            lane.rejected += 1
+            raise LLMBusy(model, wait)
+
+    def _dispatch(self, lane: _Lane, now: float):
+        lane.refill(now)
+        if now < lane.paused_until:
+            return
+        ticket = lane.head()
+        # A call costing more than a whole minute's budget goes once the bucket is full
+        while (ticket and lane.active < lane.concurrency
+               and lane.budget >= min(ticket.cost, lane.per_minute)):
+            heapq.heappop(lane.waiting)
+            lane.budget -= ticket.cost
+            lane.active += 1
+            lane.granted += 1
+            ticket.granted = True
+            ticket.started = now
+            ticket.wake()
+            ticket = lane.head()
+
+    def _enqueue(self, model: str, cost: float, priority: int, wake: Callable) -> _Ticket:
+        now = time.monotonic()
+        with self._lock:
+            lane = self._lane(model)
+            lane.refill(now)
+            self._check_admission(lane, model, cost, priority, now)
+            limit = self.max_wait.get(priority)
+            ticket = _Ticket(model, lane, cost, priority, now + limit if limit is not None else None, wake)
+            heapq.heappush(lane.waiting, (priority, next(self._seq), ticket))
+            self._dispatch(lane, now)
+            return ticket
+
+    def _poll(self, ticket: _Ticket) -> Optional[float]:
+        """None once the ticket is granted, else how long to wait before polling again"""
+        now = time.monotonic()
+        with self._lock:
+            lane = ticket.lane
+            self._dispatch(lane, now)
+            if ticket.granted:
+                return None
+            if ticket.deadline is not None and now >= ticket.deadline:
+                ticket.cancelled = True
+                lane.rejected += 1
+                raise LLMBusy(ticket.model, self._estimated_wait(lane, ticket.cost, ticket.priority, now))
+            delay = _MAX_POLL_SECONDS
+            if now < lane.paused_until:
+                delay = min(delay, lane.paused_until - now)
+            elif lane.head() is ticket and lane.active < lane.concurrency:
+                needed = min(ticket.cost, lane.per_minute) - lane.budget
+                delay = min(delay, needed * 60 / lane.per_minute)
+            if ticket.deadline is not None:
+                delay = min(delay, ticket.deadline - now)
+            return max(delay, 0.01)
+
+    def _release(self, ticket: _Ticket):
+        now = time.monotonic()
+        with self._lock:
+            lane = ticket.lane
+            if ticket.granted:
+                lane.active -= 1
+                if ticket.used is not None:
+                    # Settle the reservation against what the call actually used
+                    lane.budget = min(lane.per_minute, lane.budget + ticket.cost - ticket.used)
+                lane.call_seconds = 0.8 * lane.call_seconds + 0.2 * (now - ticket.started)
+            ticket.cancelled = True
+            self._dispatch(lane, now)
+
+    def throttled(self, model: str, attempt: int = 0):
+        """Record a quota 429: hold every call to the model back, longer on repeated throttling"""
+        now = time.monotonic()
+        with self._lock:
+            lane = self._lane(model)
+            lane.throttled += 1
+            lane.paused_until = max(lane.paused_until, now + self.throttle_pause * 2 ** attempt)
+
+    # ---- Waiting for a slot ----
+
+    def admit(self, model: str, cost: float = 0, priority: int = INTERACTIVE):
+        """Raise LLMBusy now if a call would be refused; for responses that must commit before calling"""
+        now = time.monotonic()
+        with self._lock:
+            lane = self._lane(model)
+            lane.refill(now)
+            self._check_admission(lane, model, cost, priority, now)
+
+    @contextmanager
+    def slot(self, model: str, cost: float, priority: int = INTERACTIVE):
+        """Hold one of the model's call slots (blocking); set `.used` on the ticket to settle the budget"""
+        wakeup = threading.Event()
+        ticket = self._enqueue(model, cost, priority, wakeup.set)
+        try:
+            delay = self._poll(ticket)
+            while delay is not None:
+                wakeup.wait(delay)
+                wakeup.clear()
+                delay = self._poll(ticket)
+        except BaseException:
+            self._release(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, model: str, cost: float, priority: int = INTERACTIVE):
+        """Event-loop version of slot()"""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        ticket = self._enqueue(model, cost, priority, lambda: loop.call_soon_threadsafe(wakeup.set))
+        try:
+            delay = self._poll(ticket)
+            while delay is not None:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+                delay = self._poll(ticket)
+        except BaseException:
+            self._release(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    # ---- Calls ----
+
+    def call(self, model: str, fn: Callable, cost: float, priority: int = INTERACTIVE,
+             usage: Callable = used_tokens):
+        """Run fn() in a slot, retrying quota 429s after the lane's pause"""
+        for attempt in range(self.max_retries + 1):
+            with self.slot(model, cost, priority) as ticket:
+                try:
+                    result = fn()
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt == self.max_retries:
+                        raise
+                    self.throttled(model, attempt)
+                    continue
+                ticket.used = usage(result)
+                return result
+
+    async def acall(self, model: str, fn: Callable[[], Awaitable], cost: float, priority: int = INTERACTIVE,
+                    usage: Callable = used_tokens):
+        """Event-loop version of call(); fn returns an awaitable"""
+        for attempt in range(self.max_retries + 1):
+            async with self.aslot(model, cost, priority) as ticket:
+                try:
+                    result = await fn()
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt == self.max_retries:
+                        raise
+                    self.throttled(model, attempt)
+                    continue
+                ticket.used = usage(result)
+                return result
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            report = {}
+            for model, lane in self._lanes.items():
+                lane.refill(now)
+                queued = {name: 0 for name in PRIORITY_NAMES.values()}
+                for ticket in lane.queued():
+                    queued[PRIORITY_NAMES[ticket.priority]] += 1
+                report[model] = {
+                    'concurrency': lane.concurrency,
+                    'active': lane.active,
+                    'queued': queued,
+                    'per_minute': lane.per_minute,
+                    'budget_available': round(lane.budget),
+                    'paused_seconds': round(max(0.0, lane.paused_until - now), 1),
+                    'avg_call_seconds': round(lane.call_seconds, 2),
+                    'granted': lane.granted,
+                    'rejected': lane.rejected,
+                    'throttled': lane.throttled
+                }
+            return report
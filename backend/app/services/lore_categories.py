@@ -0,0 +1,48 @@
+from google.cloud import firestore
+
+# Single aggregate document holding per-category lore counts
+AGGREGATE_COLLECTION = "campaign_meta"
+AGGREGATE_DOCUMENT = "lore_categories"
+
+
+def _aggregate_ref(db):
+    return db.collection(AGGREGATE_COLLECTION).document(AGGREGATE_DOCUMENT)
+
+
+def valid_category(category: str) -> bool:
+    """Categories become keys of the aggregate's counts map, which can't be empty"""
+    return bool(category and category.strip())
+
+
+def increment_category(batch, db, category: str, amount: int):
+    """Add a category count change to a write batch (or transaction) alongside the lore write itself.
+
+    If the aggregate doesn't exist yet this creates it holding only the
+    change, without the `complete` flag, so readers still rebuild it.
+    """
+    if category is None:
+        return
+    batch.set(_aggregate_ref(db), {'counts': {category: firestore.Increment(amount)}}, merge=True)
+
+
+def read_category_counts(db) -> dict:
+    """Read the maintained counts with a single document read; None until a rebuild has completed them"""
+    doc = _aggregate_ref(db).get()
+    if not doc.exists:
+        return None
+    aggregate = doc.to_dict()
+    if not aggregate.get('complete'):
+        return None
+    counts = aggregate.get('counts', {})
+    return {category: count for category, count in counts.items() if count > 0}
+
+
+def rebuild_category_counts(db) -> dict:
+    """Repair job: recount every lore entry and overwrite the aggregate document"""
+    counts = {}
+    for doc in db.collection('campaign_lore').select(['category']).stream():
+        category = doc.to_dict().get('category')
+        if category is not None:
+            counts[category] = counts.get(category, 0) + 1
+    _aggregate_ref(db).set({'counts': counts, 'complete': True, 'rebuilt_at': firestore.SERVER_TIMESTAMP})
+    return counts
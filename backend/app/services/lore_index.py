@@ -0,0 +1,192 @@
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+from typing import List, Dict
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Matches in the title count for more than matches in the body
+TITLE_WEIGHT = 3.0
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens used for both indexing and queries"""
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+class LoreIndex:
+    """In-memory inverted index over campaign_lore, kept live by a Firestore snapshot listener.
+
+    The first snapshot delivers every document as ADDED, which builds the
+    index; later snapshots only carry the changed documents. Searches run
+    entirely against memory and never read from Firestore.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._postings = defaultdict(dict)  # token -> {doc_id: weighted term frequency}
+        self._doc_tokens = {}
+        self._categories = defaultdict(set)
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+        self._lock = threading.RLock()
+        self._watch = None
+        self._listeners = []
+        self.ready = threading.Event()
+
+    # ---- Firestore listener ----
+
+    def start(self, collection_ref):
+        """Attach an on_snapshot listener to the lore collection"""
+        if self._watch is None:
+            self._watch = collection_ref.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def add_listener(self, callback):
+        """Register callback(doc_id) to run whenever a lore document changes after the initial build"""
+        self._listeners.append(callback)
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    self.remove(doc.id)
+                else:
+                    self.upsert(doc.id, doc.to_dict())
+
+        if self.ready.is_set():
+            for change in changes:
+                for callback in self._listeners:
+                    try:
+                        callback(change.document.id)
+                    except Exception as e:
+                        print(f"Lore change listener failed: {e}")
+        self.ready.set()
+
+    # ---- Index maintenance ----
+
+    def upsert(self, doc_id: str, entry: dict):
+        with self._lock:
+            self.remove(doc_id)
+
+            entry = dict(entry)
+            entry['id'] = doc_id
+            self._entries[doc_id] = entry
+
+            weights = defaultdict(float)
+            for token in tokenize(entry.get('title', '')):
+                weights[token] += TITLE_WEIGHT
+            for token in tokenize(entry.get('content', '')):
+                weights[token] += 1.0
+
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    self._vocabulary_dirty = True
+                self._postings[token][doc_id] = weight
+            self._doc_tokens[doc_id] = list(weights.keys())
+
+            self._categories[entry.get('category')].add(doc_id)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            entry = self._entries.pop(doc_id, None)
+            if entry is None:
+                return
+            for token in self._doc_tokens.pop(doc_id, []):
+                postings = self._postings.get(token)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[token]
+                        self._vocabulary_dirty = True
+            category = entry.get('category')
+            self._categories[category].discard(doc_id)
+            if not self._categories[category]:
+                del self._categories[category]
+
+    def _expand(self, token: str) -> List[str]:
+        """Return indexed tokens starting with the query token (so "drag" finds "dragon")"""
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings.keys())
+            self._vocabulary_dirty = False
+        start = bisect.bisect_left(self._vocabulary, token)
+        matches = []
+        for i in range(start, len(self._vocabulary)):
+            if not self._vocabulary[i].startswith(token):
+                break
+            matches.append(self._vocabulary[i])
+        return matches
+
+    # ---- Queries ----
+
+    def search(self, query: str, category: str = None, limit: int = None) -> Dict:
+        """Ranked search; every query token must match (by prefix) in the title or content"""
+        with self._lock:
+            query_tokens = tokenize(query)
+            total_docs = len(self._entries) or 1
+
+            scores = None
+            for token in query_tokens:
+                token_scores = defaultdict(float)
+                for term in self._expand(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total_docs / len(postings))
+                    for doc_id, weight in postings.items():
+                        token_scores[doc_id] = max(token_scores[doc_id], (1 + math.log(weight)) * idf)
+                if scores is None:
+                    scores = dict(token_scores)
+                else:
+                    scores = {doc_id: score + token_scores[doc_id]
+                              for doc_id, score in scores.items() if doc_id in token_scores}
+                if not scores:
+                    break
+
+            if scores is None:
+                # No searchable tokens in the query: match everything, unranked
+                scores = {doc_id: 0.0 for doc_id in self._entries}
+
+            facets = defaultdict(int)
+            for doc_id in scores:
+                facets[self._entries[doc_id].get('category')] += 1
+
+            if category:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if doc_id in self._categories.get(category, ())}
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            if limit:
+                ranked = ranked[:limit]
+
+            results = []
+            for doc_id, score in ranked:
+                entry = dict(self._entries[doc_id])
+                entry['score'] = round(score, 4)
+                results.append(entry)
+
+            return {'results': results, 'count': len(results), 'facets': dict(facets)}
+
+    def get(self, doc_id: str) -> Dict:
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            return dict(entry) if entry else None
+
+    def category_counts(self) -> Dict:
+        with self._lock:
+            return {category: len(doc_ids) for category, doc_ids in self._categories.items()
+                    if category is not None}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'ready': self.ready.is_set(),
+                'entries': len(self._entries),
+                'tokens': len(self._postings),
+                'categories': len(self._categories)
+            }
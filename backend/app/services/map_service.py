@@ -1,22 +1,337 @@
 import base64
+import hashlib
+import io
+import json
+import math
+import os
+import threading
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple
+
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
+from PIL import Image, ImageDraw
+
+# Pixels per grid square (VTT standard)
+PIXELS_PER_SQUARE = 70
+
+IMAGE_FORMATS = {
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+PNG_COMPRESS_LEVEL = int(os.getenv("MAP_PNG_COMPRESS_LEVEL", "6"))
+WEBP_QUALITY = int(os.getenv("MAP_WEBP_QUALITY", "90"))
+
+MAP_BUCKET = "dnd-dm-assistant-web"
+PUBLIC_URL_BASE = f"https://storage.googleapis.com/{MAP_BUCKET}"
+
+IMAGEN_MODEL = "imagen-3.0-generate-001"
+
+# Deep-zoom tiles
+TILE_SIZE = 256
+TILE_UPLOAD_WORKERS = int(os.getenv("MAP_TILE_UPLOAD_WORKERS", "16"))
+# Below this many pixels per square the grid would just darken the tile
+MIN_GRID_SPACING = 4
+
+# Resizing and encoding a large map is CPU-bound; a small dedicated pool bounds how many
+# run at once so map renders can't starve the rest of the service
+render_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MAP_RENDER_WORKERS", "2")),
+    thread_name_prefix="map-render"
+)
+
+
+@lru_cache(maxsize=8)
+def grid_square(pixels_per_square: int = PIXELS_PER_SQUARE) -> Image.Image:
+    """One grid square as an 'L' mask: lines along its top and left edges"""
+    square = Image.new('L', (pixels_per_square, pixels_per_square), 0)
+    draw = ImageDraw.Draw(square)
+    draw.line([(0, 0), (pixels_per_square - 1, 0)], fill=255, width=1)
+    draw.line([(0, 0), (0, pixels_per_square - 1)], fill=255, width=1)
+    return square
+
+
+def grid_overlay(rows: int, columns: int, pixels_per_square: int = PIXELS_PER_SQUARE) -> Image.Image:
+    """Grid lines as an 'L' mask, tiled from the cached square (only the square stays in memory)"""
+    square = grid_square(pixels_per_square)
+    strip = Image.new('L', (columns * pixels_per_square, pixels_per_square), 0)
+    for column in range(columns):
+        strip.paste(square, (column * pixels_per_square, 0))
+    mask = Image.new('L', (columns * pixels_per_square, rows * pixels_per_square), 0)
+    for row in range(rows):
+        mask.paste(strip, (0, row * pixels_per_square))
+    return mask
+
+
+def encode_image(img: Image.Image, image_format: str = 'png') -> bytes:
+    """Encode with the configured PNG compression level or WebP quality"""
+    output_buffer = io.BytesIO()
+    if image_format == 'webp':
+        img.save(output_buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        img.save(output_buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return output_buffer.getvalue()
+
+
+def render_map(image_bytes: bytes, rows: int, columns: int, show_grid: bool,
+               image_format: str = 'png', pixels_per_square: int = PIXELS_PER_SQUARE) -> bytes:
+    """Resize a generated image to the grid dimensions, overlay the grid and encode it"""
+    width = columns * pixels_per_square
+    height = rows * pixels_per_square
+
+    img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    img = img.resize((width, height), Image.LANCZOS)
+    if show_grid:
+        img.paste((0, 0, 0), mask=grid_overlay(rows, columns, pixels_per_square))
+    return encode_image(img, image_format)
+
+
+def render_map_in_pool(*args, **kwargs) -> bytes:
+    """Run render_map on the map render pool and wait for the result"""
+    return render_pool.submit(render_map, *args, **kwargs).result()
+
+
+def pyramid_levels(width: int, height: int, tile_size: int = TILE_SIZE) -> list:
+    """Deep Zoom levels: level 0 is 1x1 and each level doubles up to full size at the top"""
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    levels = []
+    for level in range(max_level + 1):
+        scale = 2 ** (max_level - level)
+        level_width = math.ceil(width / scale)
+        level_height = math.ceil(height / scale)
+        levels.append({
+            'level': level,
+            'width': level_width,
+            'height': level_height,
+            'columns': math.ceil(level_width / tile_size),
+            'rows': math.ceil(level_height / tile_size)
+        })
+    return levels
+
+
+def iter_map_tiles(image_bytes: bytes, rows: int, columns: int, show_grid: bool,
+                   image_format: str = 'png', tile_size: int = TILE_SIZE,
+                   pixels_per_square: int = PIXELS_PER_SQUARE) -> Iterator[Tuple[int, int, int, bytes]]:
+    """Yield (level, column, row, encoded tile) for every tile of the map's pyramid.
+
+    Each tile is resampled straight from the generated image, so the full-size
+    map is never held in memory; peak memory is the source image plus one tile.
+    """
+    source = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    width = columns * pixels_per_square
+    height = rows * pixels_per_square
+
+    for level in reversed(pyramid_levels(width, height, tile_size)):
+        scale_x = source.width / level['width']
+        scale_y = source.height / level['height']
+        spacing = pixels_per_square * level['width'] / width
+        grid = show_grid and spacing >= MIN_GRID_SPACING
+
+        for tile_row in range(level['rows']):
+            for tile_column in range(level['columns']):
+                x0 = tile_column * tile_size
+                y0 = tile_row * tile_size
+                x1 = min(x0 + tile_size, level['width'])
+                y1 = min(y0 + tile_size, level['height'])
+                tile = source.resize(
+                    (x1 - x0, y1 - y0), Image.LANCZOS,
+                    box=(x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y)
+                )
+                if grid:
+                    draw = ImageDraw.Draw(tile)
+                    for x in _grid_lines(columns, spacing, x0, x1):
+                        draw.line([(x, 0), (x, y1 - y0)], fill=(0, 0, 0), width=1)
+                    for y in _grid_lines(rows, spacing, y0, y1):
+                        draw.line([(0, y), (x1 - x0, y)], fill=(0, 0, 0), width=1)
+                yield level['level'], tile_column, tile_row, encode_image(tile, image_format)
+
+
+def _grid_lines(squares: int, spacing: float, start: int, end: int) -> list:
+    """Grid line offsets that fall inside the tile span [start, end)"""
+    positions = (round(i * spacing) for i in range(squares + 1))
+    return [p - start for p in positions if start <= p < end]
+
+
+def upload_map_tiles(bucket, prefix: str, image_bytes: bytes, rows: int, columns: int,
+                     show_grid: bool, image_format: str = 'png', tile_size: int = TILE_SIZE,
+                     progress=None) -> Dict:
+    """Render the map as a Deep Zoom pyramid and upload it under `prefix`.
+
+    Tiles are uploaded in parallel as they are rendered, with a bound on how
+    many encoded tiles may wait for upload at once. Writes `<prefix>/map.dzi`,
+    `<prefix>/map_files/{level}/{column}_{row}.<format>` and
+    `<prefix>/manifest.json`, and returns the manifest.
+    """
+    progress = progress or (lambda percent, message=None: None)
+    width = columns * PIXELS_PER_SQUARE
+    height = rows * PIXELS_PER_SQUARE
+    levels = pyramid_levels(width, height, tile_size)
+    total_tiles = sum(level['columns'] * level['rows'] for level in levels)
+    content_type = IMAGE_FORMATS[image_format]
+
+    in_flight = threading.BoundedSemaphore(TILE_UPLOAD_WORKERS * 2)
+    errors = []
+
+    def upload(name: str, data: bytes):
+        try:
+            bucket.blob(name).upload_from_string(data, content_type=content_type)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            in_flight.release()
 
-def save_map_to_storage(image_bytes: bytes) -> str:
+    with ThreadPoolExecutor(max_workers=TILE_UPLOAD_WORKERS, thread_name_prefix="map-tiles") as uploader:
+        tiles = iter_map_tiles(image_bytes, rows, columns, show_grid, image_format, tile_size)
+        for count, (level, tile_column, tile_row, data) in enumerate(tiles, start=1):
+            if errors:
+                break
+            in_flight.acquire()
+            uploader.submit(upload, f"{prefix}/map_files/{level}/{tile_column}_{tile_row}.{image_format}", data)
+            if count % 100 == 0:
+                progress(round(100 * count / total_tiles), f"Rendered {count}/{total_tiles} tiles")
+    if errors:
+        raise errors[0]
+
+    dzi = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile_size}" '
+        f'Overlap="0" Format="{image_format}"><Size Width="{width}" Height="{height}"/></Image>'
+    )
+    bucket.blob(f"{prefix}/map.dzi").upload_from_string(dzi, content_type="application/xml")
+
+    base_url = f"{PUBLIC_URL_BASE}/{prefix}"
+    # Largest level that still fits in one tile, usable as a thumbnail
+    preview_level = max(level['level'] for level in levels if level['columns'] == level['rows'] == 1)
+    manifest = {
+        'format': 'dzi',
+        'dzi_url': f"{base_url}/map.dzi",
+        'tile_url_template': f"{base_url}/map_files/{{z}}/{{x}}_{{y}}.{image_format}",
+        'preview_url': f"{base_url}/map_files/{preview_level}/0_0.{image_format}",
+        'tile_size': tile_size,
+        'overlap': 0,
+        'content_type': content_type,
+        'width': width,
+        'height': height,
+        'min_level': 0,
+        'max_level': levels[-1]['level'],
+        'levels': levels,
+        'tile_count': total_tiles
+    }
+    bucket.blob(f"{prefix}/manifest.json").upload_from_string(
+        json.dumps(manifest), content_type="application/json")
+    return manifest
+
+
+def upload_map_tiles_in_pool(*args, **kwargs) -> Dict:
+    """Run upload_map_tiles on the map render pool and wait for the result"""
+    return render_pool.submit(upload_map_tiles, *args, **kwargs).result()
+
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def map_bucket(storage_client=None):
+    """The public map bucket, from one Storage client shared by every request"""
+    global _bucket
+    if _bucket is None:
+        with _bucket_lock:
+            if _bucket is None:
+                _bucket = (storage_client or storage.Client()).bucket(MAP_BUCKET)
+    return _bucket
+
+
+def base_map_key(prompt: str, style: str, model: str = IMAGEN_MODEL) -> str:
+    return hashlib.sha256(json.dumps([prompt, style, model]).encode('utf-8')).hexdigest()[:32]
+
+
+class BaseMapCache:
+    """Generated base images, content-addressed by hash(prompt, style, model).
+
+    Bases live in the bucket under maps/base/ so every instance can reuse them,
+    with the most recent ones also kept in memory. Each base is returned with
+    the digest of its bytes, which names the grid/format variants rendered
+    from it, so regenerating a base never serves variants of the old one.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._bases = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket, key: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            if key in self._bases:
+                self._bases.move_to_end(key)
+                return self._bases[key]
+        try:
+            image_bytes = bucket.blob(f"maps/base/{key}.png").download_as_bytes()
+        except NotFound:
+            return None
+        return self._remember(key, image_bytes)
+
+    def put(self, bucket, key: str, image_bytes: bytes) -> Tuple[bytes, str]:
+        bucket.blob(f"maps/base/{key}.png").upload_from_string(image_bytes, content_type="image/png")
+        return self._remember(key, image_bytes)
+
+    def _remember(self, key: str, image_bytes: bytes) -> Tuple[bytes, str]:
+        base = (image_bytes, hashlib.sha256(image_bytes).hexdigest()[:16])
+        with self._lock:
+            self._bases[key] = base
+            self._bases.move_to_end(key)
+            while len(self._bases) > self.max_entries:
+                self._bases.popitem(last=False)
+        return base
+
+
+def variant_name(digest: str, rows: int, columns: int, show_grid: bool) -> str:
+    """Name of a map rendered from the base with the given digest"""
+    return f"{digest}_{columns}x{rows}{'_grid' if show_grid else ''}"
+
+
+# Uploaded object names seen recently, so repeat requests skip the exists() round trip
+KNOWN_OBJECTS_MAX = int(os.getenv("MAP_KNOWN_OBJECTS_MAX", "4096"))
+_known_objects = OrderedDict()
+_known_objects_lock = threading.Lock()
+
+
+def object_exists(bucket, name: str) -> bool:
+    """Whether a content-addressed object is already uploaded (remembered once seen)"""
+    with _known_objects_lock:
+        if name in _known_objects:
+            _known_objects.move_to_end(name)
+            return True
+    if bucket.blob(name).exists():
+        remember_object(name)
+        return True
+    return False
+
+
+def remember_object(name: str):
+    with _known_objects_lock:
+        _known_objects[name] = True
+        _known_objects.move_to_end(name)
+        while len(_known_objects) > KNOWN_OBJECTS_MAX:
+            _known_objects.popitem(last=False)
+
+
+def save_map_to_storage(image_bytes: bytes, storage_client=None) -> str:
     """Save map image to Cloud Storage and return public URL"""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket("dnd-dm-assistant-web")
-    
+    bucket = map_bucket(storage_client)
+
     # Generate unique filename
     filename = f"maps/map_{uuid.uuid4().hex[:8]}.png"
     blob = bucket.blob(filename)
-    
+
     # Upload with public read access via metadata
     blob.upload_from_string(
-        image_bytes, 
+        image_bytes,
         content_type="image/png"
     )
-    
+
     # Return the public URL (bucket is already public)
     public_url = f"https://storage.googleapis.com/dnd-dm-assistant-web/{filename}"
     return public_url
@@ -0,0 +1,149 @@
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.utils.npc_parser import parse_npc_text, STATS
+
+# Bump when parse_npc_text output changes so a re-run re-parses every document
+PARSER_VERSION = 2
+
+CHECKPOINT_DOC = ('campaign_meta', 'npc_backfill')
+
+# Firestore batches are limited to 500 writes
+MAX_BATCH_WRITES = 500
+
+_STAT_KEYS = [stat.lower() for stat in STATS]
+_FIRST_NUMBER_RE = re.compile(r'\d+')
+
+
+def structure_npc(content: str) -> Optional[Dict]:
+    """Parse raw NPC text into queryable fields: numbers become ints so they can be filtered and sorted"""
+    parsed = parse_npc_text(content)
+    if not parsed:
+        return None
+    for key in ['level'] + _STAT_KEYS:
+        if key in parsed:
+            number = _FIRST_NUMBER_RE.search(parsed[key])
+            if number:
+                parsed[key] = int(number.group())
+            else:
+                del parsed[key]
+    return parsed
+
+
+class NPCBackfill:
+    """Adds a `parsed` map (parse_npc_text fields) to NPC documents that only have raw content.
+
+    Streams the collection in document-id order one page at a time, fetching
+    the next page while the current one is parsed in a process pool and written
+    back in batches. The last committed document id is checkpointed in
+    Firestore after every page, so an interrupted run resumes where it stopped;
+    the checkpoint is cleared once a run reaches the end of the collection.
+    """
+
+    def __init__(self, db, collection: str = 'npcs', page_size: int = 500,
+                 workers: int = None, force: bool = False, dry_run: bool = False):
+        self.db = db
+        self.collection = collection
+        self.page_size = min(page_size, MAX_BATCH_WRITES)
+        self.workers = workers
+        self.force = force
+        self.dry_run = dry_run
+        self.checkpoint_ref = db.collection(CHECKPOINT_DOC[0]).document(CHECKPOINT_DOC[1])
+
+    # ---- Checkpoint ----
+
+    def load_checkpoint(self) -> Dict:
+        doc = self.checkpoint_ref.get()
+        checkpoint = doc.to_dict() if doc.exists else None
+        if not checkpoint or checkpoint.get('parser_version') != PARSER_VERSION:
+            return {'last_id': None, 'processed': 0, 'updated': 0}
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint: Dict):
+        if not self.dry_run:
+            self.checkpoint_ref.set({**checkpoint, 'parser_version': PARSER_VERSION,
+                                     'updated_at': datetime.utcnow()})
+
+    def reset_checkpoint(self):
+        self.checkpoint_ref.delete()
+
+    # ---- Run ----
+
+    def _fetch_page(self, last_id: Optional[str]) -> list:
+        query = (self.db.collection(self.collection)
+                 .select(['content', 'name', 'parser_version'])
+                 .order_by('__name__')
+                 .limit(self.page_size))
+        if last_id:
+            query = query.start_after({'__name__': last_id})
+        return list(query.stream())
+
+    def _needs_parsing(self, data: Dict) -> bool:
+        return bool(data.get('content')) and (self.force or data.get('parser_version') != PARSER_VERSION)
+
+    def run(self, restart: bool = False, limit: int = None) -> Dict:
+        checkpoint = {'last_id': None, 'processed': 0, 'updated': 0} if restart else self.load_checkpoint()
+        if checkpoint['last_id']:
+            print(f"Resuming after {checkpoint['last_id']} ({checkpoint['processed']} already processed)")
+
+        started = time.perf_counter()
+        run_processed = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers) as parser_pool, \
+                ThreadPoolExecutor(max_workers=1) as fetcher:
+            next_page = fetcher.submit(self._fetch_page, checkpoint['last_id'])
+            while True:
+                page = next_page.result()
+                if not page:
+                    break
+                # Fetch the following page while this one is parsed and written
+                next_page = fetcher.submit(self._fetch_page, page[-1].id)
+
+                docs = [(doc, doc.to_dict()) for doc in page]
+                pending = [(doc, data) for doc, data in docs if self._needs_parsing(data)]
+                chunksize = max(1, len(pending) // (4 * (self.workers or 4)))
+                parsed_docs = parser_pool.map(structure_npc, [data['content'] for _, data in pending],
+                                              chunksize=chunksize)
+
+                batch = self.db.batch()
+                updated = 0
+                for (doc, data), parsed in zip(pending, parsed_docs):
+                    fields = {'parser_version': PARSER_VERSION}
+                    if parsed:
+                        fields['parsed'] = parsed
+                        if not data.get('name') and parsed.get('name'):
+                            fields['name'] = parsed['name']
+                        updated += 1
+                    batch.update(doc.reference, fields)
+                if pending and not self.dry_run:
+                    batch.commit()
+
+                checkpoint['last_id'] = page[-1].id
+                checkpoint['processed'] += len(page)
+                checkpoint['updated'] += updated
+                self.save_checkpoint(checkpoint)
+
+                run_processed += len(page)
+                elapsed = time.perf_counter() - started
+                print(f"{checkpoint['processed']} docs processed, {checkpoint['updated']} structured "
+                      f"({run_processed / elapsed:.0f} docs/sec)")
+
+                if limit and run_processed >= limit:
+                    next_page.cancel()
+                    break
+
+        complete = not (limit and run_processed >= limit)
+        if complete and not self.dry_run:
+            # The next run starts from the beginning and skips documents already at this version
+            self.reset_checkpoint()
+
+        elapsed = time.perf_counter() - started
+        return {
+            **checkpoint,
+            'seconds': round(elapsed, 1),
+            'docs_per_second': round(run_processed / elapsed, 1) if elapsed else None,
+            'complete': complete
+        }
@@ -0,0 +1,298 @@
+import math
+import re
+from fractions import Fraction
+from typing import Dict, Optional
+
+from app.rag.monster_table import action_entries, cr_fraction
+
+# Deterministic 5e numbers (modifiers, proficiency, HP, AC, CR tables) so generation
+# prompts only have to ask the model for narrative and choices.
+
+ABILITIES = ('str', 'dex', 'con', 'int', 'wis', 'cha')
+STANDARD_ARRAY = (15, 14, 13, 12, 10, 8)
+
+SIZE_HIT_DIE = {
+    'tiny': 4,
+    'small': 6,
+    'medium': 8,
+    'large': 10,
+    'huge': 12,
+    'gargantuan': 20
+}
+
+# hit die, saving throw proficiencies, ability priority for the standard array,
+# armor (name, base AC, max Dex bonus or None, shield), spellcasting ability
+CLASSES = {
+    'barbarian': (12, ('str', 'con'), ('str', 'con', 'dex', 'wis', 'cha', 'int'), ('unarmored defense', 10, None, False), None),
+    'bard':      (8, ('dex', 'cha'), ('cha', 'dex', 'con', 'wis', 'int', 'str'), ('studded leather', 12, None, False), 'cha'),
+    'cleric':    (8, ('wis', 'cha'), ('wis', 'con', 'str', 'dex', 'cha', 'int'), ('scale mail, shield', 14, 2, True), 'wis'),
+    'druid':     (8, ('int', 'wis'), ('wis', 'con', 'dex', 'int', 'cha', 'str'), ('leather, shield', 11, None, True), 'wis'),
+    'fighter':   (10, ('str', 'con'), ('str', 'con', 'dex', 'wis', 'cha', 'int'), ('chain mail, shield', 16, 0, True), None),
+    'monk':      (8, ('str', 'dex'), ('dex', 'wis', 'con', 'str', 'int', 'cha'), ('unarmored defense', 10, None, False), None),
+    'paladin':   (10, ('wis', 'cha'), ('str', 'cha', 'con', 'wis', 'dex', 'int'), ('chain mail, shield', 16, 0, True), 'cha'),
+    'ranger':    (10, ('str', 'dex'), ('dex', 'wis', 'con', 'str', 'int', 'cha'), ('studded leather', 12, None, False), 'wis'),
+    'rogue':     (8, ('dex', 'int'), ('dex', 'con', 'wis', 'int', 'cha', 'str'), ('studded leather', 12, None, False), None),
+    'sorcerer':  (6, ('con', 'cha'), ('cha', 'con', 'dex', 'wis', 'int', 'str'), ('no armor', 10, None, False), 'cha'),
+    'warlock':   (8, ('wis', 'cha'), ('cha', 'con', 'dex', 'wis', 'int', 'str'), ('leather', 11, None, False), 'cha'),
+    'wizard':    (6, ('int', 'wis'), ('int', 'con', 'dex', 'wis', 'cha', 'str'), ('no armor', 10, None, False), 'int'),
+    'artificer': (8, ('con', 'int'), ('int', 'con', 'dex', 'wis', 'cha', 'str'), ('scale mail, shield', 14, 2, True), 'int'),
+}
+
+ASI_LEVELS = (4, 8, 12, 16, 19)
+EXTRA_ASI_LEVELS = {'fighter': (6, 14), 'rogue': (10,)}
+
+# DMG "Monster Statistics by Challenge Rating":
+# CR -> (XP, proficiency, AC, HP range, attack bonus, damage per round range, save DC)
+CR_TABLE = {
+    Fraction(0):    (10, 2, 13, (1, 6), 3, (0, 1), 13),
+    Fraction(1, 8): (25, 2, 13, (7, 35), 3, (2, 3), 13),
+    Fraction(1, 4): (50, 2, 13, (36, 49), 3, (4, 5), 13),
+    Fraction(1, 2): (100, 2, 13, (50, 70), 3, (6, 8), 13),
+    Fraction(1):    (200, 2, 13, (71, 85), 3, (9, 14), 13),
+    Fraction(2):    (450, 2, 13, (86, 100), 3, (15, 20), 13),
+    Fraction(3):    (700, 2, 13, (101, 115), 4, (21, 26), 13),
+    Fraction(4):    (1100, 2, 14, (116, 130), 5, (27, 32), 14),
+    Fraction(5):    (1800, 3, 15, (131, 145), 6, (33, 38), 15),
+    Fraction(6):    (2300, 3, 15, (146, 160), 6, (39, 44), 15),
+    Fraction(7):    (2900, 3, 15, (161, 175), 6, (45, 50), 15),
+    Fraction(8):    (3900, 3, 16, (176, 190), 7, (51, 56), 16),
+    Fraction(9):    (5000, 4, 16, (191, 205), 7, (57, 62), 16),
+    Fraction(10):   (5900, 4, 17, (206, 220), 7, (63, 68), 16),
+    Fraction(11):   (7200, 4, 17, (221, 235), 8, (69, 74), 17),
+    Fraction(12):   (8400, 4, 17, (236, 250), 8, (75, 80), 17),
+    Fraction(13):   (10000, 5, 18, (251, 265), 8, (81, 86), 18),
+    Fraction(14):   (11500, 5, 18, (266, 280), 8, (87, 92), 18),
+    Fraction(15):   (13000, 5, 18, (281, 295), 8, (93, 98), 18),
+    Fraction(16):   (15000, 5, 18, (296, 310), 9, (99, 104), 18),
+    Fraction(17):   (18000, 6, 19, (311, 325), 10, (105, 110), 19),
+    Fraction(18):   (20000, 6, 19, (326, 340), 10, (111, 116), 19),
+    Fraction(19):   (22000, 6, 19, (341, 355), 10, (117, 122), 19),
+    Fraction(20):   (25000, 6, 19, (356, 400), 10, (123, 140), 19),
+    Fraction(21):   (33000, 7, 19, (401, 445), 11, (141, 158), 20),
+    Fraction(22):   (41000, 7, 19, (446, 490), 11, (159, 176), 20),
+    Fraction(23):   (50000, 7, 19, (491, 535), 11, (177, 194), 20),
+    Fraction(24):   (62000, 7, 19, (536, 580), 12, (195, 212), 21),
+    Fraction(25):   (75000, 8, 19, (581, 625), 12, (213, 230), 21),
+    Fraction(26):   (90000, 8, 19, (626, 670), 12, (231, 248), 21),
+    Fraction(27):   (105000, 8, 19, (671, 715), 13, (249, 266), 22),
+    Fraction(28):   (120000, 8, 19, (716, 760), 13, (267, 284), 22),
+    Fraction(29):   (135000, 9, 19, (761, 805), 13, (285, 302), 22),
+    Fraction(30):   (155000, 9, 19, (806, 850), 14, (303, 320), 23),
+}
+
+
+def ability_modifier(score: int) -> int:
+    return (score - 10) // 2
+
+
+def proficiency_bonus(level: int) -> int:
+    return 2 + (max(1, level) - 1) // 4
+
+
+def parse_cr(cr) -> Fraction:
+    """Accept '1/4', '0.25', 0.25 or 5; raises ValueError for anything off the CR table"""
+    value = cr_fraction(cr).limit_denominator(8)
+    if value not in CR_TABLE:
+        raise ValueError(f"Unknown challenge rating: {cr}")
+    return value
+
+
+def format_cr(cr: Fraction) -> str:
+    return str(cr.numerator) if cr.denominator == 1 else f"{cr.numerator}/{cr.denominator}"
+
+
+def xp_for_cr(cr) -> int:
+    return CR_TABLE[parse_cr(cr)][0]
+
+
+def _signed(value: int) -> str:
+    return f"+{value}" if value >= 0 else str(value)
+
+
+def _abilities(scores: Dict[str, int]) -> Dict[str, Dict]:
+    return {ability: {'score': scores[ability], 'modifier': ability_modifier(scores[ability])}
+            for ability in ABILITIES}
+
+
+def character_stat_block(character_class: str, level: int) -> Dict:
+    """Stat block for a classed NPC: standard array by class priority, ASIs, HP, AC, saves"""
+    key = character_class.lower().split()[0] if character_class else ''
+    if key not in CLASSES:
+        raise ValueError(f"Unknown class: {character_class}")
+    level = max(1, min(int(level), 20))
+    hit_die, save_proficiencies, priority, armor, spell_ability = CLASSES[key]
+
+    scores = dict(zip(priority, STANDARD_ARRAY))
+    asi_levels = sorted(ASI_LEVELS + EXTRA_ASI_LEVELS.get(key, ()))
+    for _ in range(sum(1 for asi in asi_levels if asi <= level)):
+        # Each improvement adds two points to the highest-priority scores still below 20
+        points = 2
+        for ability in priority:
+            raised = min(points, 20 - scores[ability])
+            if raised > 0:
+                scores[ability] += raised
+                points -= raised
+            if points == 0:
+                break
+
+    mods = {ability: ability_modifier(score) for ability, score in scores.items()}
+    prof = proficiency_bonus(level)
+
+    armor_name, base_ac, max_dex, shield = armor
+    if key == 'barbarian':
+        armor_class = 10 + mods['dex'] + mods['con']
+    elif key == 'monk':
+        armor_class = 10 + mods['dex'] + mods['wis']
+    else:
+        dex_bonus = mods['dex'] if max_dex is None else min(mods['dex'], max_dex)
+        armor_class = base_ac + dex_bonus + (2 if shield else 0)
+
+    hit_points = hit_die + mods['con'] + (level - 1) * (hit_die // 2 + 1 + mods['con'])
+    attack_ability = 'dex' if scores['dex'] > scores['str'] else 'str'
+
+    block = {
+        'kind': 'character',
+        'class': key,
+        'level': level,
+        'proficiency_bonus': prof,
+        'abilities': _abilities(scores),
+        'saving_throws': {ability: mods[ability] + prof for ability in save_proficiencies},
+        'armor_class': armor_class,
+        'armor': armor_name,
+        'hit_points': max(1, hit_points),
+        'hit_dice': f"{level}d{hit_die}",
+        'initiative': mods['dex'],
+        'passive_perception': 10 + mods['wis'],
+        'attack_bonus': prof + mods[attack_ability]
+    }
+    if spell_ability:
+        block['spellcasting_ability'] = spell_ability
+        block['spell_save_dc'] = 8 + prof + mods[spell_ability]
+        block['spell_attack_bonus'] = prof + mods[spell_ability]
+    return block
+
+
+def creature_stat_block(cr, size: str = 'medium', attack_ability: str = 'str',
+                        spell_ability: Optional[str] = None) -> Dict:
+    """Stat block numbers for a creature of the given CR, following the DMG targets"""
+    value = parse_cr(cr)
+    xp, prof, armor_class, hp_range, attack_bonus, damage_range, save_dc = CR_TABLE[value]
+    hit_die = SIZE_HIT_DIE.get((size or 'medium').lower(), 8)
+
+    # Ability scores that make the table's attack bonus and save DC come out of the usual formulas
+    attack_mod = max(0, attack_bonus - prof)
+    spell_mod = max(0, save_dc - 8 - prof)
+    con_mod = min(attack_mod, 5) if value >= 1 else 0
+    scores = {'str': 10, 'dex': 12, 'con': 10 + 2 * con_mod, 'int': 8, 'wis': 10, 'cha': 8}
+    scores[attack_ability] = max(scores[attack_ability], 10 + 2 * attack_mod)
+    if spell_ability:
+        scores[spell_ability] = max(scores[spell_ability], 10 + 2 * spell_mod)
+    mods = {ability: ability_modifier(score) for ability, score in scores.items()}
+
+    # Enough hit dice to land in the middle of the CR's HP range
+    target_hp = sum(hp_range) / 2
+    average_die = hit_die / 2 + 0.5
+    dice = max(1, round(target_hp / (average_die + mods['con'])))
+    hit_points = max(1, math.floor(dice * average_die) + dice * mods['con'])
+    con_total = dice * mods['con']
+    hit_dice = f"{dice}d{hit_die}" + (f" {'+' if con_total >= 0 else '-'} {abs(con_total)}" if con_total else "")
+
+    block = {
+        'kind': 'creature',
+        'cr': format_cr(value),
+        'xp': xp,
+        'size': (size or 'medium').lower(),
+        'proficiency_bonus': prof,
+        'abilities': _abilities(scores),
+        'saving_throws': {},
+        'armor_class': armor_class,
+        'hit_points': hit_points,
+        'hit_dice': hit_dice,
+        'initiative': mods['dex'],
+        'passive_perception': 10 + mods['wis'],
+        'attack_bonus': attack_bonus,
+        'damage_per_round': list(damage_range),
+        'save_dc': save_dc
+    }
+    if spell_ability:
+        block['spellcasting_ability'] = spell_ability
+    return block
+
+
+_ATTACK_BONUS_RE = re.compile(r'\+(\d+)(?= to hit)|Attack Roll:\s*\+(\d+)')
+_SAVE_DC_RE = re.compile(r'\bDC (\d+)')
+
+
+def monster_stat_block(monster: Dict) -> Dict:
+    """Stat block for a parsed Monster Manual entry: its own numbers, CR-table targets for the rest"""
+    block = creature_stat_block(monster['cr'], monster.get('size', 'medium'))
+    if monster.get('abilities'):
+        scores = {ability: monster['abilities'].get(ability, 10) for ability in ABILITIES}
+        block['abilities'] = _abilities(scores)
+        block['initiative'] = ability_modifier(scores['dex'])
+        block['passive_perception'] = 10 + ability_modifier(scores['wis'])
+    perception = re.search(r'passive Perception (\d+)', monster.get('senses', ''), re.IGNORECASE)
+    if perception:
+        block['passive_perception'] = int(perception.group(1))
+    block.update({
+        'name': monster['name'],
+        'armor_class': monster['armor_class'],
+        'hit_points': monster['hit_points'],
+        'hit_dice': monster.get('hit_dice') or block['hit_dice']
+    })
+    if monster.get('armor'):
+        block['armor'] = monster['armor']
+    # The published actions carry the real to-hit and save DC; only "Name. ..." entries count,
+    # so a DC in a section's introduction or stray prose isn't taken for the creature's
+    actions = ' '.join(entry for _, entry in action_entries(monster.get('actions', '')))
+    attack_bonuses = [int(to_hit or roll) for to_hit, roll in _ATTACK_BONUS_RE.findall(actions)]
+    save_dcs = [int(dc) for dc in _SAVE_DC_RE.findall(actions)]
+    if attack_bonuses:
+        block['attack_bonus'] = max(attack_bonuses)
+    if save_dcs:
+        block['save_dc'] = max(save_dcs)
+    return block
+
+
+def render_stat_block(block: Dict) -> str:
+    """Plain-text stat block, in the 'Label: value' lines parse_npc_text understands"""
+    lines = ["Stat Block", ""]
+    if block['kind'] == 'character':
+        lines.append(f"Level: {block['level']} ({block['class'].title()})")
+    armor = f" ({block['armor']})" if block.get('armor') else ""
+    lines.append(f"Armor Class: {block['armor_class']}{armor}")
+    lines.append(f"Hit Points: {block['hit_points']} ({block['hit_dice']})")
+    lines.append(f"Proficiency Bonus: {_signed(block['proficiency_bonus'])}")
+    lines.append(f"Initiative: {_signed(block['initiative'])}")
+    lines.append("")
+    for ability in ABILITIES:
+        stat = block['abilities'][ability]
+        lines.append(f"{ability.title()}: {stat['score']} ({_signed(stat['modifier'])})")
+    lines.append("")
+    if block['saving_throws']:
+        lines.append("Saving Throws: " + ", ".join(
+            f"{ability.title()} {_signed(bonus)}" for ability, bonus in block['saving_throws'].items()))
+    lines.append(f"Senses: Passive Perception {block['passive_perception']}")
+    lines.append(f"Attack Bonus: {_signed(block['attack_bonus'])}")
+    if 'spell_save_dc' in block:
+        lines.append(f"Spell Save DC: {block['spell_save_dc']}, spell attack {_signed(block['spell_attack_bonus'])}")
+    if block['kind'] == 'creature':
+        lines.append(f"Save DC: {block['save_dc']}")
+        lines.append(f"Challenge: {block['cr']} ({block['xp']:,} XP)")
+    return "\n".join(lines)
+
+
+def stat_block_prompt(block: Dict) -> str:
+    """Compact summary of the computed numbers for a generation prompt"""
+    abilities = ", ".join(f"{ability.upper()} {stat['score']} ({_signed(stat['modifier'])})"
+                          for ability, stat in block['abilities'].items())
+    parts = [f"AC {block['armor_class']}", f"HP {block['hit_points']} ({block['hit_dice']})",
+             f"proficiency {_signed(block['proficiency_bonus'])}", abilities,
+             f"attack bonus {_signed(block['attack_bonus'])}"]
+    if 'spell_save_dc' in block:
+        parts.append(f"spell save DC {block['spell_save_dc']}")
+    if block['kind'] == 'creature':
+        low, high = block['damage_per_round']
+        parts += [f"save DC {block['save_dc']}", f"damage per round {low}-{high}",
+                  f"CR {block['cr']} ({block['xp']} XP)"]
+    return "; ".join(parts)
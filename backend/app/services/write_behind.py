@@ -0,0 +1,156 @@
+import queue
+import threading
+import time
+
+from google.api_core.exceptions import FailedPrecondition, InvalidArgument
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_MAX_BATCH = 500
+
+# Errors caused by a write in the batch rather than the service; retrying the same batch can't succeed
+_BAD_WRITE_ERRORS = (InvalidArgument, FailedPrecondition)
+
+
+class WriteBehindQueue:
+    """Buffers Firestore document sets and commits them in batches off the request path.
+
+    Document references are allocated by the caller (``collection.document()``
+    generates the ID client-side), so the API can return the ID immediately and
+    the write lands within ``flush_interval`` seconds.
+    """
+
+    def __init__(self, db, max_batch_size: int = 100, flush_interval: float = 1.0,
+                 max_retries: int = 3, retry_backoff: float = 0.5, max_retry_seconds: float = 10.0):
+        self.db = db
+        self.max_batch_size = min(max_batch_size, FIRESTORE_MAX_BATCH)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_seconds = max_retry_seconds
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the background flush thread (idempotent)"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, doc_ref, data: dict, merge: bool = False):
+        """Queue a document set; returns the document ID right away"""
+        self._queue.put({'ref': doc_ref, 'data': data, 'merge': merge})
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        return doc_ref.id
+
+    def flush(self):
+        """Block until every queued write has been committed or given up on"""
+        if self._thread and self._thread.is_alive():
+            self._queue.join()
+        else:
+            self._drain()
+
+    def stop(self, timeout: float = 10.0):
+        """Flush pending writes and stop the background thread"""
+        self._stopping.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        self._drain()
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._queue.qsize(),
+            'written': self.written,
+            'failed': self.failed
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._commit(batch)
+
+    def _collect(self):
+        """Wait for a first write, then gather more until the batch fills or the interval passes"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        items = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _drain(self):
+        """Commit everything still queued on the calling thread"""
+        while True:
+            items = []
+            while len(items) < self.max_batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not items:
+                return
+            self._commit(items)
+
+    def _commit(self, items):
+        """Commit one batch of queued writes, retrying or splitting it for at most max_retry_seconds"""
+        try:
+            self._commit_or_split(items, time.monotonic() + self.max_retry_seconds)
+        finally:
+            for _ in items:
+                self._queue.task_done()
+
+    def _commit_or_split(self, items, deadline: float):
+        """Commit items as one batch.
+
+        A transient failure retries the whole batch with backoff; a rejected
+        write (invalid data, failed precondition) halves the batch instead so
+        the bad write can't sink the others. Writes still failing at the
+        deadline are given up on, so an outage can't stall the flush thread.
+        """
+        attempt = 0
+        while True:
+            try:
+                batch = self.db.batch()
+                for item in items:
+                    batch.set(item['ref'], item['data'], merge=item['merge'])
+                batch.commit()
+                self.written += len(items)
+                return
+            except _BAD_WRITE_ERRORS as e:
+                if len(items) > 1:
+                    print(f"Write-behind batch of {len(items)} was rejected, splitting it: {e}")
+                    middle = len(items) // 2
+                    self._commit_or_split(items[:middle], deadline)
+                    self._commit_or_split(items[middle:], deadline)
+                    return
+                self.failed += 1
+                print(f"Giving up on write to {items[0]['ref'].path}, it was rejected: {e}")
+                return
+            except Exception as e:
+                attempt += 1
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                if attempt > self.max_retries or time.monotonic() + delay > deadline:
+                    self.failed += len(items)
+                    print(f"Giving up on write-behind batch of {len(items)} after {attempt} attempts: {e}")
+                    return
+                print(f"Write-behind batch of {len(items)} failed, retrying in {delay}s: {e}")
+                time.sleep(delay)
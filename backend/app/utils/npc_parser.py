@@ -1,117 +1,115 @@
 import re
 
+# Labels whose value is the rest of the line
+LINE_FIELDS = {
+    'NPC Name': 'name',
+    'Race': 'race',
+    'Class': 'class',
+    'Alignment': 'alignment',
+    'Level': 'level',
+    'Saving Throws': 'saving_throws',
+    'Skills': 'skills',
+    'Senses': 'senses',
+    'Languages': 'languages',
+}
+
+# Labels whose value runs until a blank line or the next label
+TEXT_SECTIONS = {
+    'World Placement': 'world_placement',
+    'Physical Description': 'physical_description',
+    'Voice Suggestions': 'voice_suggestions',
+    'Personality Traits': 'personality_traits',
+    'Background': 'background',
+    'Abilities': 'abilities',
+    'Actions': 'actions',
+}
+
+STATS = ('Str', 'Dex', 'Con', 'Int', 'Wis', 'Cha')
+
+# Sections written as markdown bullet lists, flattened to "• " bullets for the template
+BULLETED_SECTIONS = {'personality_traits', 'abilities', 'actions'}
+
+# label -> (kind, key) for the line-start lookup
+_LABEL_KEYS = {label: ('line', key) for label, key in LINE_FIELDS.items()}
+_LABEL_KEYS.update({label: ('section', key) for label, key in TEXT_SECTIONS.items()})
+_LABEL_KEYS.update({stat: ('stat', stat.lower()) for stat in STATS})
+
+# Markdown that may surround a label ("**Race:** Elf", "- Race: Elf", "### Actions:")
+_LABEL_MARKUP = ' \t>#*_-'
+
+_STAT_RE = re.compile(r'\b(Str|Dex|Con|Int|Wis|Cha):\s*(\d+)')
+_BULLET_RE = re.compile(r'\*\s+\*\*')
+
+
+def _store_section(data: dict, key: str, lines: list):
+    value = '\n'.join(lines).strip()
+    if key in BULLETED_SECTIONS:
+        value = _BULLET_RE.sub('• ', value).replace('**', '')
+    if value and key not in data:
+        data[key] = value
+
+
 def parse_npc_text(text: str) -> dict:
-    """Parse the generated NPC text into structured data for the template"""
+    """Parse the generated NPC text into structured data for the template.
+
+    Single pass over the lines: a line starting with a known label (looked up
+    by the text before its first colon) sets a field or opens a section.
+    Sections collect lines until a blank line or the next label; Actions runs
+    to the end of the text. The first occurrence of a label wins.
+    """
     data = {}
-    
-    # Extract basic info
-    name_match = re.search(r'NPC Name:\s*(.+?)(?:\n|$)', text)
-    if name_match:
-        data['name'] = name_match.group(1).strip()
-    
-    race_match = re.search(r'Race:\s*(.+?)(?:\n|$)', text)
-    if race_match:
-        data['race'] = race_match.group(1).strip()
-    
-    class_match = re.search(r'Class:\s*(.+?)(?:\n|$)', text)
-    if class_match:
-        data['class'] = class_match.group(1).strip()
-    
-    alignment_match = re.search(r'Alignment:\s*(.+?)(?:\n|$)', text)
-    if alignment_match:
-        data['alignment'] = alignment_match.group(1).strip()
-    
-    level_match = re.search(r'Level:\s*(.+?)(?:\n|$)', text)
-    if level_match:
-        data['level'] = level_match.group(1).strip()
-    
-    # Extract World Placement
-    world_match = re.search(r'World Placement:\s*(.+?)(?:\n\n|\nPhysical)', text, re.DOTALL)
-    if world_match:
-        data['world_placement'] = world_match.group(1).strip()
-    
-    # Extract Physical Description
-    phys_match = re.search(r'Physical Description:\s*(.+?)(?:\n\n|\nVoice)', text, re.DOTALL)
-    if phys_match:
-        data['physical_description'] = phys_match.group(1).strip()
-    
-    # Extract Voice Suggestions
-    voice_match = re.search(r'Voice Suggestions:\s*(.+?)(?:\n\n|\nPersonality)', text, re.DOTALL)
-    if voice_match:
-        data['voice_suggestions'] = voice_match.group(1).strip()
-    
-    # Extract and format Personality Traits
-    personality_match = re.search(r'Personality Traits:\s*(.+?)(?:\n\n|\nBackground)', text, re.DOTALL)
-    if personality_match:
-        traits_text = personality_match.group(1).strip()
-        traits_text = re.sub(r'\*\s+\*\*', '• ', traits_text)
-        traits_text = traits_text.replace('**', '')
-        data['personality_traits'] = traits_text
-    
-    # Extract Background
-    background_match = re.search(r'Background:\s*(.+?)(?:\n\n|\nStr:|Stat Block)', text, re.DOTALL)
-    if background_match:
-        data['background'] = background_match.group(1).strip()
-    
-    # Extract Stats
-    str_match = re.search(r'Str:\s*(\d+)', text)
-    if str_match:
-        data['str'] = str_match.group(1)
-    
-    dex_match = re.search(r'Dex:\s*(\d+)', text)
-    if dex_match:
-        data['dex'] = dex_match.group(1)
-    
-    con_match = re.search(r'Con:\s*(\d+)', text)
-    if con_match:
-        data['con'] = con_match.group(1)
-    
-    int_match = re.search(r'Int:\s*(\d+)', text)
-    if int_match:
-        data['int'] = int_match.group(1)
-    
-    wis_match = re.search(r'Wis:\s*(\d+)', text)
-    if wis_match:
-        data['wis'] = wis_match.group(1)
-    
-    cha_match = re.search(r'Cha:\s*(\d+)', text)
-    if cha_match:
-        data['cha'] = cha_match.group(1)
-    
-    # Extract Saving Throws
-    saves_match = re.search(r'Saving Throws:\s*(.+?)(?:\n|$)', text)
-    if saves_match:
-        data['saving_throws'] = saves_match.group(1).strip()
-    
-    # Extract Skills
-    skills_match = re.search(r'Skills:\s*(.+?)(?:\n|$)', text)
-    if skills_match:
-        data['skills'] = skills_match.group(1).strip()
-    
-    # Extract Senses
-    senses_match = re.search(r'Senses:\s*(.+?)(?:\n|$)', text)
-    if senses_match:
-        data['senses'] = senses_match.group(1).strip()
-    
-    # Extract Languages
-    lang_match = re.search(r'Languages:\s*(.+?)(?:\n|$)', text)
-    if lang_match:
-        data['languages'] = lang_match.group(1).strip()
-    
-    # Extract and format Abilities
-    abilities_match = re.search(r'Abilities:\s*(.+?)(?:\n\n|\nActions:)', text, re.DOTALL)
-    if abilities_match:
-        abilities_text = abilities_match.group(1).strip()
-        abilities_text = re.sub(r'\*\s+\*\*', '• ', abilities_text)
-        abilities_text = abilities_text.replace('**', '')
-        data['abilities'] = abilities_text
-    
-    # Extract and format Actions
-    actions_match = re.search(r'Actions:\s*(.+?)$', text, re.DOTALL)
-    if actions_match:
-        actions_text = actions_match.group(1).strip()
-        actions_text = re.sub(r'\*\s+\*\*', '• ', actions_text)
-        actions_text = actions_text.replace('**', '')
-        data['actions'] = actions_text
-    
+    lines = text.splitlines()
+    section = None  # key of the multi-line section being collected
+    collected = []
+
+    for i, line in enumerate(lines):
+        colon = line.find(':')
+        label = _LABEL_KEYS.get(line[:colon].strip(_LABEL_MARKUP)) if colon != -1 else None
+
+        if section is not None:
+            if label is None and 'Stat Block' not in line:
+                if line.strip():
+                    collected.append(line)
+                    continue
+                if not collected:
+                    # Blank lines between a label and its text
+                    continue
+            _store_section(data, section, collected)
+            section = None
+
+        if label is None:
+            continue
+
+        kind, key = label
+        value = line[colon + 1:]
+        if value.startswith('**'):
+            value = value[2:]
+
+        if kind == 'line':
+            value = value.strip()
+            if value and key not in data:
+                data[key] = value
+        elif kind == 'stat':
+            # Stat lines may hold several scores ("Str: 8  Dex: 16")
+            for stat, score in _STAT_RE.findall(line):
+                data.setdefault(stat.lower(), score)
+        elif key == 'actions':
+            _store_section(data, key, [value] + lines[i + 1:])
+        else:
+            section = key
+            collected = [value] if value.strip() else []
+
+    if section is not None:
+        _store_section(data, section, collected)
+
     return data
+
+
+def extract_npc_name(text: str) -> str:
+    """Pull just the NPC name out of generated text (markdown or plain format)"""
+    name_match = (re.search(r'\*\*(?:NPC |Creature )?Name:?\*\*:?\s*(.+)', text, re.IGNORECASE) or
+                  re.search(r'^(?:NPC |Creature )?Name:\s*(.+)', text, re.IGNORECASE | re.MULTILINE) or
+                  re.search(r'^#+\s*(.+)', text, re.MULTILINE))
+    if name_match:
+        return name_match.group(1).strip().strip('*#').strip()
+    return None
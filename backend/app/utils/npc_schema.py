@@ -0,0 +1,88 @@
+import json
+from typing import Annotated, Dict, List, Tuple
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, create_model
+
+
+class DriveNPC(BaseModel):
+    """Structured NPC for the Google Doc template; field names are the keys fill_npc_template reads"""
+    model_config = {'populate_by_name': True}
+
+    name: str = Field(min_length=1, description="Full name")
+    race: str = Field(min_length=1, description="Specific race")
+    class_: str = Field(alias='class', min_length=1, description="Class and subclass")
+    alignment: str = Field(min_length=1)
+    level: int = Field(ge=1, le=20)
+    world_placement: str = Field(min_length=1, description="2-3 sentences about location and role")
+    physical_description: str = Field(min_length=1, description="2-3 sentences describing appearance")
+    voice_suggestions: str = Field(min_length=1, description="How they speak")
+    personality_traits: List[str] = Field(min_length=2, description="'Trait: description' entries")
+    background: str = Field(min_length=1, description="2-3 paragraphs about history")
+    str_: int = Field(alias='str', ge=1, le=30)
+    dex: int = Field(ge=1, le=30)
+    con: int = Field(ge=1, le=30)
+    int_: int = Field(alias='int', ge=1, le=30)
+    wis: int = Field(ge=1, le=30)
+    cha: int = Field(ge=1, le=30)
+    saving_throws: str = Field(min_length=1, description="Proficiencies with modifiers")
+    skills: str = Field(min_length=1, description="Proficiencies with modifiers")
+    senses: str = Field(min_length=1, description="Passive Perception and special senses")
+    languages: str = Field(min_length=1)
+    abilities: List[str] = Field(min_length=1, description="'Ability: description' entries")
+    actions: List[str] = Field(min_length=1, description="'Action: attack bonus and damage' entries")
+
+
+# Template key (the field alias, e.g. 'class') -> model field name ('class_')
+TEMPLATE_KEYS = {(field.alias or name): name for name, field in DriveNPC.model_fields.items()}
+
+_FIELD_VALIDATORS = {
+    key: TypeAdapter(Annotated[DriveNPC.model_fields[name].annotation, DriveNPC.model_fields[name]])
+    for key, name in TEMPLATE_KEYS.items()
+}
+
+
+def validate_npc_fields(raw: Dict) -> Tuple[Dict, List[str]]:
+    """Validate each field on its own.
+
+    Returns the fields that passed (converted to their schema types) and the
+    template keys that are missing or invalid, so only those need repairing.
+    """
+    valid = {}
+    missing = []
+    for key, validator in _FIELD_VALIDATORS.items():
+        if key not in raw:
+            missing.append(key)
+            continue
+        try:
+            valid[key] = validator.validate_python(raw[key])
+        except ValidationError:
+            missing.append(key)
+    return valid, missing
+
+
+def parse_npc_json(text: str) -> Dict:
+    """Decode the model's JSON output; anything that isn't a JSON object counts as empty"""
+    try:
+        raw = json.loads(text or '')
+    except ValueError:
+        return {}
+    return raw if isinstance(raw, dict) else {}
+
+
+def repair_schema(missing: List[str]):
+    """A model with only the given fields, used as the response schema for a repair request"""
+    fields = {}
+    for key in missing:
+        field = DriveNPC.model_fields[TEMPLATE_KEYS[key]]
+        fields[TEMPLATE_KEYS[key]] = (field.annotation, field)
+    return create_model('DriveNPCRepair', __config__={'populate_by_name': True}, **fields)
+
+
+def to_template_data(npc: Dict) -> Dict:
+    """Flatten list fields into the '• ' bullet text the template (and parse_npc_text) uses"""
+    data = {}
+    for key, value in npc.items():
+        if isinstance(value, list):
+            value = '\n'.join(f"• {item.replace('**', '').strip().lstrip('•*- ').strip()}" for item in value)
+        data[key] = value
+    return data
@@ -0,0 +1,20 @@
+import json
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # Stop Cloud Run / nginx style proxies from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+def format_sse(data, event: str = None) -> str:
+    """Format a payload as a single server-sent event"""
+    if not isinstance(data, str):
+        data = json.dumps(data, default=str)
+
+    message = ""
+    if event:
+        message += f"event: {event}\n"
+    for line in data.splitlines() or [""]:
+        message += f"data: {line}\n"
+    return message + "\n"
@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Callable, Dict
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class StartupTracker:
+    """Records the state and init time of each service component for /ready"""
+
+    def __init__(self):
+        self._components = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str):
+        with self._lock:
+            self._components.setdefault(name, {'state': PENDING, 'seconds': None, 'error': None})
+
+    def run(self, name: str, factory: Callable):
+        """Call factory(), recording how long it took and whether it failed"""
+        self.register(name)
+        started = time.perf_counter()
+        try:
+            result = factory()
+        except Exception as e:
+            self._set(name, FAILED, started, str(e))
+            raise
+        self._set(name, READY, started)
+        return result
+
+    def _set(self, name: str, state: str, started: float, error: str = None):
+        with self._lock:
+            self._components[name] = {
+                'state': state,
+                'seconds': round(time.perf_counter() - started, 3),
+                'error': error
+            }
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(c['state'] != PENDING for c in self._components.values())
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {name: dict(c) for name, c in self._components.items()}
+
+
+class LazyClient:
+    """Proxy that builds a client on first attribute access.
+
+    Lets module-level names like `db` stay as they are while the client
+    (credential discovery, channel setup) is only created when first used.
+    """
+
+    def __init__(self, name: str, factory: Callable, tracker: StartupTracker):
+        self._name = name
+        self._factory = factory
+        self._tracker = tracker
+        self._client = None
+        self._lock = threading.Lock()
+        tracker.register(name)
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._tracker.run(self._name, self._factory)
+        return self._client
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
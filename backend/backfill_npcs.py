@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Backfill structured fields (parse_npc_text output) onto stored NPC documents.
+
+    python backfill_npcs.py                 # resume from the last checkpoint
+    python backfill_npcs.py --restart       # start over from the first document
+    python backfill_npcs.py --dry-run --limit 2000
+"""
+import argparse
+import os
+
+from google.cloud import firestore
+
+from app.services.npc_backfill import NPCBackfill
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--project", default=os.getenv("GCP_PROJECT_ID", "shattared-meridian-assistant"))
+    parser.add_argument("--page-size", type=int, default=500, help="documents per page and write batch (max 500)")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--limit", type=int, default=None, help="stop after about this many documents")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    parser.add_argument("--force", action="store_true", help="re-parse documents already at the current parser version")
+    parser.add_argument("--dry-run", action="store_true", help="parse without writing documents or the checkpoint")
+    args = parser.parse_args()
+
+    print("Starting NPC backfill...")
+    print(f"Project ID: {args.project}")
+    print()
+
+    backfill = NPCBackfill(
+        firestore.Client(project=args.project),
+        page_size=args.page_size,
+        workers=args.workers,
+        force=args.force,
+        dry_run=args.dry_run
+    )
+    result = backfill.run(restart=args.restart, limit=args.limit)
+
+    print()
+    print(f"✅ {result['processed']} documents processed, {result['updated']} structured "
+          f"in {result['seconds']}s ({result['docs_per_second']} docs/sec)")
+    if not result['complete']:
+        print("Stopped at --limit; run again to continue from the checkpoint.")
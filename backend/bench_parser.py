@@ -0,0 +1,23 @@
+import random
+import timeit
+
+from app.utils.npc_parser import parse_npc_text
+from test_parser_fuzz import legacy_parse_npc_text, make_npc_text
+
+# Compare the single-pass parser against the previous regex-per-field parser
+
+rng = random.Random(1)
+samples = [make_npc_text(rng) for _ in range(500)]
+# Long outputs (e.g. verbose backgrounds) are where the DOTALL searches backtrack the most
+long_samples = [text.replace('Background: ', 'Background: ' + 'Lorem ipsum dolor sit amet. ' * 200)
+                for text in samples[:100]]
+
+for label, texts in (("typical", samples), ("long background", long_samples)):
+    print(f"\n{label} ({len(texts)} NPCs, avg {sum(map(len, texts)) // len(texts)} chars):")
+    results = {}
+    for name, parser in (("regex per field", legacy_parse_npc_text), ("single pass", parse_npc_text)):
+        runs = timeit.repeat(lambda: [parser(text) for text in texts], number=5, repeat=3)
+        per_npc = min(runs) / (5 * len(texts)) * 1e6
+        results[name] = per_npc
+        print(f"  {name:16} {per_npc:8.1f} µs/NPC  ({1e6 / per_npc:,.0f} NPCs/sec)")
+    print(f"  speedup: {results['regex per field'] / results['single pass']:.1f}x")
@@ -0,0 +1,53 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+# Request validation checks for the API. Every request here is refused before
+# it reaches Firestore or a model, so no cloud credentials are needed.
+
+client = TestClient(app)
+
+
+def test_npc_filters_one_at_a_time():
+    response = client.get('/npcs', params={'npc_type': 'creature', 'role': 'merchant'})
+    assert response.status_code == 400, response.text
+    assert 'npc_type' in response.json()['detail']
+
+
+def test_invalid_challenge_ratings():
+    for cr in ['1/0', '-1', '31', '1e999999']:
+        response = client.post('/generate-npc-enhanced', params={'npc_type': 'creature', 'cr': cr})
+        assert response.status_code == 400, (cr, response.text)
+        response = client.post('/encounters/evaluate', json={
+            'party_level': 3, 'monsters': [{'name': 'Nothing Like It', 'cr': cr}]
+        })
+        assert response.status_code == 400, (cr, response.text)
+
+
+def test_encounter_monster_stats_bounded():
+    for stat, value in [('attacks', 100000), ('attack_bonus', 70000), ('armor_class', 0),
+                        ('hit_points', 10 ** 9), ('damage_per_hit', 1e12)]:
+        response = client.post('/encounters/evaluate', json={
+            'party_level': 5, 'monsters': [{'cr': '1', stat: value}]
+        })
+        assert response.status_code == 422, (stat, response.text)
+
+
+def test_encounter_trials_scale_down_with_attacks():
+    response = client.post('/encounters/evaluate', json={
+        'party_level': 20, 'party_size': 10, 'trials': 20000,
+        'monsters': [{'cr': '30', 'count': 30, 'attacks': 10}]
+    })
+    assert response.status_code == 200, response.text
+    assert response.json()['simulation']['trials'] < 20000
+
+
+if __name__ == "__main__":
+    test_npc_filters_one_at_a_time()
+    print("✓ combined NPC filters refused with 400")
+    test_invalid_challenge_ratings()
+    print("✓ zero-denominator, negative and out-of-range CRs refused with 400")
+    test_encounter_monster_stats_bounded()
+    print("✓ oversized monster stats refused with 422")
+    test_encounter_trials_scale_down_with_attacks()
+    print("✓ trials reduced for encounters with many attacks")
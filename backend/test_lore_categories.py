@@ -0,0 +1,113 @@
+from google.cloud import firestore
+
+from app.services.lore_categories import increment_category, read_category_counts, rebuild_category_counts
+
+# Checks for the lore category aggregate against a small in-memory stand-in for Firestore.
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeDocument:
+    def __init__(self, docs, doc_id):
+        self._docs = docs
+        self.id = doc_id
+
+    def get(self):
+        return FakeSnapshot(self.id, self._docs.get(self.id))
+
+    def set(self, data, merge=False):
+        current = dict(self._docs.get(self.id) or {}) if merge else {}
+        self._docs[self.id] = _merge(current, data)
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def document(self, doc_id):
+        return FakeDocument(self._docs, doc_id)
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        return [FakeSnapshot(doc_id, data) for doc_id, data in self._docs.items()]
+
+
+class FakeBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+    def commit(self):
+        for ref, data, merge in self._writes:
+            ref.set(data, merge=merge)
+
+
+class FakeDB:
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return FakeCollection(self.collections.setdefault(name, {}))
+
+    def batch(self):
+        return FakeBatch()
+
+
+def _merge(current: dict, data: dict) -> dict:
+    for key, value in data.items():
+        if isinstance(value, dict):
+            current[key] = _merge(dict(current.get(key) or {}), value)
+        elif isinstance(value, firestore.Increment):
+            current[key] = current.get(key, 0) + value.value
+        else:
+            current[key] = value
+    return current
+
+
+def add_lore(db, doc_id, category):
+    batch = db.batch()
+    batch.set(db.collection('campaign_lore').document(doc_id), {'category': category})
+    increment_category(batch, db, category, 1)
+    batch.commit()
+
+
+def test_missing_aggregate_with_existing_lore():
+    # Lore written before the aggregate existed, then one more entry after deploy
+    db = FakeDB()
+    db.collection('campaign_lore').document('a').set({'category': 'history'})
+    db.collection('campaign_lore').document('b').set({'category': 'history'})
+    add_lore(db, 'c', 'places')
+    # The increment created a partial aggregate, which must not be served
+    assert read_category_counts(db) is None
+    assert rebuild_category_counts(db) == {'history': 2, 'places': 1}
+    assert read_category_counts(db) == {'history': 2, 'places': 1}
+
+
+def test_increments_after_rebuild():
+    db = FakeDB()
+    rebuild_category_counts(db)
+    add_lore(db, 'a', 'history')
+    add_lore(db, 'b', 'history')
+    batch = db.batch()
+    increment_category(batch, db, 'history', -1)
+    batch.commit()
+    assert read_category_counts(db) == {'history': 1}
+
+
+if __name__ == "__main__":
+    test_missing_aggregate_with_existing_lore()
+    print("✓ aggregate created by an increment is rebuilt before it is served")
+    test_increments_after_rebuild()
+    print("✓ increments keep a complete aggregate current")
@@ -0,0 +1,222 @@
+import random
+import re
+import string
+
+from app.utils.npc_parser import parse_npc_text, LINE_FIELDS, TEXT_SECTIONS, STATS
+
+# Property and fuzz checks for parse_npc_text. The previous regex-per-field parser is
+# kept below as the reference: on text in the generation prompt's format both must agree.
+
+
+def legacy_parse_npc_text(text: str) -> dict:
+    """The previous regex-per-field parser, kept as the reference implementation"""
+    data = {}
+    
+    # Extract basic info
+    name_match = re.search(r'NPC Name:\s*(.+?)(?:\n|$)', text)
+    if name_match:
+        data['name'] = name_match.group(1).strip()
+    
+    race_match = re.search(r'Race:\s*(.+?)(?:\n|$)', text)
+    if race_match:
+        data['race'] = race_match.group(1).strip()
+    
+    class_match = re.search(r'Class:\s*(.+?)(?:\n|$)', text)
+    if class_match:
+        data['class'] = class_match.group(1).strip()
+    
+    alignment_match = re.search(r'Alignment:\s*(.+?)(?:\n|$)', text)
+    if alignment_match:
+        data['alignment'] = alignment_match.group(1).strip()
+    
+    level_match = re.search(r'Level:\s*(.+?)(?:\n|$)', text)
+    if level_match:
+        data['level'] = level_match.group(1).strip()
+    
+    # Extract World Placement
+    world_match = re.search(r'World Placement:\s*(.+?)(?:\n\n|\nPhysical)', text, re.DOTALL)
+    if world_match:
+        data['world_placement'] = world_match.group(1).strip()
+    
+    # Extract Physical Description
+    phys_match = re.search(r'Physical Description:\s*(.+?)(?:\n\n|\nVoice)', text, re.DOTALL)
+    if phys_match:
+        data['physical_description'] = phys_match.group(1).strip()
+    
+    # Extract Voice Suggestions
+    voice_match = re.search(r'Voice Suggestions:\s*(.+?)(?:\n\n|\nPersonality)', text, re.DOTALL)
+    if voice_match:
+        data['voice_suggestions'] = voice_match.group(1).strip()
+    
+    # Extract and format Personality Traits
+    personality_match = re.search(r'Personality Traits:\s*(.+?)(?:\n\n|\nBackground)', text, re.DOTALL)
+    if personality_match:
+        traits_text = personality_match.group(1).strip()
+        traits_text = re.sub(r'\*\s+\*\*', '• ', traits_text)
+        traits_text = traits_text.replace('**', '')
+        data['personality_traits'] = traits_text
+    
+    # Extract Background
+    background_match = re.search(r'Background:\s*(.+?)(?:\n\n|\nStr:|Stat Block)', text, re.DOTALL)
+    if background_match:
+        data['background'] = background_match.group(1).strip()
+    
+    # Extract Stats
+    str_match = re.search(r'Str:\s*(\d+)', text)
+    if str_match:
+        data['str'] = str_match.group(1)
+    
+    dex_match = re.search(r'Dex:\s*(\d+)', text)
+    if dex_match:
+        data['dex'] = dex_match.group(1)
+    
+    con_match = re.search(r'Con:\s*(\d+)', text)
+    if con_match:
+        data['con'] = con_match.group(1)
+    
+    int_match = re.search(r'Int:\s*(\d+)', text)
+    if int_match:
+        data['int'] = int_match.group(1)
+    
+    wis_match = re.search(r'Wis:\s*(\d+)', text)
+    if wis_match:
+        data['wis'] = wis_match.group(1)
+    
+    cha_match = re.search(r'Cha:\s*(\d+)', text)
+    if cha_match:
+        data['cha'] = cha_match.group(1)
+    
+    # Extract Saving Throws
+    saves_match = re.search(r'Saving Throws:\s*(.+?)(?:\n|$)', text)
+    if saves_match:
+        data['saving_throws'] = saves_match.group(1).strip()
+    
+    # Extract Skills
+    skills_match = re.search(r'Skills:\s*(.+?)(?:\n|$)', text)
+    if skills_match:
+        data['skills'] = skills_match.group(1).strip()
+    
+    # Extract Senses
+    senses_match = re.search(r'Senses:\s*(.+?)(?:\n|$)', text)
+    if senses_match:
+        data['senses'] = senses_match.group(1).strip()
+    
+    # Extract Languages
+    lang_match = re.search(r'Languages:\s*(.+?)(?:\n|$)', text)
+    if lang_match:
+        data['languages'] = lang_match.group(1).strip()
+    
+    # Extract and format Abilities
+    abilities_match = re.search(r'Abilities:\s*(.+?)(?:\n\n|\nActions:)', text, re.DOTALL)
+    if abilities_match:
+        abilities_text = abilities_match.group(1).strip()
+        abilities_text = re.sub(r'\*\s+\*\*', '• ', abilities_text)
+        abilities_text = abilities_text.replace('**', '')
+        data['abilities'] = abilities_text
+    
+    # Extract and format Actions
+    actions_match = re.search(r'Actions:\s*(.+?)$', text, re.DOTALL)
+    if actions_match:
+        actions_text = actions_match.group(1).strip()
+        actions_text = re.sub(r'\*\s+\*\*', '• ', actions_text)
+        actions_text = actions_text.replace('**', '')
+        data['actions'] = actions_text
+    
+    return data
+
+KNOWN_KEYS = set(LINE_FIELDS.values()) | set(TEXT_SECTIONS.values()) | {s.lower() for s in STATS}
+
+WORDS = ["ancient", "tower", "silver", "quiet", "river", "guild", "shadow", "merchant",
+         "arcane", "oath", "stone", "lantern", "harbor", "crown", "ember", "vault"]
+
+
+def sentence(rng, min_words=3, max_words=12):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def bullets(rng):
+    return '\n'.join(f"*   **{rng.choice(WORDS).title()}:** {sentence(rng)}"
+                     for _ in range(rng.randint(1, 4)))
+
+
+def make_npc_text(rng) -> str:
+    """An NPC in the exact format the Drive generation prompt asks for (see test_parser.py)"""
+    header = [
+        f"NPC Name: {rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+        f"Race: {rng.choice(['High Elf', 'Dwarf', 'Human', 'Tiefling'])}",
+        f"Class: {rng.choice(['Wizard', 'Fighter (Champion)', 'Rogue'])}",
+        f"Alignment: {rng.choice(['Neutral Good', 'Chaotic Evil', 'Lawful Neutral'])}",
+        f"Level: {rng.randint(1, 20)}",
+        f"World Placement: {sentence(rng)}",
+    ]
+    blocks = [
+        '\n'.join(header),
+        f"Physical Description: {sentence(rng)}",
+        f"Voice Suggestions: {sentence(rng)}",
+        f"Personality Traits:\n{bullets(rng)}",
+        f"Background: {sentence(rng)} {sentence(rng)}",
+        '\n'.join(f"{stat}: {rng.randint(3, 20)}" for stat in STATS),
+        '\n'.join([
+            f"Saving Throws: Intelligence (+{rng.randint(0, 9)}), Wisdom (+{rng.randint(0, 9)})",
+            f"Skills: Arcana (+{rng.randint(0, 9)}), History (+{rng.randint(0, 9)})",
+            f"Senses: Passive Perception {rng.randint(8, 20)}",
+            "Languages: Common, Elvish",
+        ]),
+        f"Abilities:\n{bullets(rng)}",
+        f"Actions:\n{bullets(rng)}",
+    ]
+    return '\n\n'.join(blocks)
+
+
+def mutate(rng, text: str) -> str:
+    """Damage the text the way a drifting model output might"""
+    lines = text.split('\n')
+    choice = rng.randrange(5)
+    if choice == 0:
+        return text[:rng.randrange(len(text) + 1)]
+    if choice == 1:
+        rng.shuffle(lines)
+    elif choice == 2:
+        del lines[rng.randrange(len(lines))]
+    elif choice == 3:
+        lines.insert(rng.randrange(len(lines) + 1),
+                     ''.join(rng.choice(string.printable) for _ in range(rng.randint(0, 40))))
+    else:
+        lines = [f"**{line.replace(':', ':**', 1)}" if ':' in line and rng.random() < 0.5 else line
+                 for line in lines]
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    rng = random.Random(5)
+
+    # 1. Same output as the reference parser on well-formed text
+    for i in range(2000):
+        text = make_npc_text(rng)
+        assert parse_npc_text(text) == legacy_parse_npc_text(text), f"mismatch on sample {i}:\n{text}"
+    print("✓ matches the reference parser on 2000 generated NPCs")
+
+    # 2. Every field of a well-formed NPC is found
+    for i in range(200):
+        assert set(parse_npc_text(make_npc_text(rng))) == KNOWN_KEYS
+    print("✓ all fields present on well-formed NPCs")
+
+    # 3. Damaged and random input never raises and only produces known string fields
+    for i in range(5000):
+        text = make_npc_text(rng)
+        for _ in range(rng.randint(1, 4)):
+            text = mutate(rng, text)
+        parsed = parse_npc_text(text)
+        assert set(parsed) <= KNOWN_KEYS, set(parsed) - KNOWN_KEYS
+        assert all(isinstance(value, str) and value for value in parsed.values())
+        assert all(parsed[stat.lower()].isdigit() for stat in STATS if stat.lower() in parsed)
+    for i in range(2000):
+        parse_npc_text(''.join(rng.choice(string.printable) for _ in range(rng.randint(0, 400))))
+    print("✓ 7000 damaged/random inputs parsed without errors")
+
+    # 4. Markdown-bold labels parse to clean values
+    text = make_npc_text(rng).replace('NPC Name:', '**NPC Name:**').replace('Race:', '**Race**:')
+    parsed = parse_npc_text(text)
+    assert not parsed['name'].startswith('*') and not parsed['race'].startswith('*'), parsed
+    print("✓ markdown labels handled")
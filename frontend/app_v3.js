@@ -187,19 +187,29 @@ async function saveNPCToLore() {
     }
 }
 
-async function loadSavedNPCs() {
+let savedNPCsCursor = null;
+
+async function loadSavedNPCs(append = false) {
     const listDiv = document.getElementById('saved-npcs-list');
-    listDiv.innerHTML = '<div class="loading">Loading saved NPCs...</div>';
+    if (!append) {
+        savedNPCsCursor = null;
+        listDiv.innerHTML = '<div class="loading">Loading saved NPCs...</div>';
+    }
     
     try {
-        const response = await fetch(`${API_BASE_URL}/npcs`);
+        let url = `${API_BASE_URL}/npcs?fields=summary&page_size=50`;
+        if (append && savedNPCsCursor) {
+            url += `&cursor=${encodeURIComponent(savedNPCsCursor)}`;
+        }
+        const response = await fetch(url);
         const data = await response.json();
         
         if (data.npcs && data.npcs.length > 0) {
             let html = '';
             data.npcs.forEach(npc => {
-                // Extract name from content
-                const nameMatch = npc.content && npc.content.match(/\*\*(?:NPC )?Name:\*\*\s*(.+)/i) ||
+                // Prefer the stored name; older NPCs only have it inside the content
+                const nameMatch = npc.name ? [null, npc.name] :
+                                  npc.content && npc.content.match(/\*\*(?:NPC )?Name:\*\*\s*(.+)/i) ||
                                   (npc.content && npc.content.match(/# (.+)/)) ||
                                   [null, 'Unnamed NPC'];
                 const npcName = nameMatch[1] ? nameMatch[1].trim() : 'Unnamed NPC';
@@ -226,8 +236,23 @@ async function loadSavedNPCs() {
                     </div>
                 `;
             });
-            listDiv.innerHTML = html;
-        } else {
+            
+            const loadMore = document.getElementById('load-more-npcs');
+            if (loadMore) {
+                loadMore.remove();
+            }
+            if (append) {
+                listDiv.insertAdjacentHTML('beforeend', html);
+            } else {
+                listDiv.innerHTML = html;
+            }
+            
+            savedNPCsCursor = data.next_cursor;
+            if (savedNPCsCursor) {
+                listDiv.insertAdjacentHTML('beforeend',
+                    '<button id="load-more-npcs" class="load-btn" onclick="loadSavedNPCs(true)">Load more</button>');
+            }
+        } else if (!append) {
             listDiv.innerHTML = '<div class="no-results">No saved NPCs found. Generate some NPCs above!</div>';
         }
         
@@ -851,19 +876,27 @@ async function generateMap() {
     `;
     
     try {
+        // Maps run as background jobs so the request doesn't hit the server timeout
         const response = await fetch(
-            `${API_BASE_URL}/generate-map?description=${encodeURIComponent(description)}&rows=${rows}&columns=${columns}&style=${encodeURIComponent(style)}&show_grid=${showGrid}`,
+            `${API_BASE_URL}/generate-map?description=${encodeURIComponent(description)}&rows=${rows}&columns=${columns}&style=${encodeURIComponent(style)}&show_grid=${showGrid}&background=true`,
             { method: 'POST' }
         );
         
-        const data = await response.json();
+        const job = await response.json();
+        const data = await waitForJob(job, (progress, message) => {
+            const subtext = resultDiv.querySelector('.loading-subtext');
+            if (subtext) {
+                subtext.textContent = `${message || 'Working'}... (${Math.round(progress)}%)`;
+            }
+        });
         
         if (data.success) {
+            const imageSrc = data.image_base64 ? `data:image/png;base64,${data.image_base64}` : data.image_url;
             resultDiv.innerHTML = `
                 <div class="map-display">
                     <h3>✨ Generated Battle Map</h3>
                     <div class="map-image-container">
-                        <img src="data:image/png;base64,${data.image_base64}" alt="Generated Map" class="generated-map" />
+                        <img src="${imageSrc}" alt="Generated Map" class="generated-map" />
                     </div>
                     <div class="map-actions">
                         <a href="${data.image_url}" download="battle_map.png" class="download-btn">📥 Download PNG</a>
@@ -882,6 +915,34 @@ async function generateMap() {
     }
 }
 
+// Follow a background job's progress events and resolve with its result
+function waitForJob(job, onProgress) {
+    return new Promise((resolve, reject) => {
+        if (!job.job_id) {
+            reject(new Error(job.detail || 'Failed to start job'));
+            return;
+        }
+        const events = new EventSource(`${API_BASE_URL}${job.events_url}`);
+        events.addEventListener('progress', (e) => {
+            const status = JSON.parse(e.data);
+            if (onProgress) onProgress(status.progress, status.message);
+        });
+        events.addEventListener('done', (e) => {
+            events.close();
+            const status = JSON.parse(e.data);
+            if (status.status === 'succeeded') {
+                resolve(status.result);
+            } else {
+                reject(new Error(status.error || 'Job failed'));
+            }
+        });
+        events.onerror = () => {
+            events.close();
+            reject(new Error('Lost connection while waiting for job'));
+        };
+    });
+}
+
 function copyMapUrl(url) {
     navigator.clipboard.writeText(url).then(() => {
         alert('✅ Map URL copied to clipboard!');